@@ -0,0 +1,102 @@
+"""Benchmark date filtering and timestamp parsing.
+
+Compares the vectorized ``filter_run_dates`` and ``parse_timestamps`` with the
+per-run ``isoparse`` loop that they replaced, on synthetic runs.
+
+Usage::
+
+    python benchmarks/bench_dates.py --runs 1000000
+"""
+import argparse
+import time
+from datetime import date
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+
+import pandas as pd
+from dateutil.parser import isoparse
+
+from roarquery.dtypes import parse_timestamps
+from roarquery.runs import filter_run_dates
+
+
+def make_runs(n_runs: int) -> List[Dict[str, Any]]:
+    """Return synthetic fuego run documents spread over seven years."""
+    start = datetime(2017, 1, 1, tzinfo=timezone.utc)
+    runs = []
+    for idx in range(n_runs):
+        started = start + timedelta(minutes=idx * 3_679_200 // max(n_runs, 1))
+        timestamp = started.strftime("%Y-%m-%dT%H:%M:%S.%f")[:-3] + "Z"
+        runs.append(
+            {
+                "CreateTime": timestamp,
+                "Data": {"timeStarted": timestamp, "timeFinished": timestamp},
+                "ID": f"run-{idx}",
+                "Path": f"prod/roar-prod/users/u-{idx % 1000}/runs/run-{idx}",
+                "UpdateTime": timestamp,
+            }
+        )
+    return runs
+
+
+def isoparse_filter(
+    runs: List[Dict[str, Any]], started_before: date, started_after: date
+) -> List[Dict[str, Any]]:
+    """Filter runs the old way, with one isoparse call per run and bound."""
+    before = datetime(*started_before.timetuple()[:3]).astimezone()
+    after = datetime(*started_after.timetuple()[:3]).astimezone()
+    runs = [run for run in runs if isoparse(run["Data"]["timeStarted"]) < before]
+    return [run for run in runs if isoparse(run["Data"]["timeStarted"]) > after]
+
+
+def isoparse_columns(df: pd.DataFrame) -> pd.DataFrame:
+    """Parse timestamp columns the old way, one value at a time."""
+    df = df.copy()
+    for column in ["CreateTime", "timeStarted", "timeFinished"]:
+        df[column] = df[column].map(isoparse)
+    return df
+
+
+def timeit(func: Callable[[], Any]) -> float:
+    """Return the wall time of one call, in seconds."""
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    """Run the benchmark and print the timings."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    runs = make_runs(args.runs)
+    bounds = dict(started_before=date(2024, 1, 1), started_after=date(2021, 1, 1))
+    assert isoparse_filter(runs, **bounds) == filter_run_dates(runs, **bounds)
+
+    df = pd.DataFrame([dict(run["Data"], CreateTime=run["CreateTime"]) for run in runs])
+
+    results = {
+        "filter_run_dates": (
+            timeit(lambda: isoparse_filter(runs, **bounds)),
+            timeit(lambda: filter_run_dates(runs, **bounds)),
+        ),
+        "parse_timestamps": (
+            timeit(lambda: isoparse_columns(df)),
+            timeit(lambda: parse_timestamps(df)),
+        ),
+    }
+
+    print(f"{args.runs:,} runs")
+    print(f"{'':<20}{'isoparse':>12}{'vectorized':>12}{'speedup':>10}")
+    for name, (before, after) in results.items():
+        print(f"{name:<20}{before:>11.2f}s{after:>11.2f}s{before / after:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,82 @@
+"""Benchmark decoding of fuego output.
+
+Compares each installed JSON decoder in ``roarquery.decoding`` with the old
+path, which decoded the bytes to ``str`` before calling ``json.loads``, on the
+mock fuego output from the test suite scaled up to many documents.
+
+Usage::
+
+    python benchmarks/bench_decode.py --documents 100000 --repeat 5
+"""
+import argparse
+import json
+import sys
+import time
+from pathlib import Path
+from typing import Any
+from typing import Callable
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from roarquery.decoding import available_decoders  # noqa: E402
+from roarquery.decoding import decode_page  # noqa: E402
+from roarquery.decoding import set_json_decoder  # noqa: E402
+from tests.mock_bytes import RUNS_BYTES  # noqa: E402
+from tests.mock_bytes import TRIALS_1_BYTES  # noqa: E402
+from tests.mock_bytes import TRIALS_4_BYTES  # noqa: E402
+
+
+def make_output(n_documents: int) -> bytes:
+    """Return fuego output with ``n_documents`` copies of the mock documents."""
+    documents = [
+        *json.loads(RUNS_BYTES),
+        *json.loads(TRIALS_1_BYTES),
+        *json.loads(TRIALS_4_BYTES),
+    ]
+    scaled = [documents[idx % len(documents)] for idx in range(n_documents)]
+    return json.dumps(scaled, indent=2).encode("utf-8")
+
+
+def decode_str(output: bytes) -> Any:
+    """Decode fuego output the old way, through ``str``."""
+    return json.loads(output.decode("utf-8"))
+
+
+def timeit(func: Callable[[bytes], Any], output: bytes, repeat: int) -> float:
+    """Return the best wall time of ``repeat`` calls, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(output)
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    """Run the benchmark and print the timings."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--documents", type=int, default=100_000)
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    output = make_output(args.documents)
+    expected = decode_str(output)
+    baseline = timeit(decode_str, output, args.repeat)
+
+    print(f"{args.documents:,} documents, {len(output) / 2**20:.1f} MiB")
+    print(f"{'decoder':<18}{'time':>10}{'speedup':>10}")
+    print(f"{'str + json':<18}{baseline:>9.3f}s{1:>9.1f}x")
+    for name in available_decoders():
+        set_json_decoder(name, validate=False)
+        assert decode_page(output) == expected
+        elapsed = timeit(decode_page, output, args.repeat)
+        print(f"{name:<18}{elapsed:>9.3f}s{baseline / elapsed:>9.1f}x")
+
+        set_json_decoder(name, validate=True)
+        elapsed = timeit(decode_page, output, args.repeat)
+        label = f"{name} + validate"
+        print(f"{label:<18}{elapsed:>9.3f}s{baseline / elapsed:>9.1f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Benchmark flattening of the nested assigningOrgs and scores run fields.
+
+Compares ``normalize_runs``, which flattens the raw run dicts in one pass
+before the DataFrame is built, with the row-wise ``apply(pd.Series)`` and
+``json_normalize`` expansion that it replaced.
+
+Usage::
+
+    python benchmarks/bench_normalize.py --runs 100000
+"""
+import argparse
+import copy
+import time
+from functools import partial
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+
+import pandas as pd
+from pandas import json_normalize
+
+from roarquery.runs import NESTED_RUN_FIELDS
+from roarquery.runs import normalize_runs
+
+
+def make_runs(n_runs: int) -> List[Dict[str, Any]]:
+    """Return synthetic run data with nested orgs and scores."""
+    return [
+        {
+            "taskId": "swr",
+            "variantId": f"variant-{idx % 7}",
+            "completed": True,
+            "timeStarted": "2024-01-01T00:00:00Z",
+            "assigningOrgs": {
+                "districts": [f"district-{idx % 5}"],
+                "schools": [f"school-{idx % 50}", f"school-{idx % 51}"],
+                "classes": [f"class-{idx % 500}"],
+                "groups": [],
+            },
+            "scores": {
+                "computed": {"composite": idx % 100, "thetaEstimate": idx / 1000},
+                "raw": {"composite": {"test": {"numCorrect": idx % 20}}},
+            },
+            "CreateTime": "2024-01-01T00:00:00Z",
+            "runId": f"run-{idx}",
+        }
+        for idx in range(n_runs)
+    ]
+
+
+def expand_rowwise(runs: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Expand the nested fields the old way, after building the DataFrame."""
+    df_runs = pd.DataFrame(runs).set_index("runId")
+    expanded_columns = df_runs["assigningOrgs"].apply(
+        partial(pd.Series, dtype="object")
+    )
+    df_runs = pd.concat(
+        [
+            df_runs.drop("assigningOrgs", axis=1),
+            expanded_columns.add_prefix("assigningOrgs."),
+        ],
+        axis=1,
+    )
+    expanded_df = json_normalize(df_runs["scores"])
+    expanded_df["runId"] = df_runs.index
+    expanded_df.set_index("runId", inplace=True, drop=True)
+    return pd.concat(
+        [df_runs.drop("scores", axis=1), expanded_df.add_prefix("scores.")], axis=1
+    )
+
+
+def flatten_first(runs: List[Dict[str, Any]]) -> pd.DataFrame:
+    """Flatten the nested fields before building the DataFrame."""
+    return normalize_runs(runs, NESTED_RUN_FIELDS).set_index("runId")
+
+
+def timeit(func: Callable[[List[Dict[str, Any]]], Any], n_runs: int) -> float:
+    """Return the wall time of one call on fresh runs, in seconds."""
+    runs = make_runs(n_runs)
+    start = time.perf_counter()
+    func(runs)
+    return time.perf_counter() - start
+
+
+def main() -> None:
+    """Run the benchmark and print the timings."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=100_000)
+    args = parser.parse_args()
+
+    runs = make_runs(1000)
+    assert flatten_first(copy.deepcopy(runs)).equals(expand_rowwise(runs))
+
+    before = timeit(expand_rowwise, args.runs)
+    after = timeit(flatten_first, args.runs)
+    print(f"{args.runs:,} runs")
+    print(f"row-wise expansion: {before:.2f}s")
+    print(f"normalize_runs:     {after:.2f}s ({before / after:.1f}x faster)")
+
+
+if __name__ == "__main__":
+    main()
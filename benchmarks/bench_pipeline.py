@@ -0,0 +1,351 @@
+r"""Benchmark the query pipeline end to end against a simulated fuego.
+
+Each scenario runs in a fresh interpreter against a synthetic database of
+``--users`` users with ``--runs-per-user`` runs of ``--trials-per-run``
+trials each, served by a ``LocalBackend`` that sleeps ``--latency`` seconds
+per call to stand in for the fuego subprocess and the network. With
+``--fake-fuego``, the dataset is saved to disk and served by real fuego
+subprocesses running ``benchmarks/bin/fuego`` instead. For every scenario the
+wall time, number of fuego calls, bytes received, peak RSS and rows per
+second are reported.
+
+Usage::
+
+    python benchmarks/bench_pipeline.py --users 50 --runs-per-user 4 \\
+        --trials-per-run 50 --latency 0.05 --workers 8
+
+or, with nox::
+
+    nox -s benchmarks -- --latency 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import resource
+import subprocess  # nosec
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime
+from datetime import timedelta
+from datetime import timezone
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Tuple
+
+from roarquery.__main__ import main as cli
+from roarquery.backends import format_timestamp
+from roarquery.backends import FuegoBackend
+from roarquery.backends import LocalBackend
+from roarquery.backends import use_backend
+from roarquery.runs import get_runs
+from roarquery.runs import get_runs_async
+from roarquery.runs import get_runs_compat
+from roarquery.shards import value_shards
+from roarquery.utils import page_results
+
+
+BIN_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "bin")
+LEGACY_ROOT = "prod/roar-prod"
+TASKS = ["swr", "sre", "pa"]
+
+
+class SimulatedFuego(LocalBackend):
+    """A local backend that adds latency and counts calls and bytes."""
+
+    def __init__(self, latency: float = 0.0) -> None:
+        """Initialize an empty database."""
+        super().__init__()
+        self.latency = latency
+        self.calls = 0
+        self.bytes = 0
+        self._lock = threading.Lock()
+
+    def run(self, query: List[str]) -> bytes:
+        """Answer a fuego command after the simulated latency."""
+        time.sleep(self.latency)
+        output = super().run(query)
+        with self._lock:
+            self.calls += 1
+            self.bytes += len(output)
+        return output
+
+
+def make_dataset(args: argparse.Namespace, legacy: bool) -> SimulatedFuego:
+    """Fill a simulated database with synthetic users, runs and trials."""
+    backend = SimulatedFuego(args.latency)
+    start = datetime(2023, 1, 1, tzinfo=timezone.utc)
+    users = f"{LEGACY_ROOT}/users" if legacy else "users"
+
+    run_idx = 0
+    for user_idx in range(args.users):
+        user_path = f"{users}/user-{user_idx:06d}"
+        backend.add_document(
+            user_path,
+            {
+                "grade": str(user_idx % 12),
+                "userType": "student",
+                "districts": {"current": [f"district-{user_idx % 3}"]},
+            },
+        )
+        for _ in range(args.runs_per_user):
+            timestamp = format_timestamp(start + timedelta(minutes=run_idx))
+            data: Dict[str, Any] = {
+                "taskId": TASKS[run_idx % len(TASKS)],
+                "variantId": f"variant-{run_idx % 4}",
+                "completed": True,
+                "timeStarted": timestamp,
+                "timeFinished": timestamp,
+            }
+            if legacy:
+                data.update(
+                    districtId=f"district-{user_idx % 3}",
+                    schoolId=f"school-{user_idx % 10}",
+                    classId=f"class-{user_idx % 50}",
+                    studyId="study-1",
+                )
+            else:
+                data.update(
+                    assigningOrgs={
+                        "districts": [f"district-{user_idx % 3}"],
+                        "schools": [f"school-{user_idx % 10}"],
+                        "classes": [f"class-{user_idx % 50}"],
+                        "groups": [],
+                    },
+                    scores={"computed": {"composite": run_idx % 100}},
+                )
+
+            run_path = f"{user_path}/runs/run-{run_idx:08d}"
+            backend.add_document(run_path, data, timestamp)
+            for trial_idx in range(args.trials_per_run):
+                backend.add_document(
+                    f"{run_path}/trials/trial-{trial_idx:05d}",
+                    {
+                        "correct": trial_idx % 2,
+                        "item": f"item-{trial_idx % 40}",
+                        "rt": 500 + trial_idx,
+                    },
+                    timestamp,
+                )
+            run_idx += 1
+
+    return backend
+
+
+def _page_results(args: argparse.Namespace) -> int:
+    return len(page_results(["fuego", "query", "-g", "runs"]))
+
+
+def _get_runs(args: argparse.Namespace) -> int:
+    return len(get_runs(max_workers=args.workers))
+
+
+def _get_runs_sharded(args: argparse.Namespace) -> int:
+    shards = value_shards("taskId", TASKS)
+    return len(get_runs(max_workers=args.workers, shards=shards))
+
+
+def _get_runs_trials(args: argparse.Namespace) -> int:
+    return len(get_runs(return_trials=True, max_workers=args.workers))
+
+
+def _get_runs_scan_trials(args: argparse.Namespace) -> int:
+    # Every synthetic trial is scored 0 or 1.
+    conditions = ["correct <in> [0, 1]"]
+    return len(
+        get_runs(
+            return_trials=True, max_workers=args.workers, trial_conditions=conditions
+        )
+    )
+
+
+def _get_runs_async_trials(args: argparse.Namespace) -> int:
+    return len(
+        asyncio.run(get_runs_async(return_trials=True, max_concurrency=args.workers))
+    )
+
+
+def _get_runs_compat_trials(args: argparse.Namespace) -> int:
+    return len(
+        get_runs_compat(
+            root_doc=LEGACY_ROOT, return_trials=True, max_workers=args.workers
+        )
+    )
+
+
+def _cli_export(args: argparse.Namespace) -> int:
+    with tempfile.TemporaryDirectory() as tmpdir:
+        output = os.path.join(tmpdir, "trials.csv")
+        cli(
+            ["runs", "--return-trials", f"--workers={args.workers}", output],
+            standalone_mode=False,
+        )
+        with open(output) as fp:
+            return sum(1 for _ in fp) - 1
+
+
+# Each scenario: whether it uses the legacy layout, and what it runs.
+SCENARIOS: Dict[str, Tuple[bool, Callable[[argparse.Namespace], int]]] = {
+    "page_results": (False, _page_results),
+    "get_runs": (False, _get_runs),
+    "get_runs sharded": (False, _get_runs_sharded),
+    "get_runs trials": (False, _get_runs_trials),
+    "get_runs scan trials": (False, _get_runs_scan_trials),
+    "get_runs_async trials": (False, _get_runs_async_trials),
+    "get_runs_compat trials": (True, _get_runs_compat_trials),
+    "cli export": (False, _cli_export),
+}
+
+
+def _peak_rss_mib() -> float:
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    return peak / 2**20 if sys.platform == "darwin" else peak / 2**10
+
+
+def _run_with_fake_fuego(
+    backend: SimulatedFuego,
+    func: Callable[[argparse.Namespace], int],
+    args: argparse.Namespace,
+) -> Tuple[int, float, int, int]:
+    """Run a scenario through fuego subprocesses served by the fake fuego."""
+    with tempfile.TemporaryDirectory() as tmpdir:
+        backend.save(os.path.join(tmpdir, "db"))
+        log_path = os.path.join(tmpdir, "calls.jsonl")
+        os.environ.update(
+            PATH=f"{BIN_DIR}{os.pathsep}{os.environ['PATH']}",
+            PYTHON=sys.executable,
+            FAKE_FUEGO_ROOT=os.path.join(tmpdir, "db"),
+            FAKE_FUEGO_LATENCY=str(args.latency),
+            FAKE_FUEGO_LOG=log_path,
+        )
+        with use_backend(FuegoBackend()):
+            start = time.perf_counter()
+            rows = func(args)
+            elapsed = time.perf_counter() - start
+
+        with open(log_path) as fp:
+            calls = [json.loads(line) for line in fp]
+
+    return rows, elapsed, len(calls), sum(call["bytes"] for call in calls)
+
+
+def run_scenario(name: str, args: argparse.Namespace) -> Dict[str, Any]:
+    """Run one scenario in this interpreter and return its measurements."""
+    legacy, func = SCENARIOS[name]
+    backend = make_dataset(args, legacy)
+    # Build the backend's index before timing.
+    backend.run(["fuego", "query", "--limit", "1", "-g", "runs"])
+    backend.calls = backend.bytes = 0
+    rss_before = _peak_rss_mib()
+
+    if args.fake_fuego:
+        rows, elapsed, calls, n_bytes = _run_with_fake_fuego(backend, func, args)
+    else:
+        with use_backend(backend):
+            start = time.perf_counter()
+            rows = func(args)
+            elapsed = time.perf_counter() - start
+        calls, n_bytes = backend.calls, backend.bytes
+
+    return {
+        "scenario": name,
+        "seconds": elapsed,
+        "fuego_calls": calls,
+        "mib_received": n_bytes / 2**20,
+        "peak_rss_mib": _peak_rss_mib(),
+        "rss_growth_mib": _peak_rss_mib() - rss_before,
+        "rows": rows,
+        "rows_per_second": rows / elapsed,
+    }
+
+
+def parse_args() -> argparse.Namespace:
+    """Parse the command line."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--runs-per-user", type=int, default=4)
+    parser.add_argument("--trials-per-run", type=int, default=50)
+    parser.add_argument(
+        "--latency", type=float, default=0.0, help="Seconds added to each call."
+    )
+    parser.add_argument("--workers", type=int, default=4)
+    parser.add_argument(
+        "--fake-fuego",
+        action="store_true",
+        help="Run real fuego subprocesses, served by benchmarks/bin/fuego.",
+    )
+    parser.add_argument(
+        "--scenario",
+        action="append",
+        choices=list(SCENARIOS),
+        help="Run only this scenario. May be repeated.",
+    )
+    parser.add_argument(
+        "--json", dest="json_path", help="Also write the results to this file."
+    )
+    parser.add_argument("--child", action="store_true", help=argparse.SUPPRESS)
+    return parser.parse_args()
+
+
+def main() -> None:
+    """Run each scenario in a fresh interpreter and print the results."""
+    args = parse_args()
+    scenarios = args.scenario or list(SCENARIOS)
+
+    if args.child:
+        print(json.dumps(run_scenario(scenarios[0], args)))
+        return
+
+    env = {
+        key: value
+        for key, value in os.environ.items()
+        if key not in ("ROAR_QUERY_BACKEND", "ROAR_QUERY_CACHE_DIR")
+    }
+    argv = [
+        f"--users={args.users}",
+        f"--runs-per-user={args.runs_per_user}",
+        f"--trials-per-run={args.trials_per_run}",
+        f"--latency={args.latency}",
+        f"--workers={args.workers}",
+    ]
+    if args.fake_fuego:
+        argv.append("--fake-fuego")
+
+    print(
+        f"{args.users} users x {args.runs_per_user} runs x "
+        f"{args.trials_per_run} trials, {args.latency * 1000:.0f} ms per call, "
+        f"{args.workers} workers"
+    )
+    print(
+        f"{'scenario':<24}{'seconds':>9}{'calls':>8}{'MiB in':>9}"
+        f"{'peak RSS':>10}{'rows':>9}{'rows/s':>10}"
+    )
+    results = []
+    for name in scenarios:
+        output = subprocess.run(  # nosec
+            [sys.executable, __file__, *argv, "--child", f"--scenario={name}"],
+            capture_output=True,
+            check=True,
+            env=env,
+            text=True,
+        ).stdout
+        result = json.loads(output.splitlines()[-1])
+        results.append(result)
+        print(
+            f"{name:<24}{result['seconds']:>9.2f}{result['fuego_calls']:>8}"
+            f"{result['mib_received']:>9.1f}{result['peak_rss_mib']:>9.0f}M"
+            f"{result['rows']:>9}{result['rows_per_second']:>10.0f}"
+        )
+
+    if args.json_path is not None:
+        with open(args.json_path, "w") as fp:
+            json.dump(results, fp, indent=2)
+
+
+if __name__ == "__main__":
+    main()
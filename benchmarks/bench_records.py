@@ -0,0 +1,80 @@
+"""Benchmark the memory held by fuego trial documents.
+
+Compares keeping every decoded trial as the dict that fuego prints with
+keeping it as a ``FuegoRecord`` without the ``ReadTime`` and ``UpdateTime``
+fields that ``get_runs`` does not use.
+
+Usage::
+
+    python benchmarks/bench_records.py --trials 200000
+"""
+import argparse
+import json
+import tracemalloc
+from typing import Any
+from typing import Callable
+from typing import List
+
+from roarquery.decoding import decode_page
+from roarquery.runs import TRIAL_DROPPED_FIELDS
+from roarquery.utils import FuegoRecord
+
+
+def make_output(n_trials: int, trials_per_run: int = 100) -> bytes:
+    """Return fuego output for ``n_trials`` trials of synthetic runs."""
+    timestamp = "2024-01-01T00:00:00.123456Z"
+    docs = [
+        {
+            "CreateTime": timestamp,
+            "Data": {"correct": idx % 2, "item": f"item-{idx % 40}", "rt": idx % 997},
+            "ID": f"trial-{idx}",
+            "Path": (
+                f"prod/roar-prod/users/user-{idx // 1000}/runs/"
+                f"run-{idx // trials_per_run}/trials/trial-{idx}"
+            ),
+            "ReadTime": timestamp,
+            "UpdateTime": timestamp,
+        }
+        for idx in range(n_trials)
+    ]
+    return json.dumps(docs).encode("utf-8")
+
+
+def as_dicts(output: bytes) -> List[Any]:
+    """Keep the decoded documents as they are."""
+    return list(decode_page(output))
+
+
+def as_records(output: bytes) -> List[Any]:
+    """Keep the decoded documents as compact records."""
+    return [
+        FuegoRecord.from_json(doc, TRIAL_DROPPED_FIELDS) for doc in decode_page(output)
+    ]
+
+
+def retained(func: Callable[[bytes], List[Any]], output: bytes) -> int:
+    """Return the number of bytes still allocated by the result of ``func``."""
+    tracemalloc.start()
+    result = func(output)
+    size, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def main() -> None:
+    """Run the benchmark and print the memory use."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--trials", type=int, default=200_000)
+    args = parser.parse_args()
+
+    output = make_output(args.trials)
+    before = retained(as_dicts, output)
+    after = retained(as_records, output)
+    print(f"{args.trials:,} trials")
+    print(f"dicts:   {before / 2**20:8.1f} MiB")
+    print(f"records: {after / 2**20:8.1f} MiB ({1 - after / before:.0%} smaller)")
+
+
+if __name__ == "__main__":
+    main()
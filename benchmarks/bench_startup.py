@@ -0,0 +1,54 @@
+"""Benchmark the startup time of the roarquery command.
+
+Runs ``roarquery --help`` and other commands that do not query Firestore in
+fresh interpreters and reports the median wall time, next to the time to
+import pandas, which the commands used to load on startup.
+
+Usage::
+
+    python benchmarks/bench_startup.py --repeat 10
+"""
+import argparse
+import statistics
+import subprocess  # nosec
+import sys
+import time
+from typing import List
+
+
+COMMANDS = {
+    "roarquery --help": ["-m", "roarquery", "--help"],
+    "roarquery --version": ["-m", "roarquery", "--version"],
+    "roarquery runs --help": ["-m", "roarquery", "runs", "--help"],
+    "import roarquery": ["-c", "import roarquery"],
+    "import pandas": ["-c", "import pandas"],
+}
+
+
+def median_time(args: List[str], repeat: int) -> float:
+    """Return the median wall time of running python with ``args``, in seconds."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        subprocess.run(  # nosec
+            [sys.executable, *args], check=True, stdout=subprocess.DEVNULL
+        )
+        times.append(time.perf_counter() - start)
+    return statistics.median(times)
+
+
+def main() -> None:
+    """Run the benchmark and print the timings."""
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    baseline = median_time(["-c", "pass"], args.repeat)
+    print(f"{'command':<24}{'median':>10}{'over python':>14}")
+    for name, command in COMMANDS.items():
+        elapsed = median_time(command, args.repeat)
+        print(f"{name:<24}{elapsed:>9.3f}s{elapsed - baseline:>13.3f}s")
+
+
+if __name__ == "__main__":
+    main()
@@ -139,6 +139,13 @@ def tests(session: Session) -> None:
             session.notify("coverage", posargs=[])
 
 
+@session(python=python_versions[0])
+def benchmarks(session: Session) -> None:
+    """Benchmark the query pipeline against a simulated fuego."""
+    session.install(".")
+    session.run("python", "benchmarks/bench_pipeline.py", *session.posargs)
+
+
 @session
 def coverage(session: Session) -> None:
     """Produce the coverage report."""
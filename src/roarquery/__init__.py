@@ -1,2 +1,36 @@
 """Roarquery."""
-from .runs import get_runs  # noqa: F401
+from typing import Any
+from typing import List
+
+
+__all__ = ["get_runs", "get_runs_async", "get_runs_iter", "get_trials_iter"]
+
+
+def __getattr__(name: str) -> Any:
+    """Import the ``get_runs`` functions on first use, since they load pandas.
+
+    Parameters
+    ----------
+    name : str
+        The attribute to look up.
+
+    Returns
+    -------
+    Any
+        The attribute.
+
+    Raises
+    ------
+    AttributeError
+        If the package has no such attribute.
+    """
+    if name in __all__:
+        from . import runs
+
+        return getattr(runs, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+def __dir__() -> List[str]:
+    """List the module attributes, including the lazily imported ones."""
+    return sorted(list(globals()) + __all__)
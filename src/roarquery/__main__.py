@@ -1,11 +1,610 @@
 """Command-line interface."""
-from datetime import date
+import json
+from contextlib import contextmanager
+from contextlib import ExitStack
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import TypeVar
 
 import click
 
-from .runs import get_runs
-from .runs import get_runs_compat
+from .backends import Backend
+from .backends import make_backend
+from .backends import use_backend
+from .cache import ResponseCache
+from .cache import use_response_cache
+from .checkpoint import Checkpoint
+from .checkpoint import use_checkpoint
+from .metrics import Metrics
+from .metrics import Trace
+from .metrics import use_metrics
+from .metrics import use_trace
+from .retry import RetryPolicy
+from .retry import use_retry_policy
+from .shards import make_shards
+from .shards import Shard
+from .users import UserResolver
 from .utils import camel_case
+from .utils import use_page_size
+from .writers import FORMATS
+
+
+# The commands import runs, sync and writers.open_writer when they run, since
+# they load pandas, which would otherwise slow down every invocation,
+# including --help and --version.
+
+
+QUERY_OPTIONS = [
+    click.option(
+        "--legacy",
+        is_flag=True,
+        show_default=True,
+        default=False,
+        help="Return trials from the legacy database",
+    ),
+    click.option(
+        "--roar-uid", type=str, help="Return only runs for the user with this ROAR UID."
+    ),
+    click.option(
+        "--pid-prefix", type=str, help="Return only runs for users with this prefix."
+    ),
+    click.option("--task-id", type=str, help="Return only runs for this task."),
+    click.option(
+        "--study-id",
+        type=str,
+        help="Return only runs for this study. Only supported in the legacy database.",
+    ),
+    click.option("--variant-id", type=str, help="Return only runs for this variant."),
+    click.option("--district-id", type=str, help="Return only runs for this district."),
+    click.option("--school-id", type=str, help="Return only runs for this school."),
+    click.option("--class-id", type=str, help="Return only runs with this class."),
+    click.option(
+        "--group-id",
+        type=str,
+        help="Return only runs with this group. Only supported in the current database.",
+    ),
+    click.option(
+        "--require-completed",
+        is_flag=True,
+        show_default=True,
+        default=False,
+        help="Require all runs to be completed.",
+    ),
+    click.option(
+        "--started-before",
+        type=click.DateTime(formats=["%Y-%m-%d"]),
+        help="Return only runs started before this date. Format: YYYY-MM-DD.",
+    ),
+    click.option(
+        "--started-after",
+        type=click.DateTime(formats=["%Y-%m-%d"]),
+        help="Return only runs started after this date. Format: YYYY-MM-DD.",
+    ),
+    click.option(
+        "--return-trials",
+        is_flag=True,
+        default=False,
+        help="Return the trials for each run as well.",
+    ),
+    click.option(
+        "--scan-trials",
+        is_flag=True,
+        default=False,
+        help=(
+            "With --return-trials, fetch the trials with one scan of the trials "
+            "collection group, narrowed by --trial-condition, rather than one "
+            "query per run. Requires at least one --trial-condition."
+        ),
+    ),
+    click.option(
+        "--trial-condition",
+        "trial_conditions",
+        type=str,
+        multiple=True,
+        help=(
+            "An equality condition that every trial of the requested runs "
+            "satisfies, e.g. 'taskId == \"swr\"'. May be repeated. Implies "
+            "--scan-trials."
+        ),
+    ),
+    click.option(
+        "--root-doc",
+        type=str,
+        default="prod/roar-prod",
+        help="The Firestore root document. Returned runs will all be under this document.",
+    ),
+    click.option(
+        "--workers",
+        type=click.IntRange(min=1),
+        default=1,
+        show_default=True,
+        help="The number of runs whose trials are fetched concurrently.",
+    ),
+    click.option(
+        "--skip-failed-runs",
+        is_flag=True,
+        default=False,
+        help=(
+            "Leave out the runs whose trials cannot be fetched, and list them, "
+            "rather than failing the whole export."
+        ),
+    ),
+    click.option(
+        "--shard-by",
+        type=str,
+        help=(
+            "Split the runs query into shards that are paginated --workers at a "
+            "time: 'date:N' (N windows between --started-after and "
+            "--started-before), 'task:ID,ID,...' (one shard per task ID) or "
+            "'path:PATH,PATH,...' (ranges of run paths split at these runs, "
+            "without a date range)."
+        ),
+    ),
+    click.option(
+        "--user-cache",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Persist fetched user documents to this file and reuse them on later runs.",
+    ),
+    click.option(
+        "--user-cache-ttl",
+        type=click.FloatRange(min=0),
+        default=24.0,
+        show_default=True,
+        help="The number of hours for which persisted user documents are reused.",
+    ),
+    click.option(
+        "--cache-dir",
+        type=click.Path(file_okay=False, writable=True),
+        envvar="ROAR_QUERY_CACHE_DIR",
+        help=(
+            "Cache fuego responses in this directory and reuse them for up to a day. "
+            "Defaults to the ROAR_QUERY_CACHE_DIR environment variable."
+        ),
+    ),
+    click.option(
+        "--no-cache",
+        is_flag=True,
+        default=False,
+        help="Do not read or write the response cache.",
+    ),
+    click.option(
+        "--refresh",
+        is_flag=True,
+        default=False,
+        help="Ignore cached responses, but store the fresh ones in the cache.",
+    ),
+    click.option(
+        "--page-size",
+        type=click.IntRange(min=1),
+        default=100,
+        show_default=True,
+        help="The number of documents requested in the first page of each query.",
+    ),
+    click.option(
+        "--max-page-size",
+        type=click.IntRange(min=1),
+        default=None,
+        help=(
+            "The largest page size. If given, pages grow toward this size while "
+            "they are fast and small, and shrink when they are slow or large. "
+            "By default, every page has --page-size documents. Adaptive pages "
+            "may differ between runs, so they make cached pages less reusable."
+        ),
+    ),
+    click.option(
+        "--backend",
+        type=str,
+        envvar="ROAR_QUERY_BACKEND",
+        help=(
+            "How fuego commands are executed: 'fuego' (the fuego binary, the "
+            "default), 'firestore' (in-process with google-cloud-firestore) or "
+            "'local:DIRECTORY' (JSON documents on disk). Defaults to the "
+            "ROAR_QUERY_BACKEND environment variable."
+        ),
+    ),
+    click.option(
+        "--retries",
+        type=click.IntRange(min=0),
+        default=3,
+        show_default=True,
+        help=(
+            "The number of times a failed fuego call is retried, after "
+            "exponentially growing, randomized delays."
+        ),
+    ),
+    click.option(
+        "--checkpoint-dir",
+        type=click.Path(file_okay=False, writable=True),
+        help=(
+            "Save every page of every query in this directory, so that an "
+            "interrupted query can continue with --resume."
+        ),
+    ),
+    click.option(
+        "--resume",
+        is_flag=True,
+        default=False,
+        help=(
+            "Continue from the pages saved in --checkpoint-dir instead of "
+            "starting over."
+        ),
+    ),
+    click.option(
+        "--parse-timestamps",
+        is_flag=True,
+        default=False,
+        help=(
+            "Write CreateTime, timeStarted, timeFinished, etc. as UTC datetimes "
+            "rather than the ISO strings returned by Firestore."
+        ),
+    ),
+    click.option(
+        "--compact-dtypes",
+        is_flag=True,
+        default=False,
+        help=(
+            "Store low-cardinality strings (taskId, grade, ...) as categories, "
+            "booleans as booleans and numbers in the smallest type that holds "
+            "them, and report the memory saved."
+        ),
+    ),
+    click.option(
+        "--stats",
+        is_flag=True,
+        default=False,
+        help=(
+            "Report the time spent in each phase (fuego calls, decoding, "
+            "filtering, building DataFrames, merging users, writing), the number "
+            "of fuego calls, bytes and documents received, and peak memory."
+        ),
+    ),
+    click.option(
+        "--stats-json",
+        type=click.Path(dir_okay=False, writable=True),
+        help="Write the --stats report to this file as JSON.",
+    ),
+    click.option(
+        "--trace",
+        type=click.Path(dir_okay=False, writable=True),
+        help=(
+            "Write a timeline of every fuego call and query phase to this file, "
+            "in the Chrome trace-event format (open it in https://ui.perfetto.dev)."
+        ),
+    ),
+]
+
+
+_F = TypeVar("_F", bound=Callable[..., Any])
+
+
+def query_options(func: _F) -> _F:
+    """Add the options shared by the commands that query runs."""
+    for option in reversed(QUERY_OPTIONS):
+        func = option(func)
+    return func
+
+
+def backend_option(spec: Optional[str]) -> Optional[Backend]:
+    """Create the backend selected with ``--backend``.
+
+    Parameters
+    ----------
+    spec : str, optional
+        The value of ``--backend``.
+
+    Returns
+    -------
+    Backend or None
+        The backend, or None if no backend was selected.
+
+    Raises
+    ------
+    BadParameter
+        If the backend is unknown.
+    """
+    if spec is None:
+        return None
+
+    try:
+        return make_backend(spec)
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint="--backend") from exc
+
+
+def checkpoint_option(
+    checkpoint_dir: Optional[str], resume: bool
+) -> Optional[Checkpoint]:
+    """Create the checkpoint selected with ``--checkpoint-dir``.
+
+    Parameters
+    ----------
+    checkpoint_dir : str, optional
+        The value of ``--checkpoint-dir``.
+
+    resume : bool
+        The value of ``--resume``.
+
+    Returns
+    -------
+    Checkpoint or None
+        The checkpoint, or None if no directory was given.
+
+    Raises
+    ------
+    BadParameter
+        If ``--resume`` is given without ``--checkpoint-dir``.
+    """
+    if checkpoint_dir is None:
+        if resume:
+            raise click.BadParameter(
+                "--resume requires --checkpoint-dir.", param_hint="--resume"
+            )
+        return None
+
+    checkpoint = Checkpoint(checkpoint_dir, resume=resume)
+    if resume:
+        summary = checkpoint.summary()
+        click.echo(
+            f"Resuming from {checkpoint_dir}: {summary['complete']} queries "
+            f"complete, {summary['unfinished']} unfinished.",
+            err=True,
+        )
+    return checkpoint
+
+
+def shard_option(options: Dict[str, Any]) -> Optional[List[Shard]]:
+    """Create the shards selected with ``--shard-by``.
+
+    Parameters
+    ----------
+    options : Dict[str, Any]
+        The values of the ``QUERY_OPTIONS``, keyed by parameter name.
+
+    Returns
+    -------
+    List[Shard] or None
+        The shards, or None if the query is not sharded.
+
+    Raises
+    ------
+    BadParameter
+        If the shards are invalid.
+    """
+    if options["shard_by"] is None:
+        return None
+
+    try:
+        return make_shards(
+            options["shard_by"], options["started_after"], options["started_before"]
+        )
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint="--shard-by") from exc
+
+
+def trial_conditions_option(options: Dict[str, Any]) -> Optional[List[str]]:
+    """Return the conditions of the trial scan selected with ``--scan-trials``.
+
+    Parameters
+    ----------
+    options : Dict[str, Any]
+        The values of the ``QUERY_OPTIONS``, keyed by parameter name.
+
+    Returns
+    -------
+    List[str] or None
+        The trial conditions, or None if the trials are not scanned.
+
+    Raises
+    ------
+    BadParameter
+        If the conditions cannot narrow a trial scan.
+    """
+    if not options["scan_trials"] and not options["trial_conditions"]:
+        return None
+
+    from .runs import check_trial_conditions
+
+    try:
+        return check_trial_conditions(options["trial_conditions"])
+    except ValueError as exc:
+        raise click.BadParameter(str(exc), param_hint="--trial-condition") from exc
+
+
+def save_user_cache(user_resolver: UserResolver) -> None:
+    """Save the user cache and report its hits and misses.
+
+    Parameters
+    ----------
+    user_resolver : UserResolver
+        The resolver used by the query.
+    """
+    user_resolver.save()
+    if user_resolver.hits or user_resolver.misses:
+        click.echo(
+            f"User lookups: {user_resolver.hits} cache hits, "
+            f"{user_resolver.misses} fetched.",
+            err=True,
+        )
+
+
+@contextmanager
+def runs_query(options: Dict[str, Any]) -> Iterator[Dict[str, Any]]:
+    """Convert the shared query options into keyword arguments for get_runs.
+
+    Within the context, the requested response cache, retry policy and
+    checkpoint are active, as is the requested backend (otherwise the active
+    backend is left as it is). On exit, even if the query failed, the backend
+    is closed and the user cache is saved and its hit/miss counts are
+    reported, and the ``--stats`` metrics and ``--trace`` timeline are written
+    if requested.
+
+    Parameters
+    ----------
+    options : Dict[str, Any]
+        The values of the ``QUERY_OPTIONS``, keyed by parameter name.
+
+    Yields
+    ------
+    Dict[str, Any]
+        Keyword arguments for ``get_runs``, plus ``legacy`` and ``root_doc``.
+    """
+    query_kwargs = {
+        key: options[key]
+        for key in [
+            "roar_uid",
+            "pid_prefix",
+            "task_id",
+            "variant_id",
+            "study_id",
+            "district_id",
+            "school_id",
+            "class_id",
+            "group_id",
+        ]
+    }
+
+    # Convert to camelCase and remove None values.
+    query_kwargs = {
+        camel_case(key): value
+        for key, value in query_kwargs.items()
+        if value is not None
+    }
+
+    if options["require_completed"]:
+        query_kwargs["completed"] = "true"
+
+    user_resolver = UserResolver(
+        cache_path=options["user_cache"], ttl=options["user_cache_ttl"] * 3600
+    )
+
+    response_cache = None
+    if options["cache_dir"] is not None and not options["no_cache"]:
+        response_cache = ResponseCache(options["cache_dir"], refresh=options["refresh"])
+
+    backend = backend_option(options["backend"])
+    checkpoint = checkpoint_option(options["checkpoint_dir"], options["resume"])
+    shards = shard_option(options)
+    trial_conditions = trial_conditions_option(options)
+    failed_runs: Optional[Dict[str, Exception]] = None
+    if options["skip_failed_runs"]:
+        failed_runs = {}
+    page_size = options["page_size"]
+    max_page_size = options["max_page_size"]
+    if max_page_size is not None:
+        max_page_size = max(max_page_size, page_size)
+
+    with ExitStack() as stack:
+        # Save the user cache even if the query fails, so that a retry of an
+        # interrupted export does not fetch the same users again.
+        stack.callback(save_user_cache, user_resolver)
+        if backend is not None:
+            stack.callback(backend.close)
+            stack.enter_context(use_backend(backend))
+        stack.enter_context(use_response_cache(response_cache))
+        stack.enter_context(use_page_size(page_size, max_page_size))
+        stack.enter_context(
+            use_retry_policy(RetryPolicy(max_attempts=options["retries"] + 1))
+        )
+        stack.enter_context(use_checkpoint(checkpoint))
+        stack.enter_context(profile_query(options))
+        yield dict(
+            legacy=options["legacy"],
+            root_doc=options["root_doc"],
+            return_trials=options["return_trials"],
+            query_kwargs=query_kwargs,
+            started_before=options["started_before"],
+            started_after=options["started_after"],
+            max_workers=options["workers"],
+            user_resolver=user_resolver,
+            parse_timestamps=options["parse_timestamps"],
+            shards=shards,
+            trial_conditions=trial_conditions,
+            compact=options["compact_dtypes"],
+            failed_runs=failed_runs,
+        )
+
+    if failed_runs:
+        click.echo(
+            f"Skipped {len(failed_runs)} run(s) whose trials could not be fetched:",
+            err=True,
+        )
+        for run_id, exc in failed_runs.items():
+            click.echo(f"  {run_id}: {exc!r}", err=True)
+
+
+@contextmanager
+def profile_query(options: Dict[str, Any]) -> Iterator[None]:
+    """Record the ``--stats`` metrics and the ``--trace`` timeline of a query.
+
+    After the query, the metrics are printed to stderr and/or written as JSON,
+    and the trace is written, as requested. With ``--compact-dtypes``, the
+    memory used by the data before and after compaction is also printed.
+
+    Parameters
+    ----------
+    options : Dict[str, Any]
+        The values of the ``QUERY_OPTIONS``, keyed by parameter name.
+
+    Yields
+    ------
+    None
+    """
+    metrics = None
+    if (
+        options["stats"]
+        or options["stats_json"] is not None
+        or options["compact_dtypes"]
+    ):
+        metrics = Metrics()
+    trace = Trace() if options["trace"] is not None else None
+
+    with use_metrics(metrics), use_trace(trace):
+        yield
+
+    if metrics is not None and options["stats"]:
+        click.echo(metrics.report(), err=True)
+    if metrics is not None and options["compact_dtypes"]:
+        before = metrics.counters.get("bytes before compaction", 0) / 2**20
+        after = metrics.counters.get("bytes after compaction", 0) / 2**20
+        click.echo(
+            f"Compact dtypes: {before:.1f} MiB before, {after:.1f} MiB after.", err=True
+        )
+    if metrics is not None and options["stats_json"] is not None:
+        with open(options["stats_json"], "w") as fp:
+            json.dump(metrics.to_dict(), fp, indent=2)
+    if trace is not None:
+        trace.save(options["trace"])
+
+
+def fetch_runs(legacy: bool, root_doc: str, **kwargs: Any) -> Any:
+    """Call get_runs, or get_runs_compat for the legacy database.
+
+    Parameters
+    ----------
+    legacy : bool
+        If True, query the legacy database.
+
+    root_doc : str
+        The Firestore root document. Only used for the legacy database.
+
+    **kwargs : Any
+        Keyword arguments passed to ``get_runs`` or ``get_runs_compat``.
+
+    Returns
+    -------
+    pd.DataFrame
+        The runs or trials returned by the query.
+    """
+    from .runs import get_runs
+    from .runs import get_runs_compat
+
+    if legacy:
+        return get_runs_compat(root_doc=root_doc, **kwargs)
+    return get_runs(**kwargs)
 
 
 @click.version_option()
@@ -46,84 +645,32 @@ Examples:
   ``roarquery runs --task-id=sre --district-id=sd --started-after=2021-05-10 runs.csv``
 """
 )
+@query_options
 @click.option(
-    "--legacy",
+    "--stream",
     is_flag=True,
-    show_default=True,
     default=False,
-    help="Return trials from the legacy database",
-)
-@click.option(
-    "--roar-uid", type=str, help="Return only runs for the user with this ROAR UID."
-)
-@click.option(
-    "--pid-prefix", type=str, help="Return only runs for users with this prefix."
+    help=(
+        "With --return-trials, write each run's trials to the output file as soon "
+        "as they are fetched instead of holding every trial in memory."
+    ),
 )
-@click.option("--task-id", type=str, help="Return only runs for this task.")
 @click.option(
-    "--study-id",
-    type=str,
-    help="Return only runs for this study. Only supported in the legacy database.",
-)
-@click.option("--variant-id", type=str, help="Return only runs for this variant.")
-@click.option("--district-id", type=str, help="Return only runs for this district.")
-@click.option("--school-id", type=str, help="Return only runs for this school.")
-@click.option("--class-id", type=str, help="Return only runs with this class.")
-@click.option(
-    "--group-id",
-    type=str,
-    help="Return only runs with this group. Only supported in the current database.",
-)
-@click.option(
-    "--require-completed",
-    is_flag=True,
-    show_default=True,
-    default=False,
-    help="Require all runs to be completed.",
-)
-@click.option(
-    "--started-before",
-    type=click.DateTime(formats=["%Y-%m-%d"]),
-    help="Return only runs started before this date. Format: YYYY-MM-DD.",
-)
-@click.option(
-    "--started-after",
-    type=click.DateTime(formats=["%Y-%m-%d"]),
-    help="Return only runs started after this date. Format: YYYY-MM-DD.",
-)
-@click.option(
-    "--return-trials",
-    is_flag=True,
-    default=False,
-    help="Return the trials for each run as well.",
-)
-@click.option(
-    "--root-doc",
-    type=str,
-    default="prod/roar-prod",
-    help="The Firestore root document. Returned runs will all be under this document.",
+    "--format",
+    "output_format",
+    type=click.Choice(FORMATS),
+    help=(
+        "The output file format. Defaults to the format implied by the extension "
+        "of OUTPUT_FILENAME (.parquet, .feather), or csv. Parquet and Feather "
+        "require the roarquery[parquet] extra."
+    ),
 )
 @click.argument(
     "output_filename",
     type=click.Path(dir_okay=False, writable=True),
 )
 def runs(
-    legacy: bool,
-    roar_uid: str,
-    pid_prefix: str,
-    task_id: str,
-    study_id: str,
-    variant_id: str,
-    district_id: str,
-    school_id: str,
-    class_id: str,
-    group_id: str,
-    require_completed: bool,
-    started_before: date,
-    started_after: date,
-    return_trials: bool,
-    root_doc: str,
-    output_filename: click.Path,
+    output_filename: str, stream: bool, output_format: str, **options: Any
 ) -> None:
     r"""Return ROAR runs matching certain query parameters.
 
@@ -134,45 +681,71 @@ def runs(
     Arguments:
       OUTPUT FILENAME            Path to the output file to which to save runs/trials.
     """
-    query_kwargs = {
-        "roar_uid": roar_uid,
-        "pid_prefix": pid_prefix,
-        "task_id": task_id,
-        "variant_id": variant_id,
-        "study_id": study_id,
-        "district_id": district_id,
-        "school_id": school_id,
-        "class_id": class_id,
-        "group_id": group_id,
-    }
+    from .writers import open_writer
 
-    # Convert to camelCase and remove None values.
-    query_kwargs = {
-        camel_case(key): value
-        for key, value in query_kwargs.items()
-        if value is not None
-    }
+    with runs_query(options) as kwargs:
+        if stream and kwargs["return_trials"]:
+            with open_writer(output_filename, output_format) as writer:
+                fetch_runs(trials_writer=writer, **kwargs)
+            return
 
-    if require_completed:
-        query_kwargs["completed"] = "true"
+        df_trials = fetch_runs(**kwargs)
+        with open_writer(output_filename, output_format) as writer:
+            writer.write(df_trials)
 
-    if legacy:
-        df_trials = get_runs_compat(
-            root_doc=root_doc,
-            return_trials=return_trials,
-            query_kwargs=query_kwargs,
-            started_before=started_before,
-            started_after=started_after,
-        )
-    else:
-        df_trials = get_runs(
-            return_trials=return_trials,
-            query_kwargs=query_kwargs,
-            started_before=started_before,
-            started_after=started_after,
-        )
 
-    df_trials.to_csv(output_filename, index=True)
+@main.command(
+    epilog="""
+Examples:
+
+  Keep a nightly export of "swr" trials up to date.
+
+  ``roarquery sync --task-id=swr --return-trials trials.csv``
+"""
+)
+@query_options
+@click.option(
+    "--state-file",
+    type=click.Path(dir_okay=False, writable=True),
+    help=(
+        "The file recording the newest UpdateTime seen for each query. "
+        "Defaults to OUTPUT_FILENAME.sync.json."
+    ),
+)
+@click.option(
+    "--format",
+    "output_format",
+    type=click.Choice(FORMATS),
+    help="The export file format. Defaults to the format implied by the extension.",
+)
+@click.argument(
+    "output_filename",
+    type=click.Path(dir_okay=False, writable=True),
+)
+def sync(
+    output_filename: str, state_file: str, output_format: str, **options: Any
+) -> None:
+    r"""Incrementally update an export of ROAR runs.
+
+    The first sync writes every matching run (and trial) to OUTPUT_FILENAME.
+    Later syncs with the same options fetch only the runs whose UpdateTime or
+    timeStarted is newer than the last sync and merge them into the export.
+    If --skip-failed-runs skips any run, the sync state is not advanced, so
+    the next sync fetches those runs again.
+
+    \b
+    Arguments:
+      OUTPUT FILENAME            Path to the export to create or update.
+    """
+    from .sync import sync_runs
+
+    with runs_query(options) as kwargs:
+        sync_runs(
+            output_filename,
+            state_filename=state_file,
+            output_format=output_format,
+            **kwargs,
+        )
 
 
 if __name__ == "__main__":
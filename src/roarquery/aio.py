@@ -0,0 +1,377 @@
+"""Run fuego commands concurrently with asyncio.
+
+``AsyncRunner`` is the asyncio counterpart of ``run_fuego`` and the paging
+helpers in ``roarquery.utils``. ``roarquery.runs.get_runs_async`` uses it to
+overlap the user lookups and trial fetches of a query, and it can be awaited
+directly from a notebook, whose event loop is already running.
+"""
+import asyncio
+import subprocess  # nosec
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any
+from typing import AsyncIterator
+from typing import Awaitable
+from typing import Callable
+from typing import cast
+from typing import Dict
+from typing import Hashable
+from typing import Iterable
+from typing import List
+from typing import Mapping
+from typing import Optional
+from typing import Tuple
+from typing import TypeVar
+
+from .backends import FuegoBackend
+from .backends import get_backend
+from .cache import get_response_cache
+from .metrics import count
+from .metrics import timed
+from .retry import get_retry_policy
+from .users import split_run_path
+from .users import user_from_doc
+from .users import UserResolver
+from .utils import _FuegoResponse
+from .utils import _Pager
+from .utils import bytes2json
+from .utils import FetchError
+from .utils import FuegoRecord
+from .utils import summarize_argv
+
+
+_K = TypeVar("_K", bound=Hashable)
+_A = TypeVar("_A")
+_R = TypeVar("_R")
+
+
+async def exec_fuego(query: List[str]) -> bytes:
+    """Run the fuego binary in a subprocess without blocking the event loop.
+
+    Parameters
+    ----------
+    query : List[str]
+        The fuego argv, starting with "fuego".
+
+    Returns
+    -------
+    bytes
+        The output of the fuego command.
+
+    Raises
+    ------
+    CalledProcessError
+        If fuego exits with a non-zero status, as with ``check_output``.
+    """
+    process = await asyncio.create_subprocess_exec(
+        *query, stdout=asyncio.subprocess.PIPE
+    )
+    output, _ = await process.communicate()
+    if process.returncode:
+        raise subprocess.CalledProcessError(process.returncode, query, output)
+    return output
+
+
+async def iter_tasks(
+    tasks: Mapping[_K, "asyncio.Future[_R]"]
+) -> AsyncIterator[Tuple[_K, _R]]:
+    """Await running tasks in order, like ``iter_concurrently``.
+
+    A failed task does not stop the others; once every task has been awaited,
+    a ``FetchError`` listing all of the failures is raised.
+
+    Parameters
+    ----------
+    tasks : Mapping[Hashable, asyncio.Future]
+        The running tasks, keyed by item.
+
+    Yields
+    ------
+    Tuple[Hashable, Any]
+        The key and result of each task that succeeded, in the order of
+        ``tasks``.
+
+    Raises
+    ------
+    FetchError
+        If any of the tasks raised an exception.
+    """
+    errors: Dict[Any, Exception] = {}
+    for key, task in tasks.items():
+        try:
+            result = await task
+        except Exception as exc:
+            errors[key] = exc
+        else:
+            yield key, result
+
+    if errors:
+        raise FetchError(errors) from next(iter(errors.values()))
+
+
+async def gather_tasks(tasks: Mapping[_K, "asyncio.Future[_R]"]) -> Dict[_K, _R]:
+    """Await running tasks and collect their results, like ``map_concurrently``.
+
+    Parameters
+    ----------
+    tasks : Mapping[Hashable, asyncio.Future]
+        The running tasks, keyed by item.
+
+    Returns
+    -------
+    Dict[Hashable, Any]
+        The result of each task, in the order of ``tasks``.
+
+    Raises
+    ------
+    FetchError
+        If any of the tasks raised an exception. The results of the successful
+        tasks are available in the ``results`` attribute of the error.
+    """
+    results: Dict[_K, _R] = {}
+    try:
+        async for key, result in iter_tasks(tasks):
+            results[key] = result
+    except FetchError as exc:
+        exc.results = results
+        raise
+
+    return results
+
+
+class AsyncRunner:
+    """Run fuego commands on the event loop, a bounded number at a time.
+
+    With the default backend, the fuego binary is started with
+    ``asyncio.create_subprocess_exec``, so one thread can wait on many calls.
+    The other backends block, so their calls run in worker threads, which
+    ``close`` (or leaving ``async with``) shuts down. Either way, at most
+    ``max_concurrency`` calls are in flight. The response cache, retry
+    policy, checkpoint and metrics apply as they do to ``run_fuego``.
+
+    Parameters
+    ----------
+    max_concurrency : int, optional, default=8
+        The maximum number of concurrent fuego calls.
+    """
+
+    def __init__(self, max_concurrency: int = 8) -> None:
+        """Initialize the runner."""
+        self.max_concurrency = max_concurrency
+        self._semaphore: Optional[asyncio.Semaphore] = None
+        self._executor: Optional[ThreadPoolExecutor] = None
+
+    async def __aenter__(self) -> "AsyncRunner":
+        """Use the runner within a context that closes it."""
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        """Close the runner."""
+        self.close()
+
+    def close(self) -> None:
+        """Shut down the worker threads of the blocking backends, if any."""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        """The semaphore that bounds the number of concurrent calls."""
+        # Create the semaphore on first use, within the running event loop.
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        return self._semaphore
+
+    @property
+    def executor(self) -> ThreadPoolExecutor:
+        """The worker threads that run the calls of blocking backends."""
+        # The default executor may have fewer threads than max_concurrency.
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(max_workers=self.max_concurrency)
+        return self._executor
+
+    async def _run_backend(self, query: List[str]) -> bytes:
+        """Run a fuego command once with the active backend."""
+        backend = get_backend()
+        async with self.semaphore:
+            with timed("fuego", argv=summarize_argv(query)) as span:
+                if isinstance(backend, FuegoBackend):
+                    output = await exec_fuego(query)
+                else:
+                    output = await asyncio.get_running_loop().run_in_executor(
+                        self.executor, backend.run, query
+                    )
+                span["bytes"] = len(output)
+        count("fuego calls")
+        count("bytes received", len(output))
+        return output
+
+    async def run_fuego(self, query: List[str]) -> bytes:
+        """Run a fuego command and return its raw output, like ``run_fuego``.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv, starting with "fuego".
+
+        Returns
+        -------
+        bytes
+            The output of the fuego command.
+        """
+        cache = get_response_cache()
+        if cache is not None:
+            output = cache.get(query)
+            if output is not None:
+                count("cached responses")
+                return output
+
+        policy = get_retry_policy()
+        if policy is None:
+            output = await self._run_backend(query)
+        else:
+            output = await policy.call_async(lambda: self._run_backend(query))
+
+        if cache is not None:
+            cache.set(query, output)
+
+        return output
+
+    async def iter_pages(
+        self,
+        query: List[str],
+        limit: Optional[int] = None,
+        max_limit: Optional[int] = None,
+    ) -> AsyncIterator[List[_FuegoResponse]]:
+        """Page through results from a query, like ``iter_pages``.
+
+        Parameters
+        ----------
+        query : List[str]
+            The query to run. It is not modified.
+
+        limit : int, optional, default=100
+            The number of results to return in the first page.
+
+        max_limit : int, optional, default=None
+            The largest number of results to return per page.
+
+        Yields
+        ------
+        List[_FuegoResponse]
+            The documents in each page of results.
+        """
+        pager = _Pager(query, limit, max_limit)
+        for page in pager.replay():
+            yield page
+
+        while not pager.done:
+            start = time.perf_counter()
+            with pager.fetching() as span:
+                output = await self.run_fuego(list(pager.query))
+                page = bytes2json(output)
+                span["documents"] = len(page)
+            pager.record(page, time.perf_counter() - start, len(output))
+            if page:
+                yield page
+
+    async def page_records(
+        self, query: List[str], drop: Iterable[str] = ("ReadTime",)
+    ) -> List[FuegoRecord]:
+        """Return every result of a query as compact records.
+
+        Parameters
+        ----------
+        query : List[str]
+            The query to run. It is not modified.
+
+        drop : Iterable[str], optional, default=("ReadTime",)
+            The metadata fields to leave out of each record.
+
+        Returns
+        -------
+        List[FuegoRecord]
+            The results of the query.
+        """
+        drop = tuple(drop)
+        return [
+            FuegoRecord.from_json(doc, drop)
+            async for page in self.iter_pages(query)
+            for doc in page
+        ]
+
+    async def fetch_user(self, user_path: str) -> _FuegoResponse:
+        """Fetch a single user document, like ``fetch_user``.
+
+        Parameters
+        ----------
+        user_path : str
+            The Firestore path to the user, e.g. "users/aa-0001".
+
+        Returns
+        -------
+        _FuegoResponse
+            The raw user document.
+        """
+        user_collection, user_id = user_path.rsplit("/", 1)
+        fuego_query = ["fuego", "get", user_collection, user_id]
+        with timed("fetch user"):
+            output = await self.run_fuego(fuego_query)
+            return cast(_FuegoResponse, bytes2json(output))
+
+    def start(
+        self, func: Callable[[_A], Awaitable[_R]], items: Mapping[_K, _A]
+    ) -> Dict[_K, "asyncio.Future[_R]"]:
+        """Start a task for each item.
+
+        The tasks run as soon as the event loop is free, and the runner's
+        semaphore bounds how many of their fuego calls are in flight.
+
+        Parameters
+        ----------
+        func : Callable
+            The coroutine function to apply to each item's value.
+
+        items : Mapping
+            The items to process.
+
+        Returns
+        -------
+        Dict[Hashable, asyncio.Future]
+            The running tasks, keyed like ``items``.
+        """
+        return {key: asyncio.ensure_future(func(arg)) for key, arg in items.items()}
+
+    async def get_users_from_runs(
+        self, resolver: UserResolver, run_paths: Iterable[str], legacy: bool = False
+    ) -> List[Dict[str, Any]]:
+        """Return the user info for each run, like ``get_users_from_runs``.
+
+        Parameters
+        ----------
+        resolver : UserResolver
+            The resolver whose cache is used and filled.
+
+        run_paths : Iterable[str]
+            The Firestore paths to the runs.
+
+        legacy : bool, optional, default=False
+            If True, users are identified by PID, otherwise by roarUid.
+
+        Returns
+        -------
+        List[Dict[str, Any]]
+            One user info row per run, in the order of ``run_paths``.
+        """
+        split_paths = [split_run_path(run_path) for run_path in run_paths]
+        docs, to_fetch = resolver.lookup(user_path for user_path, _ in split_paths)
+        fetched = await gather_tasks(
+            self.start(self.fetch_user, {path: path for path in to_fetch})
+        )
+        resolver.add(fetched)
+        docs.update(fetched)
+        return [
+            user_from_doc(docs[user_path], run_id, legacy=legacy)
+            for user_path, run_id in split_paths
+        ]
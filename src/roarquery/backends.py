@@ -0,0 +1,849 @@
+"""Backends that execute fuego commands."""
+import base64
+import bisect
+from abc import ABC
+from abc import abstractmethod
+import json
+import operator
+import os
+import re
+import subprocess  # nosec
+import threading
+from contextlib import contextmanager
+from datetime import datetime
+from datetime import timezone
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+_ACTIVE_BACKEND: Optional["Backend"] = None
+_DEFAULT_BACKENDS: Dict[str, "Backend"] = {}
+
+Condition = Tuple[str, str, Any]
+
+_CONDITION_RE = re.compile(
+    r"^\s*(?P<field>\S+)\s+"
+    r"(?P<op>==|!=|<=|>=|<|>|<array-contains>|<array-contains-any>|<in>|<not-in>)"
+    r"\s+(?P<value>.+?)\s*$"
+)
+_TIMESTAMP_RE = re.compile(
+    r"^\d{4}-\d{2}-\d{2}T\d{2}:\d{2}:\d{2}(\.\d+)?(Z|[+-]\d{2}:\d{2})$"
+)
+_FLAGS_WITH_VALUES = ("--limit", "--startafter", "--select")
+_FIRESTORE_OPS = {
+    "==": "==",
+    "!=": "!=",
+    "<": "<",
+    "<=": "<=",
+    ">": ">",
+    ">=": ">=",
+    "<array-contains>": "array_contains",
+    "<array-contains-any>": "array_contains_any",
+    "<in>": "in",
+    "<not-in>": "not-in",
+}
+
+
+class BackendError(RuntimeError):
+    """Raised when a backend cannot execute a fuego command."""
+
+
+class TransientBackendError(BackendError):
+    """Raised when a fuego command fails but may succeed if it is retried.
+
+    Quota, deadline and network errors are transient. A missing document or
+    an unparseable condition is not, and raises a plain ``BackendError``.
+    """
+
+
+def parse_value(value: str) -> Any:
+    """Parse a value in a fuego query condition.
+
+    Quoted values are strings, RFC 3339 timestamps become aware datetimes,
+    and anything else is parsed as JSON (numbers, booleans, lists), falling
+    back to the raw string.
+
+    Parameters
+    ----------
+    value : str
+        The value as written in the condition.
+
+    Returns
+    -------
+    Any
+        The parsed value.
+
+    Examples
+    --------
+    >>> parse_value('"swr"')
+    'swr'
+
+    >>> parse_value("2024-01-01T00:00:00Z")
+    datetime.datetime(2024, 1, 1, 0, 0, tzinfo=tzutc())
+
+    >>> parse_value("3")
+    3
+    """
+    if _TIMESTAMP_RE.match(value):
+        from dateutil.parser import isoparse
+
+        return isoparse(value)
+
+    try:
+        return json.loads(value)
+    except ValueError:
+        return value
+
+
+def parse_condition(condition: str) -> Condition:
+    """Split a fuego query condition into a field, operator and value.
+
+    Parameters
+    ----------
+    condition : str
+        The condition, e.g. ``taskId == "swr"``.
+
+    Returns
+    -------
+    Tuple[str, str, Any]
+        The field path, the fuego operator and the parsed value.
+
+    Raises
+    ------
+    BackendError
+        If the condition cannot be parsed.
+
+    Examples
+    --------
+    >>> parse_condition('assigningOrgs.schools <array-contains> "s1"')
+    ('assigningOrgs.schools', '<array-contains>', 's1')
+    """
+    match = _CONDITION_RE.match(condition)
+    if match is None:
+        raise BackendError(f"Cannot parse the fuego condition {condition!r}")
+
+    return match["field"], match["op"], parse_value(match["value"])
+
+
+class FuegoCommand:
+    """A parsed fuego argv.
+
+    Only the commands and options that roarquery uses are supported: ``query``
+    (with ``-g``, ``--limit``, ``--startafter`` and ``--select``), ``get`` and
+    ``collections``.
+
+    Parameters
+    ----------
+    query : List[str]
+        The fuego argv, starting with "fuego".
+
+    Raises
+    ------
+    BackendError
+        If the command is not supported.
+    """
+
+    def __init__(self, query: List[str]) -> None:
+        """Parse the argv."""
+        self.command = query[1] if len(query) > 1 else ""
+        self.path = ""
+        self.group = False
+        self.conditions: List[Condition] = []
+        self.selects: List[str] = []
+        self.limit: Optional[int] = None
+        self.start_after: Optional[str] = None
+
+        if self.command in ("c", "collections"):
+            return
+        if self.command not in ("query", "get"):
+            raise BackendError(f"Unsupported fuego command: {query!r}")
+
+        positional = self._parse_options(query[2:])
+        if not positional:
+            raise BackendError(f"No collection in fuego command: {query!r}")
+
+        if self.command == "get":
+            self.path = "/".join(positional)
+        else:
+            self.path = positional[0]
+            self.conditions = [parse_condition(arg) for arg in positional[1:]]
+
+    def _parse_options(self, args: List[str]) -> List[str]:
+        positional = []
+        idx = 0
+        while idx < len(args):
+            arg = args[idx]
+            if arg in ("-g", "--group"):
+                self.group = True
+            elif arg in _FLAGS_WITH_VALUES:
+                idx += 1
+                if arg == "--limit":
+                    self.limit = int(args[idx])
+                elif arg == "--startafter":
+                    self.start_after = args[idx]
+                else:
+                    self.selects.append(args[idx])
+            else:
+                positional.append(arg)
+            idx += 1
+
+        return positional
+
+
+def format_timestamp(value: datetime) -> str:
+    """Format a timestamp the way fuego does, as RFC 3339 in UTC.
+
+    Parameters
+    ----------
+    value : datetime
+        The timestamp. Naive timestamps are assumed to be in UTC.
+
+    Returns
+    -------
+    str
+        The formatted timestamp.
+
+    Examples
+    --------
+    >>> format_timestamp(datetime(2024, 1, 1, 12, 30, 0, 500000))
+    '2024-01-01T12:30:00.5Z'
+    """
+    if value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+
+    timestamp = value.isoformat()
+    if "." in timestamp:
+        timestamp = timestamp.rstrip("0")
+    return f"{timestamp}Z"
+
+
+def path_key(path: str) -> Tuple[str, ...]:
+    """Return the sort key of a document path, in Firestore's order.
+
+    Firestore orders documents by their path one segment at a time, so
+    "users/a/runs/r" comes before "users/a-b/runs/r" even though "/" sorts
+    after "-".
+
+    Parameters
+    ----------
+    path : str
+        The document path. Any leading project information is ignored.
+
+    Returns
+    -------
+    Tuple[str, ...]
+        The segments of the path.
+
+    Examples
+    --------
+    >>> path_key("users/a/runs/r") < path_key("users/a-b/runs/r")
+    True
+    """
+    return tuple(path.split("databases/(default)/documents/")[-1].split("/"))
+
+
+def to_json(value: Any) -> Any:
+    """Convert Firestore values into the JSON that fuego prints.
+
+    Parameters
+    ----------
+    value : Any
+        A field value returned by the Firestore client.
+
+    Returns
+    -------
+    Any
+        A JSON-serializable value.
+    """
+    if isinstance(value, dict):
+        return {key: to_json(item) for key, item in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [to_json(item) for item in value]
+    if isinstance(value, datetime):
+        return format_timestamp(value)
+    if isinstance(value, bytes):
+        return base64.b64encode(value).decode("ascii")
+    if hasattr(value, "latitude") and hasattr(value, "longitude"):
+        return {"Latitude": value.latitude, "Longitude": value.longitude}
+    if hasattr(value, "path") and hasattr(value, "parent"):
+        # A DocumentReference
+        return value.path
+    return value
+
+
+def dump_documents(documents: Any) -> bytes:
+    """Serialize fuego documents as fuego would print them.
+
+    Parameters
+    ----------
+    documents : Any
+        A document or a list of documents.
+
+    Returns
+    -------
+    bytes
+        The JSON output.
+    """
+    return json.dumps(documents, indent=2).encode("utf-8")
+
+
+class Backend(ABC):
+    """Base class for the backends that execute fuego commands.
+
+    ``roarquery.utils.run_fuego`` passes every fuego argv to the active
+    backend, which returns the output that ``fuego`` would have printed.
+    """
+
+    @abstractmethod
+    def run(self, query: List[str]) -> bytes:
+        """Execute a fuego command.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv, starting with "fuego".
+
+        Returns
+        -------
+        bytes
+            The output that fuego would have printed.
+        """
+
+    def close(self) -> None:
+        """Release any connections held by the backend."""
+
+
+class FuegoBackend(Backend):
+    """Run each command with the ``fuego`` binary in a subprocess."""
+
+    def run(self, query: List[str]) -> bytes:
+        """Run fuego and return its output.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv, starting with "fuego".
+
+        Returns
+        -------
+        bytes
+            The output of the fuego command.
+        """
+        return subprocess.check_output(query)  # nosec
+
+
+class FirestoreBackend(Backend):
+    """Execute fuego commands in-process with the Firestore client library.
+
+    One client, and therefore one authenticated gRPC channel, is kept for
+    each credentials file, so queries do not pay for a process spawn and a
+    fresh authentication each time. Set ``FIRESTORE_EMULATOR_HOST`` to use the
+    Firestore emulator.
+
+    This requires the ``google-cloud-firestore`` package, which is installed
+    with the ``roarquery[firestore]`` extra.
+
+    Parameters
+    ----------
+    project : str, optional, default=None
+        The Google Cloud project. If None, it is taken from the credentials.
+    """
+
+    def __init__(self, project: Optional[str] = None) -> None:
+        """Initialize the backend."""
+        self.project = project
+        self._clients: Dict[str, Any] = {}
+        self._lock = threading.Lock()
+
+    def client(self) -> Any:
+        """Return the client for the current credentials.
+
+        Returns
+        -------
+        google.cloud.firestore.Client
+            The client. ``roarquery`` switches between the legacy and current
+            databases by changing ``GOOGLE_APPLICATION_CREDENTIALS``, so one
+            client is kept per credentials file.
+        """
+        credentials = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "")
+        with self._lock:
+            if credentials not in self._clients:
+                self._clients[credentials] = self._make_client(credentials)
+            return self._clients[credentials]
+
+    def _make_client(self, credentials: str) -> Any:
+        try:
+            from google.cloud import firestore
+        except ImportError as exc:  # pragma: no cover
+            raise ImportError(
+                "The firestore backend requires google-cloud-firestore. Install "
+                "it with `pip install roarquery[firestore]`."
+            ) from exc
+
+        client_class: Any = firestore.Client
+        if os.path.isfile(credentials):
+            return client_class.from_service_account_json(
+                credentials, project=self.project
+            )
+        return client_class(project=self.project)
+
+    def run(self, query: List[str]) -> bytes:
+        """Execute a fuego command with the Firestore client.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv, starting with "fuego".
+
+        Returns
+        -------
+        bytes
+            The output that fuego would have printed.
+
+        Raises
+        ------
+        BackendError
+            If a requested document does not exist.
+
+        TransientBackendError
+            If Firestore fails with a quota, deadline or network error.
+        """
+        try:
+            return self._run(query)
+        except Exception as exc:
+            if _is_transient(exc):
+                raise TransientBackendError(str(exc)) from exc
+            raise
+
+    def _run(self, query: List[str]) -> bytes:
+        command = FuegoCommand(query)
+        client = self.client()
+
+        if command.command in ("c", "collections"):
+            names = [collection.id for collection in client.collections()]
+            return "".join(f"{name}\n" for name in names).encode("utf-8")
+
+        if command.command == "get":
+            snapshot = client.document(command.path).get()
+            if not snapshot.exists:
+                raise BackendError(f"Document {command.path} does not exist")
+            return dump_documents(self._document(snapshot))
+
+        return dump_documents(
+            [
+                self._document(snapshot)
+                for snapshot in self.build_query(client, command).stream()
+            ]
+        )
+
+    def build_query(self, client: Any, command: FuegoCommand) -> Any:
+        """Translate a parsed ``fuego query`` into a Firestore query.
+
+        Parameters
+        ----------
+        client : google.cloud.firestore.Client
+            The client.
+
+        command : FuegoCommand
+            The parsed fuego query.
+
+        Returns
+        -------
+        google.cloud.firestore.Query
+            The query, which has not been run yet.
+        """
+        from google.cloud.firestore_v1.base_query import FieldFilter
+
+        if command.group:
+            query = client.collection_group(command.path)
+        else:
+            query = client.collection(command.path)
+
+        for field, op, value in command.conditions:
+            query = query.where(filter=FieldFilter(field, _FIRESTORE_OPS[op], value))
+        if command.selects:
+            query = query.select(command.selects)
+        if command.start_after is not None:
+            query = query.start_after(client.document(command.start_after).get())
+        if command.limit is not None:
+            query = query.limit(command.limit)
+
+        return query
+
+    @staticmethod
+    def _document(snapshot: Any) -> Dict[str, Any]:
+        return {
+            "CreateTime": format_timestamp(snapshot.create_time),
+            "Data": to_json(snapshot.to_dict() or {}),
+            "ID": snapshot.id,
+            "Path": snapshot.reference.path,
+            "ReadTime": format_timestamp(snapshot.read_time),
+            "UpdateTime": format_timestamp(snapshot.update_time),
+        }
+
+    def close(self) -> None:
+        """Close every client."""
+        with self._lock:
+            for client in self._clients.values():
+                client.close()
+            self._clients = {}
+
+
+def _get_field(data: Dict[str, Any], field: str) -> Any:
+    value: Any = data
+    for key in field.split("."):
+        if not isinstance(value, dict) or key not in value:
+            return None
+        value = value[key]
+    return value
+
+
+def _array_contains_any(value: Any, target: Any) -> bool:
+    return isinstance(value, list) and any(item in value for item in target)
+
+
+_LOCAL_OPS: Dict[str, Callable[[Any, Any], bool]] = {
+    "==": operator.eq,
+    "!=": lambda value, target: value is not None and value != target,
+    "<": operator.lt,
+    "<=": operator.le,
+    ">": operator.gt,
+    ">=": operator.ge,
+    "<array-contains>": lambda value, target: isinstance(value, list)
+    and target in value,
+    "<array-contains-any>": _array_contains_any,
+    "<in>": lambda value, target: value in target,
+    "<not-in>": lambda value, target: value is not None and value not in target,
+}
+
+
+def _compare(value: Any, op: str, target: Any) -> bool:
+    """Evaluate one condition the way Firestore would, for local documents."""
+    if isinstance(target, datetime) and isinstance(value, str):
+        from dateutil.parser import isoparse
+
+        try:
+            value = isoparse(value)
+        except ValueError:
+            return False
+
+    try:
+        return bool(_LOCAL_OPS[op](value, target))
+    except TypeError:
+        # Firestore only compares values of the same type.
+        return False
+
+
+def _is_transient(exc: Exception) -> bool:
+    """Return True if a Firestore client error may succeed on a retry."""
+    try:
+        from google.api_core import exceptions
+    except ImportError:  # pragma: no cover
+        return False
+
+    return isinstance(
+        exc,
+        (
+            exceptions.Aborted,
+            exceptions.DeadlineExceeded,
+            exceptions.InternalServerError,
+            exceptions.ServiceUnavailable,
+            exceptions.TooManyRequests,
+        ),
+    )
+
+
+class LocalBackend(Backend):
+    """Execute fuego commands against documents stored on the local disk.
+
+    This is a stand-in for Firestore in tests, benchmarks and offline
+    development. Each document is a JSON file, laid out like the database,
+    at ``<root>/<document path>.json``, holding the document as fuego prints
+    it (``CreateTime``, ``Data``, ``UpdateTime``, ...). ``ID`` and ``Path`` are
+    taken from the file name.
+
+    Parameters
+    ----------
+    root : str, optional, default=None
+        The directory holding the documents. If None, the backend starts
+        empty and documents are added with ``add_document``.
+    """
+
+    def __init__(self, root: Optional[str] = None) -> None:
+        """Load the documents."""
+        self.root = root
+        self.documents: Dict[str, Dict[str, Any]] = {}
+        self._index: Optional[Dict[Tuple[bool, str], List[str]]] = None
+        self._keys: Dict[Tuple[bool, str], List[Tuple[str, ...]]] = {}
+        if root is not None:
+            self._load(root)
+
+    def _load(self, root: str) -> None:
+        for dirpath, _, filenames in os.walk(root):
+            for filename in filenames:
+                if filename.endswith(".json"):
+                    self.load_file(root, os.path.join(dirpath, filename))
+
+    def load_file(self, root: str, full_path: str) -> None:
+        """Add the document stored in one file.
+
+        Parameters
+        ----------
+        root : str
+            The directory holding the documents.
+
+        full_path : str
+            The file, ``<root>/<document path>.json``.
+        """
+        path = os.path.relpath(full_path, root)[: -len(".json")]
+        with open(full_path) as fp:
+            document = json.load(fp)
+        self.add_document(
+            path.replace(os.sep, "/"),
+            document["Data"],
+            create_time=document.get("CreateTime"),
+            update_time=document.get("UpdateTime"),
+        )
+
+    def add_document(
+        self,
+        path: str,
+        data: Dict[str, Any],
+        create_time: Optional[str] = None,
+        update_time: Optional[str] = None,
+    ) -> None:
+        """Add or replace a document.
+
+        Parameters
+        ----------
+        path : str
+            The document path, e.g. ``users/aa-0001/runs/run-1``.
+
+        data : Dict[str, Any]
+            The document fields.
+
+        create_time : str, optional, default=None
+            The creation time. Defaults to now.
+
+        update_time : str, optional, default=None
+            The last update time. Defaults to ``create_time``.
+        """
+        path = path.strip("/")
+        create_time = create_time or format_timestamp(datetime.now(timezone.utc))
+        self._index = None
+        self.documents[path] = {
+            "CreateTime": create_time,
+            "Data": data,
+            "ID": path.rsplit("/", 1)[-1],
+            "Path": path,
+            "UpdateTime": update_time or create_time,
+        }
+
+    def save(self, root: Optional[str] = None) -> None:
+        """Write every document to disk.
+
+        Parameters
+        ----------
+        root : str, optional, default=None
+            The directory to write to. Defaults to ``self.root``.
+
+        Raises
+        ------
+        ValueError
+            If neither ``root`` nor ``self.root`` is set.
+        """
+        root = root if root is not None else self.root
+        if root is None:
+            raise ValueError("No directory to save the documents to.")
+
+        for path, document in self.documents.items():
+            full_path = os.path.join(root, *path.split("/")) + ".json"
+            os.makedirs(os.path.dirname(full_path), exist_ok=True)
+            with open(full_path, "w") as fp:
+                json.dump(document, fp)
+
+    def _collection(self, command: FuegoCommand) -> List[str]:
+        """Return the sorted paths of the documents in the queried collection.
+
+        The paths are sorted with ``path_key``, like Firestore sorts them, and
+        indexed by parent collection and by collection ID (for collection
+        group queries) the first time they are needed, so that a query does
+        not scan every document.
+        """
+        if self._index is None:
+            index: Dict[Tuple[bool, str], List[str]] = {}
+            for path in sorted(self.documents, key=path_key):
+                parent, _, _ = path.rpartition("/")
+                index.setdefault((False, parent), []).append(path)
+                index.setdefault((True, parent.rsplit("/", 1)[-1]), []).append(path)
+            self._index = index
+            self._keys = {}
+
+        path = command.path if command.group else command.path.strip("/")
+        return self._index.get((command.group, path), [])
+
+    def _start(self, command: FuegoCommand, paths: List[str]) -> int:
+        """Return the index of the first path after ``--startafter``."""
+        if command.start_after is None:
+            return 0
+
+        path = command.path if command.group else command.path.strip("/")
+        keys = self._keys.get((command.group, path))
+        if keys is None:
+            keys = self._keys[(command.group, path)] = [path_key(p) for p in paths]
+        return bisect.bisect_right(keys, path_key(command.start_after))
+
+    @staticmethod
+    def _matches(document: Dict[str, Any], command: FuegoCommand) -> bool:
+        return all(
+            _compare(_get_field(document["Data"], field), op, value)
+            for field, op, value in command.conditions
+        )
+
+    def _select(self, document: Dict[str, Any], selects: List[str]) -> Dict[str, Any]:
+        read_time = format_timestamp(datetime.now(timezone.utc))
+        document = dict(document, ReadTime=read_time)
+        if selects:
+            document["Data"] = {
+                key: value for key, value in document["Data"].items() if key in selects
+            }
+        return document
+
+    def run(self, query: List[str]) -> bytes:
+        """Execute a fuego command against the local documents.
+
+        Documents are returned in Firestore's path order (see ``path_key``),
+        which is also the order used by ``--startafter``.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv, starting with "fuego".
+
+        Returns
+        -------
+        bytes
+            The output that fuego would have printed.
+
+        Raises
+        ------
+        BackendError
+            If a requested document does not exist.
+        """
+        command = FuegoCommand(query)
+
+        if command.command in ("c", "collections"):
+            names = sorted({path.split("/", 1)[0] for path in self.documents})
+            return "".join(f"{name}\n" for name in names).encode("utf-8")
+
+        if command.command == "get":
+            path = command.path.strip("/")
+            if path not in self.documents:
+                raise BackendError(f"Document {path} does not exist")
+            return dump_documents(self._select(self.documents[path], []))
+
+        paths = self._collection(command)
+        results = []
+        for idx in range(self._start(command, paths), len(paths)):
+            path = paths[idx]
+            if self._matches(self.documents[path], command):
+                results.append(self._select(self.documents[path], command.selects))
+                if command.limit is not None and len(results) >= command.limit:
+                    break
+
+        return dump_documents(results)
+
+
+def make_backend(spec: str) -> Backend:
+    """Create a backend from its name.
+
+    Parameters
+    ----------
+    spec : str
+        One of "fuego", "firestore" or "local:<directory>".
+
+    Returns
+    -------
+    Backend
+        The backend.
+
+    Raises
+    ------
+    ValueError
+        If the backend is unknown.
+
+    Examples
+    --------
+    >>> make_backend("fuego")  # doctest: +ELLIPSIS
+    <roarquery.backends.FuegoBackend object at ...>
+    """
+    name, _, argument = spec.partition(":")
+    if name == "fuego":
+        return FuegoBackend()
+    if name == "firestore":
+        return FirestoreBackend(project=argument or None)
+    if name == "local" and argument:
+        return LocalBackend(argument)
+
+    raise ValueError(
+        f"Unknown backend {spec!r}. Use 'fuego', 'firestore' or 'local:<directory>'."
+    )
+
+
+def get_backend() -> Backend:
+    """Return the backend used by fuego calls.
+
+    If no backend was set with ``set_backend``, the ``ROAR_QUERY_BACKEND``
+    environment variable selects one, defaulting to the fuego binary.
+
+    Returns
+    -------
+    Backend
+        The active backend.
+    """
+    if _ACTIVE_BACKEND is not None:
+        return _ACTIVE_BACKEND
+
+    spec = os.environ.get("ROAR_QUERY_BACKEND") or "fuego"
+    if spec not in _DEFAULT_BACKENDS:
+        _DEFAULT_BACKENDS[spec] = make_backend(spec)
+    return _DEFAULT_BACKENDS[spec]
+
+
+def set_backend(backend: Optional[Backend]) -> None:
+    """Set the backend used by fuego calls.
+
+    Parameters
+    ----------
+    backend : Backend or None
+        The backend to use. If None, the backend is chosen from the
+        ``ROAR_QUERY_BACKEND`` environment variable.
+    """
+    global _ACTIVE_BACKEND
+    _ACTIVE_BACKEND = backend
+
+
+@contextmanager
+def use_backend(backend: Optional[Backend]) -> Iterator[None]:
+    """Temporarily set the backend used by fuego calls.
+
+    Parameters
+    ----------
+    backend : Backend or None
+        The backend to use within the context.
+
+    Yields
+    ------
+    None
+    """
+    previous = _ACTIVE_BACKEND
+    set_backend(backend)
+    try:
+        yield
+    finally:
+        set_backend(previous)
@@ -0,0 +1,326 @@
+"""Cache fuego responses on disk."""
+import hashlib
+import json
+import os
+import re
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+_ACTIVE_CACHE: Optional["ResponseCache"] = None
+
+# A double- or single-quoted literal, with backslash escapes.
+_QUOTED = re.compile(r"""("(?:[^"\\]|\\.)*"|'(?:[^'\\]|\\.)*')""")
+
+
+def collapse_whitespace(arg: str) -> str:
+    """Collapse repeated whitespace in an argument, outside of quoted literals.
+
+    Parameters
+    ----------
+    arg : str
+        A fuego argument, e.g. a query condition.
+
+    Returns
+    -------
+    str
+        The argument with each run of whitespace outside of quotes replaced by
+        one space, and no leading or trailing whitespace.
+
+    Examples
+    --------
+    >>> collapse_whitespace('name  ==  "a  b"')
+    'name == "a  b"'
+    """
+    # re.split puts the quoted literals at the odd indices.
+    parts = _QUOTED.split(arg)
+    parts[::2] = [re.sub(r"\s+", " ", part) for part in parts[::2]]
+    return "".join(parts).strip()
+
+
+def normalize_query(query: List[str]) -> List[str]:
+    """Normalize a fuego argv so that equivalent queries share a cache key.
+
+    Repeated whitespace in arguments is collapsed, except within quoted
+    values, and the ``--select`` fields, whose order does not change the
+    result, are sorted.
+
+    Parameters
+    ----------
+    query : List[str]
+        The fuego argv.
+
+    Returns
+    -------
+    List[str]
+        The normalized argv.
+
+    Examples
+    --------
+    >>> normalize_query(
+    ...     ["fuego", "query", "--select", "b", "--select", "a", "x  ==  1"]
+    ... )
+    ['fuego', 'query', 'x == 1', '--select', 'a', '--select', 'b']
+    """
+    args = [collapse_whitespace(arg) for arg in query]
+    selects = []
+    normalized = []
+    idx = 0
+    while idx < len(args):
+        if args[idx] == "--select" and idx + 1 < len(args):
+            selects.append(args[idx + 1])
+            idx += 2
+        else:
+            normalized.append(args[idx])
+            idx += 1
+
+    for select in sorted(selects):
+        normalized.extend(["--select", select])
+
+    return normalized
+
+
+def query_digest(query: List[str]) -> str:
+    """Return a digest identifying a fuego query and the database it targets.
+
+    The digest depends on the normalized argv (see ``normalize_query``) and
+    the credentials file, so the legacy and current databases never share
+    cached responses or checkpointed progress. ``--limit`` is part of the
+    argv, since a page cached at one size cannot stand in for another.
+
+    Parameters
+    ----------
+    query : List[str]
+        The fuego argv.
+
+    Returns
+    -------
+    str
+        The hex digest.
+    """
+    credentials = os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "")
+    if os.path.exists(credentials):
+        credentials = os.path.realpath(credentials)
+
+    payload = json.dumps({"argv": normalize_query(query), "credentials": credentials})
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+class ResponseCache:
+    """A content-addressed, on-disk cache of raw fuego output.
+
+    Entries are keyed by the normalized fuego argv and the credentials file
+    that fuego authenticates with, so the legacy and current databases never
+    share entries. Writes go to a temporary file that is atomically renamed
+    into place, so several roarquery processes can share one cache directory,
+    and one cache can be used by several threads.
+
+    Each page of a paginated query is cached under its ``--limit``. With
+    adaptive paging (``max_page_size`` in ``roarquery.utils.set_page_size``)
+    the size of each page depends on how long the earlier pages took, so a
+    repeated query may ask for different pages and miss the cache after its
+    first page. Use a fixed page size to reuse every cached page.
+
+    Parameters
+    ----------
+    cache_dir : str
+        The directory in which to store cached responses.
+
+    ttl : float, optional, default=86400
+        The number of seconds for which a cached response is reused. If None,
+        responses never expire.
+
+    max_size : int, optional, default=2**30
+        The maximum total size of the cache in bytes. When it is exceeded, the
+        oldest entries are evicted.
+
+    refresh : bool, optional, default=False
+        If True, ignore cached responses but still store fresh ones.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        ttl: Optional[float] = 86_400,
+        max_size: int = 2**30,
+        refresh: bool = False,
+    ) -> None:
+        """Initialize the cache."""
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        self.refresh = refresh
+        self._size: Optional[int] = None
+        self._lock = threading.RLock()
+
+    def key(self, query: List[str]) -> str:
+        """Return the cache key for a fuego query.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv.
+
+        Returns
+        -------
+        str
+            The hex digest identifying the query and credentials target.
+        """
+        return query_digest(query)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], key)
+
+    def _is_fresh(self, mtime: float) -> bool:
+        return self.ttl is None or time.time() - mtime < self.ttl
+
+    def get(self, query: List[str]) -> Optional[bytes]:
+        """Return the cached output for a query, if there is a fresh one.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv.
+
+        Returns
+        -------
+        bytes or None
+            The cached output, or None on a cache miss.
+        """
+        if self.refresh:
+            return None
+
+        path = self._path(self.key(query))
+        try:
+            if not self._is_fresh(os.path.getmtime(path)):
+                return None
+            with open(path, "rb") as fp:
+                return fp.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, query: List[str], output: bytes) -> None:
+        """Store the output of a query.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv.
+
+        output : bytes
+            The raw output of the query.
+        """
+        path = self._path(self.key(query))
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix=".tmp")
+        try:
+            with os.fdopen(fd, "wb") as fp:
+                fp.write(output)
+            with self._lock:
+                try:
+                    replaced = os.path.getsize(path)
+                except FileNotFoundError:
+                    replaced = 0
+                os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+        with self._lock:
+            if self._size is None:
+                self._size = sum(size for _, _, size in self._entries())
+            else:
+                self._size += len(output) - replaced
+
+            if self._size > self.max_size:
+                self.prune()
+
+    def _entries(self) -> List[Tuple[str, float, int]]:
+        entries = []
+        for root, _, files in os.walk(self.cache_dir):
+            for name in files:
+                if name.endswith(".tmp"):
+                    continue
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                entries.append((path, stat.st_mtime, stat.st_size))
+        return entries
+
+    def prune(self) -> None:
+        """Evict expired entries, then the oldest entries until under max_size."""
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[1])
+            size = sum(entry_size for _, _, entry_size in entries)
+            for path, mtime, entry_size in entries:
+                if self._is_fresh(mtime) and size <= self.max_size:
+                    break
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+                size -= entry_size
+
+            self._size = size
+
+    def clear(self) -> None:
+        """Remove every cached response."""
+        with self._lock:
+            for path, _, _ in self._entries():
+                try:
+                    os.unlink(path)
+                except FileNotFoundError:
+                    pass
+            self._size = 0
+
+
+def get_response_cache() -> Optional[ResponseCache]:
+    """Return the response cache used by fuego calls, if any.
+
+    Returns
+    -------
+    ResponseCache or None
+        The active response cache.
+    """
+    return _ACTIVE_CACHE
+
+
+def set_response_cache(cache: Optional[ResponseCache]) -> None:
+    """Set the response cache used by fuego calls.
+
+    Parameters
+    ----------
+    cache : ResponseCache or None
+        The cache to use. If None, caching is disabled.
+    """
+    global _ACTIVE_CACHE
+    _ACTIVE_CACHE = cache
+
+
+@contextmanager
+def use_response_cache(cache: Optional[ResponseCache]) -> Iterator[None]:
+    """Temporarily set the response cache used by fuego calls.
+
+    Parameters
+    ----------
+    cache : ResponseCache or None
+        The cache to use within the context.
+
+    Yields
+    ------
+    None
+    """
+    previous = get_response_cache()
+    set_response_cache(cache)
+    try:
+        yield
+    finally:
+        set_response_cache(previous)
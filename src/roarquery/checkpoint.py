@@ -0,0 +1,215 @@
+"""Record the progress of paginated queries so that exports can resume."""
+import json
+import os
+import threading
+from contextlib import contextmanager
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Tuple
+
+from .cache import query_digest
+
+
+_ACTIVE_CHECKPOINT: Optional["Checkpoint"] = None
+
+
+def query_key(query: List[str]) -> str:
+    """Return the key identifying a paginated query in a checkpoint.
+
+    The key depends on the credentials file, so the legacy and current
+    databases never share progress.
+
+    Parameters
+    ----------
+    query : List[str]
+        The fuego argv, without the ``--limit`` and ``--startafter`` that
+        ``iter_pages`` adds to fetch each page.
+
+    Returns
+    -------
+    str
+        The hex digest identifying the query.
+    """
+    return query_digest(query)
+
+
+class Checkpoint:
+    """The pages received so far by each paginated query, kept on disk.
+
+    Every page of a paginated query is appended to a JSON lines file for that
+    query, together with the ``--startafter`` cursor of the next page and
+    whether the query is complete. After a failure, a checkpoint opened with
+    ``resume=True`` replays the saved pages and continues each unfinished query
+    from its cursor, so the trials of runs that were already fetched are never
+    fetched again. A line cut short by a crash is ignored.
+
+    Parameters
+    ----------
+    directory : str
+        The directory in which to keep the progress. It is created if needed.
+
+    resume : bool, optional, default=False
+        If True, continue from the progress already in ``directory``.
+        Otherwise, each query starts over and overwrites its saved progress.
+    """
+
+    def __init__(self, directory: str, resume: bool = False) -> None:
+        """Initialize the checkpoint."""
+        self.directory = directory
+        self.resume = resume
+        self._started: Set[str] = set()
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, f"{key}.jsonl")
+
+    @staticmethod
+    def _read(path: str) -> List[Dict[str, Any]]:
+        """Read the saved pages, dropping a last line cut short by a crash."""
+        entries = []
+        offset = 0
+        with open(path, "rb") as fp:
+            for line in fp:
+                try:
+                    if not line.endswith(b"\n"):
+                        raise ValueError("Incomplete line.")
+                    entries.append(json.loads(line))
+                except ValueError:
+                    break
+                offset += len(line)
+
+        if offset < os.path.getsize(path):
+            os.truncate(path, offset)
+        return entries
+
+    def load(self, query: List[str]) -> Tuple[List[List[Any]], Optional[str], bool]:
+        """Return the saved progress of a query.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv.
+
+        Returns
+        -------
+        Tuple[List[List[Any]], str or None, bool]
+            The pages received so far, the cursor to continue from and
+            whether the query is complete. Without ``resume``, there is no
+            progress.
+        """
+        if not self.resume:
+            return [], None, False
+
+        key = query_key(query)
+        try:
+            entries = self._read(self._path(key))
+        except FileNotFoundError:
+            return [], None, False
+
+        with self._lock:
+            self._started.add(key)
+        if not entries:
+            return [], None, False
+        return (
+            [entry["documents"] for entry in entries],
+            entries[-1]["cursor"],
+            entries[-1]["complete"],
+        )
+
+    def save_page(
+        self,
+        query: List[str],
+        documents: List[Any],
+        cursor: Optional[str],
+        complete: bool,
+    ) -> None:
+        """Append a page to the progress of a query.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv.
+
+        documents : List[Any]
+            The documents in the page.
+
+        cursor : str, optional
+            The ``--startafter`` path of the next page.
+
+        complete : bool
+            Whether this is the last page of the query.
+        """
+        key = query_key(query)
+        line = json.dumps(
+            {"cursor": cursor, "complete": complete, "documents": documents}
+        )
+        with self._lock:
+            mode = "a" if key in self._started else "w"
+            self._started.add(key)
+            with open(self._path(key), mode) as fp:
+                fp.write(line + "\n")
+
+    def summary(self) -> Dict[str, int]:
+        """Count the saved queries that are complete and unfinished.
+
+        Returns
+        -------
+        Dict[str, int]
+            The number of "complete" and "unfinished" queries.
+        """
+        summary = {"complete": 0, "unfinished": 0}
+        for filename in os.listdir(self.directory):
+            if filename.endswith(".jsonl"):
+                entries = self._read(os.path.join(self.directory, filename))
+                complete = bool(entries) and entries[-1]["complete"]
+                summary["complete" if complete else "unfinished"] += 1
+        return summary
+
+
+def get_checkpoint() -> Optional[Checkpoint]:
+    """Return the checkpoint that paginated queries record their progress in.
+
+    Returns
+    -------
+    Checkpoint or None
+        The active checkpoint, if any.
+    """
+    return _ACTIVE_CHECKPOINT
+
+
+def set_checkpoint(checkpoint: Optional[Checkpoint]) -> None:
+    """Set the checkpoint that paginated queries record their progress in.
+
+    Parameters
+    ----------
+    checkpoint : Checkpoint or None
+        The checkpoint to use. If None, progress is not recorded.
+    """
+    global _ACTIVE_CHECKPOINT
+    _ACTIVE_CHECKPOINT = checkpoint
+
+
+@contextmanager
+def use_checkpoint(checkpoint: Optional[Checkpoint]) -> Iterator[None]:
+    """Temporarily record the progress of paginated queries in a checkpoint.
+
+    Parameters
+    ----------
+    checkpoint : Checkpoint or None
+        The checkpoint to use within the context.
+
+    Yields
+    ------
+    None
+    """
+    previous = get_checkpoint()
+    set_checkpoint(checkpoint)
+    try:
+        yield
+    finally:
+        set_checkpoint(previous)
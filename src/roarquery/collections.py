@@ -1,11 +1,11 @@
 """Query Firestore collections."""
-import subprocess  # nosec
 from typing import List
 
 from .utils import drop_empty
+from .utils import run_fuego
 
 
 def get_collections() -> List[str]:
     """Get collections from a database."""
-    output = subprocess.check_output(["fuego", "c"])  # nosec
+    output = run_fuego(["fuego", "c"])
     return drop_empty(output.decode("utf-8").split("\n"))
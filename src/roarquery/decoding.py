@@ -0,0 +1,187 @@
+"""Decode the JSON printed by fuego."""
+import json
+from typing import Any
+from typing import Callable
+from typing import Dict
+from typing import List
+from typing import Optional
+
+
+Decoder = Callable[[bytes], Any]
+
+# The fields of a fuego document and their types. ReadTime is not required,
+# since it is not part of the stored document.
+_DOCUMENT_FIELDS = {
+    "CreateTime": str,
+    "Data": dict,
+    "ID": str,
+    "Path": str,
+    "UpdateTime": str,
+}
+
+_DECODER: Optional[str] = None
+_VALIDATE = False
+
+
+class FuegoOutputError(ValueError):
+    """Raised when fuego output does not have the shape of fuego documents."""
+
+
+def _orjson_decoder() -> Decoder:
+    import orjson
+
+    return orjson.loads
+
+
+def _msgspec_decoder() -> Decoder:
+    import msgspec
+
+    decoder: Decoder = msgspec.json.Decoder().decode
+    return decoder
+
+
+def _json_decoder() -> Decoder:
+    return json.loads
+
+
+# The decoders, fastest first.
+_DECODER_FACTORIES: Dict[str, Callable[[], Decoder]] = {
+    "orjson": _orjson_decoder,
+    "msgspec": _msgspec_decoder,
+    "json": _json_decoder,
+}
+_DECODERS: Dict[str, Decoder] = {}
+_AVAILABLE: Optional[List[str]] = None
+
+
+def available_decoders() -> List[str]:
+    """Return the JSON decoders that are installed, fastest first.
+
+    Returns
+    -------
+    List[str]
+        The decoder names. "json" (the standard library) is always available.
+    """
+    global _AVAILABLE
+    if _AVAILABLE is None:
+        for name, factory in _DECODER_FACTORIES.items():
+            try:
+                _DECODERS[name] = factory()
+            except ImportError:
+                continue
+        _AVAILABLE = list(_DECODERS)
+
+    return list(_AVAILABLE)
+
+
+def get_json_decoder() -> str:
+    """Return the name of the JSON decoder used for fuego output.
+
+    Returns
+    -------
+    str
+        The decoder set with ``set_json_decoder``, or else the fastest
+        installed decoder.
+    """
+    if _DECODER is not None:
+        return _DECODER
+    return available_decoders()[0]
+
+
+def set_json_decoder(name: Optional[str] = None, validate: bool = False) -> None:
+    """Choose how fuego output is decoded.
+
+    Parameters
+    ----------
+    name : str, optional, default=None
+        One of "orjson", "msgspec" or "json". If None, the fastest installed
+        decoder is used. orjson is installed with the ``roarquery[fast]``
+        extra.
+
+    validate : bool, optional, default=False
+        If True, check that every decoded page has the shape of fuego
+        documents.
+
+    Raises
+    ------
+    ValueError
+        If the decoder is unknown or not installed.
+    """
+    global _DECODER, _VALIDATE
+    if name is not None and name not in available_decoders():
+        raise ValueError(
+            f"JSON decoder {name!r} is not available. "
+            f"Choose one of {available_decoders()}."
+        )
+
+    _DECODER = name
+    _VALIDATE = validate
+
+
+def validate_documents(documents: Any) -> None:
+    """Check that decoded fuego output has the shape of fuego documents.
+
+    Parameters
+    ----------
+    documents : Any
+        The decoded output of ``fuego query`` (a list of documents) or
+        ``fuego get`` (one document).
+
+    Raises
+    ------
+    FuegoOutputError
+        If a document is missing a field or a field has the wrong type.
+    """
+    if isinstance(documents, dict):
+        documents = [documents]
+    if not isinstance(documents, list):
+        raise FuegoOutputError(
+            f"Expected a list of documents, got {type(documents).__name__}"
+        )
+
+    for idx, document in enumerate(documents):
+        if not isinstance(document, dict):
+            raise FuegoOutputError(f"Document {idx} is not an object")
+        for field, field_type in _DOCUMENT_FIELDS.items():
+            if not isinstance(document.get(field), field_type):
+                raise FuegoOutputError(
+                    f"Document {idx} has no {field_type.__name__} field {field!r}"
+                )
+
+
+def decode_page(output: bytes, validate: Optional[bool] = None) -> Any:
+    """Decode one page of fuego output.
+
+    The bytes are parsed once, without first being decoded to ``str``.
+
+    Parameters
+    ----------
+    output : bytes
+        The raw output of fuego.
+
+    validate : bool, optional, default=None
+        Whether to check the shape of the documents. If None, use the setting
+        of ``set_json_decoder``.
+
+    Returns
+    -------
+    Any
+        The documents. Empty output decodes to an empty list.
+
+    Examples
+    --------
+    >>> decode_page(b'[{"ID": "1"}]')
+    [{'ID': '1'}]
+
+    >>> decode_page(b"")
+    []
+    """
+    if not output:
+        return []
+
+    documents = _DECODERS[get_json_decoder()](output)
+
+    if validate if validate is not None else _VALIDATE:
+        validate_documents(documents)
+
+    return documents
@@ -0,0 +1,424 @@
+"""Choose column dtypes for exported runs and trials."""
+from typing import Any
+from typing import Dict
+from typing import Mapping
+from typing import Optional
+
+import pandas as pd
+
+from .metrics import count
+from .metrics import timed
+
+
+TIMESTAMP_FIELDS = (
+    "CreateTime",
+    "UpdateTime",
+    "ReadTime",
+    "timeStarted",
+    "timeFinished",
+)
+CATEGORICAL_FIELDS = ("taskId", "variantId")
+BOOLEAN_VALUES = {True: True, False: False, "true": True, "false": False}
+INTEGER_DTYPES = {"Int8": 2**7, "Int16": 2**15, "Int32": 2**31, "Int64": 2**63}
+
+
+def field_name(column: str) -> str:
+    """Return the Firestore field name behind a DataFrame column.
+
+    Nested fields are flattened with "." and columns present in both runs and
+    trials get "_x"/"_y" suffixes when they are merged; both are removed.
+
+    Parameters
+    ----------
+    column : str
+        The column name.
+
+    Returns
+    -------
+    str
+        The field name.
+
+    Examples
+    --------
+    >>> field_name("user.CreateTime")
+    'CreateTime'
+
+    >>> field_name("CreateTime_y")
+    'CreateTime'
+    """
+    name = str(column).rsplit(".", 1)[-1]
+    if name.endswith(("_x", "_y")):
+        name = name[:-2]
+    return name
+
+
+def is_timestamp_column(column: str) -> bool:
+    """Return True if a column holds one of the ``TIMESTAMP_FIELDS``.
+
+    Parameters
+    ----------
+    column : str
+        The column name.
+
+    Returns
+    -------
+    bool
+        Whether the column is a timestamp column.
+    """
+    return field_name(column) in TIMESTAMP_FIELDS
+
+
+def parse_timestamps(df: pd.DataFrame) -> pd.DataFrame:
+    """Parse every timestamp column into tz-aware ``datetime64[ns, UTC]``.
+
+    Each column is parsed with one vectorized ``pd.to_datetime`` call rather
+    than one ``isoparse`` call per value. Values that cannot be parsed become
+    ``NaT``.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The runs or trials.
+
+    Returns
+    -------
+    pd.DataFrame
+        A shallow copy of ``df`` with parsed timestamp columns.
+    """
+    df = df.copy(deep=False)
+    with timed("parse timestamps"):
+        for column in df.columns:
+            if is_timestamp_column(column):
+                df[column] = pd.to_datetime(df[column], utc=True, errors="coerce")
+
+    return df
+
+
+def _is_boolean(values: pd.Series) -> bool:
+    """Return True if every non-null value is a boolean or "true"/"false"."""
+    non_null = values.dropna()
+    if non_null.empty:
+        return False
+
+    def is_bool(value: Any) -> bool:
+        return isinstance(value, (bool, str)) and value in BOOLEAN_VALUES
+
+    return bool(non_null.map(is_bool).all())
+
+
+def preserve_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Give exported columns the dtypes that their values represent.
+
+    Fuego returns every value as JSON, so timestamps arrive as ISO strings and
+    booleans sometimes as "true"/"false". Columnar formats can store the real
+    types, so this converts
+
+    - timestamp fields (``CreateTime``, ``timeStarted``, ...) to tz-aware
+      ``datetime64[ns, UTC]``,
+    - boolean-valued object columns to the nullable ``boolean`` dtype, and
+    - ``taskId``/``variantId`` columns to ``category``.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The runs or trials.
+
+    Returns
+    -------
+    pd.DataFrame
+        A shallow copy of ``df`` with converted columns.
+    """
+    df = parse_timestamps(df)
+    for column in df.columns:
+        name = field_name(column)
+        values = df[column]
+        if name in CATEGORICAL_FIELDS:
+            df[column] = values.astype("category")
+        elif values.dtype == object and _is_boolean(values):
+            df[column] = values.map(BOOLEAN_VALUES).astype("boolean")
+
+    return df
+
+
+def _is_numbers(values: pd.Series) -> bool:
+    """Return True if every non-null value is an int or a float (not a bool)."""
+    non_null = values.dropna()
+    if non_null.empty:
+        return False
+
+    def is_number(value: Any) -> bool:
+        return pd.api.types.is_number(value) and not pd.api.types.is_bool(value)
+
+    return bool(non_null.map(is_number).all())
+
+
+def _is_strings(values: pd.Series) -> bool:
+    """Return True if every non-null value is a string."""
+    non_null = values.dropna()
+    return not non_null.empty and bool(non_null.map(type).eq(str).all())
+
+
+def numeric_dtype(values: pd.Series) -> str:
+    """Return the smallest dtype that holds a numeric column without loss.
+
+    Whole numbers get the smallest nullable integer dtype that holds them,
+    and other numbers ``float32`` if every value survives the conversion,
+    otherwise ``float64``.
+
+    Parameters
+    ----------
+    values : pd.Series
+        The numeric column.
+
+    Returns
+    -------
+    str
+        The dtype.
+
+    Examples
+    --------
+    >>> numeric_dtype(pd.Series([1.0, None, 300.0]))
+    'Int16'
+
+    >>> numeric_dtype(pd.Series([0.5, 0.1]))
+    'float64'
+    """
+    non_null = values.dropna().astype("float64")
+    if non_null.empty:
+        return "Int8"
+
+    if bool((non_null % 1 == 0).all()):
+        low, high = non_null.min(), non_null.max()
+        for dtype, bound in INTEGER_DTYPES.items():
+            if -bound <= low and high < bound:
+                return dtype
+
+    if bool((non_null.astype("float32") == non_null).all()):
+        return "float32"
+    return "float64"
+
+
+class DtypeCompactor:
+    """Convert runs or trials to compact dtypes, consistently across chunks.
+
+    Fuego returns every value as JSON, so most columns arrive as ``object``.
+    The compactor converts
+
+    - ``taskId``/``variantId`` and other string columns with few distinct
+      values to ``category``,
+    - boolean-valued columns to the nullable ``boolean`` dtype, and
+    - numeric (and object columns of numbers) to the smallest nullable
+      integer dtype, or to ``float32`` if no value changes, else ``float64``.
+
+    Other columns, e.g. timestamps, lists and IDs, are left as they are.
+
+    The dtype of each column is chosen once and every later chunk is
+    converted to it, so the chunks of a streamed query share their dtypes
+    and can be concatenated or written together. The dtype of a column is
+    chosen by ``dtypes`` if it is declared there, else by ``fit``, which sees
+    all of its values, else by the first chunk that has values for it. A
+    chunk cannot tell which values later chunks hold, so the dtypes chosen by
+    a chunk are only as narrow as is safe: booleans become ``boolean``, whole
+    numbers ``Int64`` and other numbers ``float64``, and strings are left as
+    they are, so streamed string columns only become categories if they are
+    declared or fitted. If a later chunk has a value that does not fit, e.g.
+    a fraction in an ``Int64`` column or a new category, the dtype is widened
+    rather than failing the stream: numeric dtypes to ``float64`` and any
+    other dtype to ``object``. The chunks before it keep the narrower dtype.
+    ``memory_before`` and ``memory_after`` hold the total memory of the
+    chunks, which is also counted by the active ``Metrics``.
+
+    Parameters
+    ----------
+    max_categories : int, optional, default=1000
+        The largest number of distinct values of a categorical column.
+
+    category_ratio : float, optional, default=0.5
+        The largest fraction of distinct values among the non-null values of
+        a categorical column.
+
+    dtypes : Mapping[str, Any], optional, default=None
+        The dtypes of some columns, keyed by column name, e.g.
+        ``{"taskId": pd.CategoricalDtype(["pa", "sre", "swr"])}``. Each is a
+        ``pd.CategoricalDtype``, ``"boolean"``, a numeric dtype, or None to
+        leave the column as it is.
+    """
+
+    def __init__(
+        self,
+        max_categories: int = 1000,
+        category_ratio: float = 0.5,
+        dtypes: Optional[Mapping[str, Any]] = None,
+    ) -> None:
+        """Initialize the compactor."""
+        self.max_categories = max_categories
+        self.category_ratio = category_ratio
+        self.dtypes: Dict[str, Any] = dict(dtypes) if dtypes is not None else {}
+        self.memory_before = 0
+        self.memory_after = 0
+
+    def fit(self, df: pd.DataFrame) -> None:
+        """Fix the dtypes of the columns that have none yet from all their values.
+
+        Call it before converting the chunks of a stream whose values are
+        known up front, e.g. the runs whose trials are streamed, so that their
+        columns get the smallest dtypes and categories that hold every value.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            Every row of the runs or trials, or at least every distinct value
+            of the columns to fix.
+        """
+        for column in df.columns:
+            self._fix_dtype(str(column), df[column], complete=True)
+
+    def compact(self, df: pd.DataFrame) -> pd.DataFrame:
+        """Convert a chunk to the compact dtypes.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The runs or trials.
+
+        Returns
+        -------
+        pd.DataFrame
+            A shallow copy of ``df`` with converted columns.
+
+        """
+        memory_before = int(df.memory_usage(deep=True).sum())
+        with timed("compact dtypes"):
+            df = df.copy(deep=False)
+            for column in df.columns:
+                name = str(column)
+                self._fix_dtype(name, df[column], complete=False)
+                converted = self._convert_or_widen(name, df[column])
+                if converted is not None:
+                    df[column] = converted
+
+        memory_after = int(df.memory_usage(deep=True).sum())
+        self.memory_before += memory_before
+        self.memory_after += memory_after
+        count("bytes before compaction", memory_before)
+        count("bytes after compaction", memory_after)
+        return df
+
+    def _fix_dtype(self, column: str, values: pd.Series, complete: bool) -> None:
+        """Fix the dtype of a column, unless it is fixed or has no values."""
+        if column not in self.dtypes and not values.isna().all():
+            self.dtypes[column] = self._choose_dtype(column, values, complete)
+
+    def _choose_dtype(self, column: str, values: pd.Series, complete: bool) -> Any:
+        """Return the compact dtype of a column, or None to leave it alone.
+
+        Categories and the smallest numeric dtypes are only chosen if the
+        values are ``complete``.
+        """
+        if pd.api.types.is_bool_dtype(values.dtype) or (
+            values.dtype == object and _is_boolean(values)
+        ):
+            return "boolean"
+        if pd.api.types.is_numeric_dtype(values.dtype) or (
+            values.dtype == object and _is_numbers(values)
+        ):
+            dtype = numeric_dtype(pd.to_numeric(values))
+            if complete:
+                return dtype
+            return "Int64" if dtype in INTEGER_DTYPES else "float64"
+        if not complete:
+            return None
+        if isinstance(values.dtype, pd.CategoricalDtype):
+            return values.dtype
+        if values.dtype == object and _is_strings(values):
+            n_values = values.nunique()
+            if field_name(column) in CATEGORICAL_FIELDS or (
+                n_values <= self.max_categories
+                and n_values <= self.category_ratio * values.count()
+            ):
+                return pd.CategoricalDtype(sorted(values.dropna().unique()))
+        return None
+
+    def _convert_or_widen(self, column: str, values: pd.Series) -> Optional[pd.Series]:
+        """Convert a column to its dtype, widening the dtype if it does not fit.
+
+        Returns None, leaving the column as it is, if its dtype is None. A
+        dtype widened to ``object`` holds any value.
+        """
+        dtype = self.dtypes.get(column)
+        while dtype is not None:
+            converted = self._convert(values, dtype)
+            if converted is not None:
+                return converted
+
+            # Widen the dtype rather than fail partway through a stream.
+            # Numbers widen to float64, anything else to object.
+            numeric = str(dtype) in INTEGER_DTYPES or str(dtype) == "float32"
+            dtype = self.dtypes[column] = "float64" if numeric else "object"
+            count("dtypes widened")
+        return None
+
+    @staticmethod
+    def _convert(values: pd.Series, dtype: Any) -> Optional[pd.Series]:
+        """Convert a column to its dtype, or return None if it does not fit."""
+        if isinstance(dtype, pd.CategoricalDtype):
+            return _to_category(values, dtype)
+        if str(dtype) == "boolean":
+            return _to_boolean(values)
+        if str(dtype) == "object":
+            return values.astype(object)
+        return _to_numeric(values, dtype)
+
+
+def _to_category(values: pd.Series, dtype: pd.CategoricalDtype) -> Optional[pd.Series]:
+    values = values.astype(object)
+    if not set(values.dropna().unique()) <= set(dtype.categories):
+        return None
+    return values.astype(dtype)
+
+
+def _to_boolean(values: pd.Series) -> Optional[pd.Series]:
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return values.astype("boolean")
+    if not (_is_boolean(values) or values.isna().all()):
+        return None
+    return values.map(BOOLEAN_VALUES).astype("boolean")
+
+
+def _to_numeric(values: pd.Series, dtype: Any) -> Optional[pd.Series]:
+    if pd.api.types.is_bool_dtype(values.dtype):
+        return None
+    if values.dtype == object and not (_is_numbers(values) or values.isna().all()):
+        return None
+
+    numbers = pd.to_numeric(values)
+    non_null = numbers.dropna()
+    try:
+        # Converting back and forth must not change any value.
+        if not bool((non_null.astype(dtype) == non_null).all()):
+            return None
+    except (TypeError, ValueError, OverflowError):
+        return None
+    return numbers.astype(dtype)
+
+
+def compact_dtypes(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert runs or trials to compact dtypes.
+
+    See ``DtypeCompactor``, which also converts a stream of chunks
+    consistently. Every value of ``df`` is known, so its columns get the
+    smallest dtypes and categories that hold them.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        The runs or trials.
+
+    Returns
+    -------
+    pd.DataFrame
+        A shallow copy of ``df`` with converted columns.
+    """
+    compactor = DtypeCompactor()
+    compactor.fit(df)
+    return compactor.compact(df)
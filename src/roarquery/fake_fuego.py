@@ -0,0 +1,269 @@
+"""A stand-in for the fuego executable that serves a local dataset.
+
+Put an executable named ``fuego`` that runs ``python -m roarquery.fake_fuego``
+first on ``PATH`` (``benchmarks/bin/fuego`` is one) to run roarquery offline.
+The dataset is a directory laid out like the database, as written by
+``LocalBackend.save``. ``query`` (with ``-g``, ``--limit``, ``--startafter``,
+``--select`` and filter conditions), ``get`` and ``c`` are answered the way
+``LocalBackend`` answers them, reading only the files that the command needs.
+
+The fake is configured with environment variables, since its command line
+must match fuego's:
+
+``FAKE_FUEGO_ROOT``
+    The dataset directory. Required.
+``FAKE_FUEGO_LATENCY``, ``FAKE_FUEGO_JITTER``
+    Seconds to wait before answering, plus a uniformly random extra delay of
+    up to the jitter.
+``FAKE_FUEGO_ERROR_RATE``
+    The probability that a call fails with a throttling (quota) error.
+``FAKE_FUEGO_TIMEOUT_RATE``, ``FAKE_FUEGO_TIMEOUT``
+    The probability that a call hangs for ``FAKE_FUEGO_TIMEOUT`` seconds
+    (default 10) and then fails with a deadline error.
+``FAKE_FUEGO_LOG``
+    If set, a JSON line describing every call (argv, seconds, bytes, error)
+    is appended to this file.
+"""
+import json
+import os
+import random
+import sys
+import time
+from typing import Iterator
+from typing import List
+from typing import Mapping
+from typing import Optional
+
+from .backends import Backend
+from .backends import BackendError
+from .backends import FuegoCommand
+from .backends import LocalBackend
+from .backends import path_key
+from .backends import TransientBackendError
+
+
+THROTTLED_MESSAGE = (
+    "rpc error: code = ResourceExhausted desc = Quota exceeded. (fake fuego)"
+)
+TIMEOUT_MESSAGE = (
+    "rpc error: code = DeadlineExceeded desc = context deadline exceeded. "
+    "(fake fuego)"
+)
+
+
+class FakeFuego(Backend):
+    """Answer fuego commands from a local dataset, with injected faults.
+
+    Parameters
+    ----------
+    root : str
+        The dataset directory, as written by ``LocalBackend.save``.
+
+    latency : float, optional, default=0.0
+        Seconds to wait before answering each call.
+
+    jitter : float, optional, default=0.0
+        The largest random extra delay, in seconds.
+
+    error_rate : float, optional, default=0.0
+        The probability that a call fails with a throttling error.
+
+    timeout_rate : float, optional, default=0.0
+        The probability that a call waits ``timeout`` seconds and then fails
+        with a deadline error.
+
+    timeout : float, optional, default=10.0
+        How long a timed out call waits.
+
+    rng : random.Random, optional, default=None
+        The source of randomness for the jitter and the injected faults.
+    """
+
+    def __init__(
+        self,
+        root: str,
+        latency: float = 0.0,
+        jitter: float = 0.0,
+        error_rate: float = 0.0,
+        timeout_rate: float = 0.0,
+        timeout: float = 10.0,
+        rng: Optional[random.Random] = None,
+    ) -> None:
+        """Initialize the fake."""
+        self.root = root
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.timeout_rate = timeout_rate
+        self.timeout = timeout
+        self.rng = rng if rng is not None else random.Random()
+
+    @classmethod
+    def from_env(cls, environ: Mapping[str, str]) -> "FakeFuego":
+        """Configure a fake from ``FAKE_FUEGO_*`` environment variables.
+
+        Parameters
+        ----------
+        environ : Mapping[str, str]
+            The environment, usually ``os.environ``.
+
+        Returns
+        -------
+        FakeFuego
+            The fake.
+
+        Raises
+        ------
+        BackendError
+            If ``FAKE_FUEGO_ROOT`` is not set.
+        """
+        if not environ.get("FAKE_FUEGO_ROOT"):
+            raise BackendError("Set FAKE_FUEGO_ROOT to the fake fuego dataset.")
+
+        def number(name: str, default: float = 0.0) -> float:
+            return float(environ.get(name) or default)
+
+        return cls(
+            environ["FAKE_FUEGO_ROOT"],
+            latency=number("FAKE_FUEGO_LATENCY"),
+            jitter=number("FAKE_FUEGO_JITTER"),
+            error_rate=number("FAKE_FUEGO_ERROR_RATE"),
+            timeout_rate=number("FAKE_FUEGO_TIMEOUT_RATE"),
+            timeout=number("FAKE_FUEGO_TIMEOUT", 10.0),
+        )
+
+    def _files(self, command: FuegoCommand) -> Iterator[str]:
+        """Yield the files holding the documents that a command may return."""
+        if command.command == "get":
+            full_path = os.path.join(self.root, *command.path.split("/")) + ".json"
+            if os.path.isfile(full_path):
+                yield full_path
+            return
+
+        if command.group:
+            directories = [
+                dirpath
+                for dirpath, _, _ in os.walk(self.root)
+                if os.path.basename(dirpath) == command.path
+            ]
+        else:
+            directories = [os.path.join(self.root, *command.path.strip("/").split("/"))]
+
+        for directory in directories:
+            if not os.path.isdir(directory):
+                continue
+            for filename in os.listdir(directory):
+                full_path = os.path.join(directory, filename)
+                if filename.endswith(".json") and os.path.isfile(full_path):
+                    yield full_path
+
+    def _document_path(self, full_path: str) -> str:
+        path = os.path.relpath(full_path, self.root)[: -len(".json")]
+        return path.replace(os.sep, "/")
+
+    def _load(self, command: FuegoCommand) -> LocalBackend:
+        """Load the documents that a command may return.
+
+        Documents are ordered like ``LocalBackend`` orders them, by path
+        segment. Documents at or before ``--startafter`` are skipped, and without
+        filter conditions only the first ``--limit`` documents are read.
+        """
+        files = sorted(
+            ((self._document_path(path), path) for path in self._files(command)),
+            key=lambda item: path_key(item[0]),
+        )
+        if command.start_after is not None:
+            start_after = path_key(command.start_after)
+            files = [item for item in files if path_key(item[0]) > start_after]
+        if not command.conditions and command.limit is not None:
+            files = files[: command.limit]
+
+        backend = LocalBackend()
+        for _, full_path in files:
+            backend.load_file(self.root, full_path)
+        return backend
+
+    def _collections(self) -> bytes:
+        names = sorted(
+            {
+                name[: -len(".json")] if name.endswith(".json") else name
+                for name in os.listdir(self.root)
+            }
+        )
+        return "".join(f"{name}\n" for name in names).encode("utf-8")
+
+    def _inject_faults(self) -> None:
+        time.sleep(self.latency + self.rng.uniform(0, self.jitter))
+
+        if self.rng.random() < self.timeout_rate:
+            time.sleep(self.timeout)
+            raise TransientBackendError(TIMEOUT_MESSAGE)
+        if self.rng.random() < self.error_rate:
+            raise TransientBackendError(THROTTLED_MESSAGE)
+
+    def run(self, query: List[str]) -> bytes:
+        """Execute a fuego command against the dataset.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv, starting with "fuego".
+
+        Returns
+        -------
+        bytes
+            The output that fuego would have printed.
+        """
+        command = FuegoCommand(query)
+        self._inject_faults()
+
+        if command.command in ("c", "collections"):
+            return self._collections()
+
+        return self._load(command).run(query)
+
+
+def _log_call(
+    log_path: str, argv: List[str], seconds: float, n_bytes: int, error: str
+) -> None:
+    record = {"argv": argv, "seconds": seconds, "bytes": n_bytes, "error": error}
+    with open(log_path, "a") as fp:
+        fp.write(json.dumps(record) + "\n")
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """Run one fuego command, like the fuego executable.
+
+    Parameters
+    ----------
+    argv : List[str], optional, default=None
+        The arguments after the program name. Defaults to ``sys.argv[1:]``.
+
+    Returns
+    -------
+    int
+        The exit status: 0 on success and 1 if the command failed.
+    """
+    argv = sys.argv[1:] if argv is None else argv
+    start = time.perf_counter()
+    output = b""
+    error = ""
+    try:
+        output = FakeFuego.from_env(os.environ).run(["fuego", *argv])
+    except BackendError as exc:
+        error = str(exc)
+        print(error, file=sys.stderr)
+
+    log_path = os.environ.get("FAKE_FUEGO_LOG")
+    if log_path:
+        _log_call(log_path, argv, time.perf_counter() - start, len(output), error)
+
+    if error:
+        return 1
+    sys.stdout.buffer.write(output)
+    sys.stdout.flush()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
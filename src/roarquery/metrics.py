@@ -0,0 +1,365 @@
+"""Record where the time goes in a query.
+
+Phases of a query are marked with ``timed``. They are summed per phase by the
+active ``Metrics`` (``--stats``) and recorded one span at a time by the active
+``Trace`` (``--trace``), which can be viewed as a timeline in Perfetto or
+``chrome://tracing``.
+"""
+import json
+import os
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any
+from typing import Dict
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+
+_ACTIVE_METRICS: Optional["Metrics"] = None
+_ACTIVE_TRACE: Optional["Trace"] = None
+
+
+def peak_rss_mib() -> Optional[float]:
+    """Return the peak resident memory of this process, in MiB.
+
+    Returns
+    -------
+    float or None
+        The peak RSS, or None on platforms without ``resource``.
+    """
+    try:
+        import resource
+    except ImportError:  # pragma: no cover
+        return None
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in KiB on Linux and in bytes on macOS.
+    return float(peak / 2**20 if sys.platform == "darwin" else peak / 2**10)
+
+
+class Metrics:
+    """Per-phase timings and counters for one query.
+
+    Phases are timed with ``timed`` and counters are incremented with
+    ``count``; both do nothing unless a ``Metrics`` is active (see
+    ``use_metrics``). Phases can nest, e.g. the ``fuego`` calls made while
+    fetching trials are also part of ``fetch trials``. Phases that run in
+    several threads at once report the total time spent in all of them, which
+    can exceed the wall time.
+    """
+
+    def __init__(self) -> None:
+        """Start recording."""
+        self.start = time.perf_counter()
+        self.phases: Dict[str, List[float]] = {}
+        self.counters: Dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def add_time(self, phase: str, seconds: float) -> None:
+        """Add one timed call of a phase.
+
+        Parameters
+        ----------
+        phase : str
+            The name of the phase.
+
+        seconds : float
+            The time spent in the call.
+        """
+        with self._lock:
+            calls_seconds = self.phases.setdefault(phase, [0, 0.0])
+            calls_seconds[0] += 1
+            calls_seconds[1] += seconds
+
+    def increment(self, counter: str, value: int = 1) -> None:
+        """Increment a counter.
+
+        Parameters
+        ----------
+        counter : str
+            The name of the counter.
+
+        value : int, optional, default=1
+            The amount to add.
+        """
+        with self._lock:
+            self.counters[counter] = self.counters.get(counter, 0) + value
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the metrics as JSON-serializable data.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The wall time, the calls and seconds of each phase, the counters
+            and the peak RSS of the process.
+        """
+        with self._lock:
+            return {
+                "wall_seconds": time.perf_counter() - self.start,
+                "phases": {
+                    phase: {"calls": int(calls), "seconds": seconds}
+                    for phase, (calls, seconds) in self.phases.items()
+                },
+                "counters": dict(self.counters),
+                "peak_rss_mib": peak_rss_mib(),
+            }
+
+    def report(self) -> str:
+        """Format the metrics as a table.
+
+        Returns
+        -------
+        str
+            The report.
+        """
+        stats = self.to_dict()
+        lines = [f"{'phase':<24}{'calls':>10}{'seconds':>12}"]
+        for phase, phase_stats in sorted(
+            stats["phases"].items(), key=lambda item: -item[1]["seconds"]
+        ):
+            lines.append(
+                f"{phase:<24}{phase_stats['calls']:>10}{phase_stats['seconds']:>12.3f}"
+            )
+        lines.append(f"{'total (wall)':<24}{'':>10}{stats['wall_seconds']:>12.3f}")
+        lines.append("")
+        for counter, value in sorted(stats["counters"].items()):
+            lines.append(f"{counter:<24}{value:>22,}")
+        if stats["peak_rss_mib"] is not None:
+            lines.append(f"{'peak RSS (MiB)':<24}{stats['peak_rss_mib']:>22,.1f}")
+        return "\n".join(lines)
+
+
+class Trace:
+    """A timeline of the phases of a query, in the Chrome trace-event format.
+
+    Each ``timed`` phase becomes a complete ("X") event on the track of the
+    thread that ran it, so phases nest as they did at run time and parallel
+    fetches show up side by side. The keyword arguments given to ``timed``
+    and any added to the span while it runs are shown as the event's args.
+    """
+
+    def __init__(self) -> None:
+        """Start recording."""
+        self.start = time.perf_counter()
+        self.events: List[Dict[str, Any]] = []
+        self._threads: Dict[int, Tuple[int, str]] = {}
+        self._lock = threading.Lock()
+
+    def add_span(
+        self, name: str, start: float, end: float, args: Dict[str, Any]
+    ) -> None:
+        """Add a span that ran in the current thread.
+
+        Parameters
+        ----------
+        name : str
+            The name of the phase.
+
+        start : float
+            When the span started, in ``time.perf_counter`` seconds.
+
+        end : float
+            When the span ended, in ``time.perf_counter`` seconds.
+
+        args : Dict[str, Any]
+            JSON-serializable details of the span.
+        """
+        thread = threading.current_thread()
+        with self._lock:
+            tid, _ = self._threads.setdefault(
+                threading.get_ident(), (len(self._threads) + 1, thread.name)
+            )
+            self.events.append(
+                {
+                    "name": name,
+                    "cat": "roarquery",
+                    "ph": "X",
+                    "ts": (start - self.start) * 1e6,
+                    "dur": (end - start) * 1e6,
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": dict(args),
+                }
+            )
+
+    def to_dict(self) -> Dict[str, Any]:
+        """Return the trace in the Chrome trace-event format.
+
+        Returns
+        -------
+        Dict[str, Any]
+            The trace events, preceded by the names of the threads.
+        """
+        with self._lock:
+            thread_names = [
+                {
+                    "name": "thread_name",
+                    "ph": "M",
+                    "pid": os.getpid(),
+                    "tid": tid,
+                    "args": {"name": name},
+                }
+                for tid, name in self._threads.values()
+            ]
+            return {
+                "traceEvents": thread_names + self.events,
+                "displayTimeUnit": "ms",
+            }
+
+    def save(self, path: str) -> None:
+        """Write the trace to a JSON file.
+
+        Parameters
+        ----------
+        path : str
+            The file to write.
+        """
+        with open(path, "w") as fp:
+            json.dump(self.to_dict(), fp)
+
+
+def get_metrics() -> Optional[Metrics]:
+    """Return the metrics being recorded, if any.
+
+    Returns
+    -------
+    Metrics or None
+        The active metrics.
+    """
+    return _ACTIVE_METRICS
+
+
+def set_metrics(metrics: Optional[Metrics]) -> None:
+    """Set the metrics that query phases are recorded to.
+
+    Parameters
+    ----------
+    metrics : Metrics or None
+        The metrics to record to. If None, nothing is recorded.
+    """
+    global _ACTIVE_METRICS
+    _ACTIVE_METRICS = metrics
+
+
+@contextmanager
+def use_metrics(metrics: Optional[Metrics]) -> Iterator[None]:
+    """Temporarily record query phases to some metrics.
+
+    Parameters
+    ----------
+    metrics : Metrics or None
+        The metrics to record to within the context.
+
+    Yields
+    ------
+    None
+    """
+    previous = get_metrics()
+    set_metrics(metrics)
+    try:
+        yield
+    finally:
+        set_metrics(previous)
+
+
+def get_trace() -> Optional[Trace]:
+    """Return the trace being recorded, if any.
+
+    Returns
+    -------
+    Trace or None
+        The active trace.
+    """
+    return _ACTIVE_TRACE
+
+
+def set_trace(trace: Optional[Trace]) -> None:
+    """Set the trace that query phases are recorded to.
+
+    Parameters
+    ----------
+    trace : Trace or None
+        The trace to record to. If None, no trace is recorded.
+    """
+    global _ACTIVE_TRACE
+    _ACTIVE_TRACE = trace
+
+
+@contextmanager
+def use_trace(trace: Optional[Trace]) -> Iterator[None]:
+    """Temporarily record query phases to a trace.
+
+    Parameters
+    ----------
+    trace : Trace or None
+        The trace to record to within the context.
+
+    Yields
+    ------
+    None
+    """
+    previous = get_trace()
+    set_trace(trace)
+    try:
+        yield
+    finally:
+        set_trace(previous)
+
+
+@contextmanager
+def timed(phase: str, **args: Any) -> Iterator[Dict[str, Any]]:
+    """Time a phase of a query, if metrics or a trace are being recorded.
+
+    Parameters
+    ----------
+    phase : str
+        The name of the phase, e.g. "decode".
+
+    **args : Any
+        JSON-serializable details of this call of the phase, for the trace.
+
+    Yields
+    ------
+    Dict[str, Any]
+        The details, to which more can be added while the phase runs. If the
+        phase raises, its error is added as "error".
+    """
+    metrics = _ACTIVE_METRICS
+    trace = _ACTIVE_TRACE
+    if metrics is None and trace is None:
+        yield args
+        return
+
+    start = time.perf_counter()
+    try:
+        yield args
+    except BaseException as exc:
+        args["error"] = repr(exc)
+        raise
+    finally:
+        end = time.perf_counter()
+        if metrics is not None:
+            metrics.add_time(phase, end - start)
+        if trace is not None:
+            trace.add_span(phase, start, end, args)
+
+
+def count(counter: str, value: int = 1) -> None:
+    """Increment a counter, if metrics are being recorded.
+
+    Parameters
+    ----------
+    counter : str
+        The name of the counter, e.g. "fuego calls".
+
+    value : int, optional, default=1
+        The amount to add.
+    """
+    metrics = _ACTIVE_METRICS
+    if metrics is not None:
+        metrics.increment(counter, value)
@@ -0,0 +1,198 @@
+"""Retry failed fuego calls with exponential backoff."""
+import asyncio
+import random
+import subprocess  # nosec
+import time
+from contextlib import contextmanager
+from typing import Awaitable
+from typing import Callable
+from typing import Iterator
+from typing import Optional
+from typing import Tuple
+from typing import Type
+from typing import TypeVar
+
+from .backends import TransientBackendError
+from .metrics import count
+from .metrics import timed
+
+
+_ACTIVE_POLICY: Optional["RetryPolicy"] = None
+
+_R = TypeVar("_R")
+
+# fuego exits with a non-zero status on quota, deadline and network errors,
+# and the in-process backends raise TransientBackendError for them. Other
+# BackendErrors, such as a missing document, fail the same way every time.
+RETRYABLE_ERRORS: Tuple[Type[Exception], ...] = (
+    subprocess.CalledProcessError,
+    TransientBackendError,
+)
+
+
+class RetryPolicy:
+    """Retry a failed call after exponentially growing, jittered delays.
+
+    The delay before retry ``n`` (counting from 1) is drawn uniformly from
+    ``[0, min(max_delay, base_delay * 2 ** (n - 1))]`` ("full jitter"), so
+    that many workers throttled at the same moment do not retry in lockstep.
+
+    Parameters
+    ----------
+    max_attempts : int, optional, default=4
+        The number of attempts, including the first one.
+
+    base_delay : float, optional, default=1.0
+        The longest delay before the first retry, in seconds.
+
+    max_delay : float, optional, default=60.0
+        The longest delay before any retry, in seconds.
+
+    retryable : Tuple[Type[Exception], ...], optional
+        The exceptions to retry. Defaults to ``RETRYABLE_ERRORS``.
+
+    rng : random.Random, optional, default=None
+        The source of randomness for the jitter.
+
+    sleep : Callable[[float], None], optional, default=time.sleep
+        The function used to wait between attempts.
+    """
+
+    def __init__(
+        self,
+        max_attempts: int = 4,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        retryable: Tuple[Type[Exception], ...] = RETRYABLE_ERRORS,
+        rng: Optional[random.Random] = None,
+        sleep: Callable[[float], None] = time.sleep,
+    ) -> None:
+        """Initialize the policy."""
+        self.max_attempts = max(max_attempts, 1)
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.retryable = retryable
+        self.rng = rng if rng is not None else random.Random()
+        self.sleep = sleep
+
+    def delay(self, retry: int) -> float:
+        """Return the delay before a retry.
+
+        Parameters
+        ----------
+        retry : int
+            The number of the retry, starting at 1.
+
+        Returns
+        -------
+        float
+            The delay in seconds.
+        """
+        return self.rng.uniform(
+            0, min(self.max_delay, self.base_delay * 2 ** (retry - 1))
+        )
+
+    def call(self, func: Callable[[], _R]) -> _R:
+        """Call a function, retrying it if it raises a retryable error.
+
+        Parameters
+        ----------
+        func : Callable[[], Any]
+            The function to call.
+
+        Returns
+        -------
+        Any
+            The result of the first successful call.
+
+        Raises
+        ------
+        Exception
+            The error of the last attempt, once every attempt has failed, or
+            any error that is not retryable.
+        """
+        for retry in range(1, self.max_attempts):
+            try:
+                return func()
+            except self.retryable as exc:
+                delay = self.delay(retry)
+                count("fuego retries")
+                with timed("backoff", retry=retry, seconds=delay, cause=repr(exc)):
+                    self.sleep(delay)
+        return func()
+
+    async def call_async(self, func: Callable[[], Awaitable[_R]]) -> _R:
+        """Await a coroutine function, retrying it like ``call``.
+
+        The delays are awaited with ``asyncio.sleep``, so other calls proceed
+        while this one backs off.
+
+        Parameters
+        ----------
+        func : Callable[[], Awaitable[Any]]
+            The coroutine function to await.
+
+        Returns
+        -------
+        Any
+            The result of the first successful call.
+
+        Raises
+        ------
+        Exception
+            The error of the last attempt, once every attempt has failed, or
+            any error that is not retryable.
+        """
+        for retry in range(1, self.max_attempts):
+            try:
+                return await func()
+            except self.retryable as exc:
+                delay = self.delay(retry)
+                count("fuego retries")
+                with timed("backoff", retry=retry, seconds=delay, cause=repr(exc)):
+                    await asyncio.sleep(delay)
+        return await func()
+
+
+def get_retry_policy() -> Optional[RetryPolicy]:
+    """Return the policy used to retry failed fuego calls, if any.
+
+    Returns
+    -------
+    RetryPolicy or None
+        The active retry policy.
+    """
+    return _ACTIVE_POLICY
+
+
+def set_retry_policy(policy: Optional[RetryPolicy]) -> None:
+    """Set the policy used to retry failed fuego calls.
+
+    Parameters
+    ----------
+    policy : RetryPolicy or None
+        The retry policy. If None, failed calls are not retried.
+    """
+    global _ACTIVE_POLICY
+    _ACTIVE_POLICY = policy
+
+
+@contextmanager
+def use_retry_policy(policy: Optional[RetryPolicy]) -> Iterator[None]:
+    """Temporarily set the policy used to retry failed fuego calls.
+
+    Parameters
+    ----------
+    policy : RetryPolicy or None
+        The retry policy to use within the context.
+
+    Yields
+    ------
+    None
+    """
+    previous = get_retry_policy()
+    set_retry_policy(policy)
+    try:
+        yield
+    finally:
+        set_retry_policy(previous)
@@ -1,29 +1,86 @@
 """Query and return ROAR runs."""
 
 import os
+import sys
 from datetime import date
 from datetime import datetime
+from datetime import timezone
 from functools import partial
-import subprocess
+from itertools import islice
 from typing import Any
+from typing import Callable
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Mapping
 from typing import Optional
+from typing import Sequence
+from typing import Tuple
 from typing import Union
 
 import pandas as pd
-from pandas import json_normalize
-from dateutil.parser import isoparse
-from tqdm.auto import tqdm
 
-from .utils import _FuegoKey, bytes2json
-from .utils import _FuegoResponse
-from .utils import page_results
+from .aio import AsyncRunner
+from .aio import gather_tasks
+from .aio import iter_tasks
+from .backends import BackendError
+from .backends import parse_condition
+from .backends import path_key
+from .dtypes import compact_dtypes
+from .dtypes import DtypeCompactor
+from .dtypes import parse_timestamps as parse_timestamp_columns
+from .metrics import count
+from .metrics import timed
+from .shards import fetch_shard
+from .shards import iter_sharded_records
+from .shards import Shard
+from .users import fetch_user
+from .users import split_run_path
+from .users import user_from_doc
+from .users import UserResolver
+from .utils import _FuegoKey
+from .utils import _FuegoDocument
+from .utils import FuegoRecord
+from .utils import FetchError
+from .utils import iter_concurrently
+from .utils import iter_records
 from .utils import trim_doc_path
+from .writers import ChunkWriter
+
+
+RunFilter = Callable[[List[_FuegoDocument]], List[_FuegoDocument]]
+
+# The nested run fields that get_runs flattens into columns, and how many
+# levels of nesting to flatten (None for all of them).
+NESTED_RUN_FIELDS: Dict[str, Optional[int]] = {"assigningOrgs": 1, "scores": None}
+
+# The fuego metadata that runs and trials do not need. Runs keep UpdateTime,
+# which sync uses as its watermark.
+RUN_DROPPED_FIELDS = ("ReadTime",)
+TRIAL_DROPPED_FIELDS = ("ReadTime", "UpdateTime")
+
+# With fewer runs than this, the trials are fetched with one query per run even
+# if a collection-group scan is possible: a handful of per-run queries costs
+# about as many fuego calls as a scan, and never reads other runs' trials.
+TRIAL_SCAN_MIN_RUNS = 10
+
+# The largest number of runs whose trials each shard of a collection-group scan
+# fetches, which bounds the trials held in memory per shard.
+TRIAL_SCAN_RUNS_PER_SHARD = 100
+
+# The operators that a collection-group scan of trials accepts. Range and
+# inequality conditions make Firestore order the trials by the filtered field
+# rather than by path, which the scan's shards rely on.
+TRIAL_SCAN_OPERATORS = ("==", "<in>", "<array-contains>", "<array-contains-any>")
+
+
+class NoResultsError(ValueError):
+    """Raised when no run satisfies a query."""
 
 
 def merge_data_with_metadata(
-    fuego_response: List[_FuegoResponse], metadata_params: Dict[str, _FuegoKey]
+    fuego_response: Iterable[_FuegoDocument], metadata_params: Dict[str, _FuegoKey]
 ) -> List[Dict[str, Any]]:
     """Merge trial data with metadata.
 
@@ -34,8 +91,10 @@ def merge_data_with_metadata(
 
     Parameters
     ----------
-    fuego_response : List[Dict[str, Any]]
-        The trial data.
+    fuego_response : Iterable[Dict[str, Any] or FuegoRecord]
+        The trial data. This may be a generator, such as ``iter_records``, in
+        which case each document is merged as it arrives. The data of each
+        document is updated in place rather than copied.
 
     metadata_params : Dict[str, str]
         The metadata fields that will be merged into the data. The keys are the
@@ -47,19 +106,127 @@ def merge_data_with_metadata(
     List[Dict[str, Any]]
         The merged data.
     """
-    item_data = [item["Data"] for item in fuego_response]
-    for item, raw_item in zip(item_data, fuego_response):
+    item_data = []
+    for raw_item in fuego_response:
+        item = raw_item["Data"]
         item.update(
             {
                 data_key: raw_item[metadata_key]
                 for data_key, metadata_key in metadata_params.items()
             }
         )
+        item_data.append(item)
 
     return item_data
 
 
-def get_user_from_run(run_path: str, legacy: bool = False) -> List[Dict[str, Any]]:
+def flatten_record(
+    record: Dict[str, Any], prefix: str = "", max_level: Optional[int] = None
+) -> Dict[str, Any]:
+    """Flatten nested dicts into one dict with dotted keys.
+
+    Keys are ordered as ``pandas.json_normalize`` orders them: the non-dict
+    values of each level first, then the flattened dict values. Lists, such as
+    the org IDs in ``assigningOrgs``, are kept as values.
+
+    Parameters
+    ----------
+    record : Dict[str, Any]
+        The nested dict.
+
+    prefix : str, optional, default=""
+        A prefix for every key.
+
+    max_level : int, optional, default=None
+        The number of levels to flatten. Deeper dicts are kept as values. If
+        None, every level is flattened.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The flattened dict.
+
+    Examples
+    --------
+    >>> flatten_record({"a": {"b": 1, "c": [2]}, "d": 3}, prefix="x.")
+    {'x.d': 3, 'x.a.b': 1, 'x.a.c': [2]}
+
+    >>> flatten_record({"a": {"b": 1}}, max_level=1)
+    {'a': {'b': 1}}
+    """
+    flat = {}
+    nested = []
+    for key, value in record.items():
+        if isinstance(value, dict) and (max_level is None or max_level > 1):
+            nested.append((key, value))
+        else:
+            flat[f"{prefix}{key}"] = value
+
+    level = None if max_level is None else max_level - 1
+    for key, value in nested:
+        flat.update(flatten_record(value, f"{prefix}{key}.", level))
+
+    return flat
+
+
+def normalize_runs(
+    runs: Iterable[Dict[str, Any]], nested_fields: Dict[str, Optional[int]]
+) -> pd.DataFrame:
+    """Build a DataFrame of runs with their nested fields flattened.
+
+    Each nested field, e.g. ``assigningOrgs``, is replaced by one column per
+    nested key, e.g. ``assigningOrgs.schools``. The fields are flattened in a
+    single pass over the raw run dicts, before the DataFrame is built, rather
+    than by expanding DataFrame columns row by row. The flattened columns
+    follow the other columns, grouped by field in the order of
+    ``nested_fields``.
+
+    Parameters
+    ----------
+    runs : Iterable[Dict[str, Any]]
+        The run data. The dicts are modified in place.
+
+    nested_fields : Dict[str, Optional[int]]
+        The fields to flatten and the number of levels to flatten for each
+        (None for all levels).
+
+    Returns
+    -------
+    pd.DataFrame
+        The runs.
+
+    Examples
+    --------
+    >>> df = normalize_runs(
+    ...     [{"runId": "r1", "assigningOrgs": {"schools": ["s1"]}, "scores": {}}],
+    ...     nested_fields={"assigningOrgs": 1, "scores": None},
+    ... )
+    >>> df.columns.tolist()
+    ['runId', 'assigningOrgs.schools']
+    """
+    records = []
+    for run in runs:
+        for field, max_level in nested_fields.items():
+            value = run.pop(field, None)
+            if isinstance(value, dict):
+                run.update(flatten_record(value, f"{field}.", max_level))
+            elif value is not None:
+                run[field] = value
+        records.append(run)
+
+    df = pd.DataFrame(records)
+
+    groups: Dict[str, List[str]] = {field: [] for field in ["", *nested_fields]}
+    for column in df.columns:
+        field = str(column).split(".", 1)[0] if "." in str(column) else ""
+        groups.get(field, groups[""]).append(column)
+
+    return df[[column for columns in groups.values() for column in columns]]
+
+
+def get_user_from_run(
+    run_path: str, legacy: bool = False, resolver: Optional[UserResolver] = None
+) -> Dict[str, Any]:
     """Get the user that owns a run.
 
     Parameters
@@ -71,27 +238,22 @@ def get_user_from_run(run_path: str, legacy: bool = False) -> List[Dict[str, Any
         If True, the returned user will be identified by PID, otherwise the user
         will be identified by roarUid. Default: False.
 
+    resolver : UserResolver, optional
+        If provided, look up the user document through this resolver so that it
+        is fetched at most once. Default: None.
+
     Returns
     -------
-    List[Dict[str, str]]
+    Dict[str, str]
         The user that owns the run.
     """
-    path_split = trim_doc_path(run_path).split("/runs/")
-    user_path = path_split[0]
-    run_id = path_split[1]
-    user_collection, user_id = user_path.split("/")
-    fuego_query = ["fuego", "get", user_collection, user_id]
-    user_result = bytes2json(subprocess.check_output(fuego_query))  # nosec
-    user = user_result["Data"]
-    user["CreateTime"] = user_result["CreateTime"]
-
-    uid_key = "PID" if legacy else "roarUid"
-    user[uid_key] = user_result["ID"]
-    user["runId"] = run_id
-
-    invalid_keys = ["districts", "schools", "classes", "groups", "families"]
+    user_path, run_id = split_run_path(run_path)
+    if resolver is None:
+        user_result = fetch_user(user_path)
+    else:
+        user_result = resolver.get_user(user_path)
 
-    return {key: value for key, value in user.items() if key not in invalid_keys}
+    return user_from_doc(user_result, run_id, legacy=legacy)
 
 
 def get_trials_from_run(run_path: str) -> List[Dict[str, Any]]:
@@ -109,25 +271,234 @@ def get_trials_from_run(run_path: str) -> List[Dict[str, Any]]:
     """
     trial_path = f"{trim_doc_path(run_path)}/trials"
     fuego_query = ["fuego", "query", trial_path]
-    raw_trials = page_results(fuego_query)
+    with timed("fetch trials"):
+        return merge_data_with_metadata(
+            fuego_response=iter_records(fuego_query, drop=TRIAL_DROPPED_FIELDS),
+            metadata_params={"CreateTime": "CreateTime", "trialId": "ID"},
+        )
+
+
+def check_trial_conditions(conditions: Iterable[str]) -> List[str]:
+    """Check that conditions can narrow a collection-group scan of trials.
+
+    Parameters
+    ----------
+    conditions : Iterable[str]
+        The fuego conditions, e.g. ``['taskId == "swr"']``.
+
+    Returns
+    -------
+    List[str]
+        The conditions.
+
+    Raises
+    ------
+    ValueError
+        If there are no conditions, or a condition is not an equality
+        condition (see ``TRIAL_SCAN_OPERATORS``).
+
+    Examples
+    --------
+    >>> check_trial_conditions(['taskId == "swr"'])
+    ['taskId == "swr"']
+    """
+    conditions = list(conditions)
+    if not conditions:
+        raise ValueError(
+            "A trial scan needs at least one trial condition, e.g. "
+            "'taskId == \"swr\"'. Without one, it would read the trials of "
+            "every run between the requested runs."
+        )
 
-    return merge_data_with_metadata(
-        fuego_response=raw_trials,
-        metadata_params={"CreateTime": "CreateTime", "trialId": "ID"},
+    for condition in conditions:
+        try:
+            _, op, _ = parse_condition(condition)
+        except BackendError as exc:
+            raise ValueError(str(exc)) from exc
+        if op not in TRIAL_SCAN_OPERATORS:
+            raise ValueError(
+                f"Trial scans only support equality conditions "
+                f"({', '.join(TRIAL_SCAN_OPERATORS)}), not {condition!r}."
+            )
+    return conditions
+
+
+def iter_trials_from_group(
+    run_paths: Mapping[str, str], conditions: Iterable[str], max_workers: int = 1
+) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Get the trials of many runs with a collection-group scan.
+
+    Rather than one ``fuego query <run>/trials`` per run, this pages through
+    ``fuego query -g trials`` and attributes each trial to its run by the
+    parent of its path. The trials of a run follow the run in path order, so
+    the scan runs from the first run to the trials of the last one, split at
+    runs into shards of at most ``TRIAL_SCAN_RUNS_PER_SHARD`` runs, which are
+    paginated ``max_workers`` at a time. Trials of runs that are not in ``run_paths``
+    are dropped as they arrive, so ``conditions`` should narrow the scan to
+    about the trials of the requested runs, e.g. ``['taskId == "swr"']`` if
+    the trials record their task.
+
+    Parameters
+    ----------
+    run_paths : Mapping[str, str]
+        The Firestore path to each run, keyed by run ID.
+
+    conditions : Iterable[str]
+        The fuego conditions that every trial of the requested runs satisfies.
+        At least one is required. Range conditions, e.g. on a timestamp, would
+        make Firestore return the trials out of path order, so only equality
+        conditions (see ``TRIAL_SCAN_OPERATORS``) can be used.
+
+    max_workers : int, optional, default=1
+        The maximum number of shards of the scan paginated at once.
+
+    Yields
+    ------
+    Tuple[str, List[Dict[str, Any]]]
+        The run ID and trials of each run that has trials, in path order.
+
+    Raises
+    ------
+    FetchError
+        If some shards of the scan failed, once the trials of the other
+        shards have been yielded. Its errors are keyed by the IDs of the runs
+        whose trials the failed shards hold.
+    """
+    conditions = check_trial_conditions(conditions)
+    run_ids = {trim_doc_path(path): run_id for run_id, path in run_paths.items()}
+    if not run_ids:
+        return
+
+    # Split the scan into enough shards to keep every worker busy. Shard i
+    # holds the trials of runs i * runs_per_shard up to the next shard's first
+    # run, and the last shard ends with the trials of the last run.
+    sorted_paths = sorted(run_ids, key=path_key)
+    runs_per_shard = -(-len(run_ids) // (4 * max_workers))
+    runs_per_shard = max(min(runs_per_shard, TRIAL_SCAN_RUNS_PER_SHARD), 1)
+    bounds = sorted_paths[::runs_per_shard]
+    ends = [*bounds[1:], f"{sorted_paths[-1]}/trials/{chr(sys.maxunicode)}"]
+    shards = {
+        idx: Shard(start_after=start, end_at=end)
+        for idx, (start, end) in enumerate(zip(bounds, ends))
+    }
+    fetch = partial(
+        fetch_shard,
+        ["fuego", "query", "-g", "trials", *conditions],
+        drop=TRIAL_DROPPED_FIELDS,
     )
 
+    shard_errors: Dict[int, Exception] = {}
+    records = _iter_scanned_records(fetch, shards, max_workers, shard_errors)
+    yield from _group_trials_by_run(records, run_ids)
+
+    if shard_errors:
+        raise FetchError(
+            {
+                run_ids[path]: exc
+                for idx, exc in shard_errors.items()
+                for path in sorted_paths[
+                    idx * runs_per_shard : (idx + 1) * runs_per_shard
+                ]
+            }
+        )
+
+
+def _iter_scanned_records(
+    fetch: Callable[[Shard], List[FuegoRecord]],
+    shards: Dict[int, Shard],
+    max_workers: int,
+    shard_errors: Dict[int, Exception],
+) -> Iterator[FuegoRecord]:
+    """Yield the trials of each shard of a scan, recording failed shards."""
+    try:
+        for _, records in iter_concurrently(
+            fetch, shards, max_workers=max_workers, desc="Scanning trials"
+        ):
+            yield from records
+    except FetchError as exc:
+        # The error is only raised once every other shard has been yielded.
+        shard_errors.update(exc.errors)
+
+
+def _group_trials_by_run(
+    records: Iterable[FuegoRecord], run_ids: Mapping[str, str]
+) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Group consecutive trials by run, dropping the trials of other runs."""
+    metadata_params: Dict[str, _FuegoKey] = {
+        "CreateTime": "CreateTime",
+        "trialId": "ID",
+    }
+
+    batch_run_id = ""
+    batch: List[FuegoRecord] = []
+    for record in records:
+        run_path, _, _ = trim_doc_path(record.path).rpartition("/trials/")
+        run_id = run_ids.get(run_path)
+        if run_id is None:
+            count("trials skipped")
+            continue
+        if run_id != batch_run_id and batch:
+            yield batch_run_id, merge_data_with_metadata(batch, metadata_params)
+            batch = []
+        batch_run_id = run_id
+        batch.append(record)
+
+    if batch:
+        yield batch_run_id, merge_data_with_metadata(batch, metadata_params)
+
+
+def _as_datetime(value: Optional[Union[date, datetime]]) -> Optional[datetime]:
+    """Convert a date to an aware datetime at local midnight."""
+    if isinstance(value, date):
+        return datetime(value.year, value.month, value.day).astimezone()
+    return value
+
+
+def date_conditions(
+    started_before: Optional[Union[date, datetime]] = None,
+    started_after: Optional[Union[date, datetime]] = None,
+) -> List[str]:
+    """Translate a date range into fuego ``timeStarted`` conditions.
+
+    Dates are interpreted as local midnight, as in ``filter_run_dates``, and
+    sent to Firestore as RFC 3339 timestamps in UTC so that runs outside of the
+    range are never downloaded.
+
+    Parameters
+    ----------
+    started_before : date, optional, default=None
+        Return only runs started before this date.
+
+    started_after : date, optional, default=None
+        Return only runs started after this date.
+
+    Returns
+    -------
+    List[str]
+        The fuego query conditions, e.g. ``timeStarted >= 2024-01-01T08:00:00Z``.
+    """
+    conditions = []
+    for operator, value in [(">=", started_after), ("<", started_before)]:
+        value = _as_datetime(value)
+        if value is not None:
+            timestamp = value.astimezone(timezone.utc).strftime("%Y-%m-%dT%H:%M:%SZ")
+            conditions.append(f"timeStarted {operator} {timestamp}")
+
+    return conditions
+
 
 def filter_run_dates(
-    runs: List[_FuegoResponse],
+    runs: Iterable[_FuegoDocument],
     started_before: Optional[Union[date, datetime]] = None,
     started_after: Optional[Union[date, datetime]] = None,
-) -> List[_FuegoResponse]:
+) -> List[_FuegoDocument]:
     """Filter runs by date.
 
     Parameters
     ----------
-    runs : List[Dict[str, Any]]
-        The runs to filter.
+    runs : Iterable[Dict[str, Any] or FuegoRecord]
+        The runs to filter. This may be a generator, such as ``iter_records``,
+        in which case the runs are filtered as they arrive.
 
     started_before : date, optional, default=None
         Return only runs started before this date.
@@ -174,74 +545,268 @@ def filter_run_dates(
     >>> print(filtered == [runs[0]])
     True
     """
-    if isinstance(started_before, date):
-        started_before = datetime(
-            started_before.year, started_before.month, started_before.day
-        ).astimezone()
-
-    if isinstance(started_after, date):
-        started_after = datetime(
-            started_after.year, started_after.month, started_after.day
-        ).astimezone()
+    started_before = _as_datetime(started_before)
+    started_after = _as_datetime(started_after)
 
-    filtered = [run for run in runs]
+    runs = list(runs)
+    if started_before is None and started_after is None:
+        return runs
 
+    # Parse every timeStarted at once and keep the runs in one masked pass.
+    time_started = pd.Series(
+        pd.to_datetime([run["Data"]["timeStarted"] for run in runs], utc=True)
+    )
+    keep = pd.Series(True, index=time_started.index)
     if started_before is not None:
-        filtered = [
-            run
-            for run in filtered
-            if isoparse(run["Data"]["timeStarted"]) < started_before
-        ]
-
+        keep &= time_started < pd.Timestamp(started_before)
     if started_after is not None:
-        filtered = [
-            run
-            for run in filtered
-            if isoparse(run["Data"]["timeStarted"]) > started_after
-        ]
+        keep &= time_started > pd.Timestamp(started_after)
 
-    return filtered
+    return [run for run, keep_run in zip(runs, keep) if keep_run]
 
 
-def get_runs_compat(
-    root_doc: str = "prod/roar-prod",
-    return_trials: bool = False,
-    query_kwargs: Optional[Dict[str, str]] = None,
-    started_before: Optional[date] = None,
-    started_after: Optional[date] = None,
-    merge_user_info: bool = False,
-) -> pd.DataFrame:
-    """Get all runs that satisfy a specific query.
+def _iter_runs(
+    fuego_args: List[str], shards: Optional[Sequence[Shard]], max_workers: int
+) -> Iterator[FuegoRecord]:
+    """Page through the runs query, shard by shard if there are shards."""
+    if shards:
+        return iter_sharded_records(
+            fuego_args, shards, drop=RUN_DROPPED_FIELDS, max_workers=max_workers
+        )
+    return iter_records(fuego_args, drop=RUN_DROPPED_FIELDS)
+
+
+def _filter_runs(
+    runs: Iterable[_FuegoDocument],
+    started_before: Optional[date],
+    started_after: Optional[date],
+    run_filter: Optional[RunFilter],
+) -> List[_FuegoDocument]:
+    """Apply the client-side run filters shared by get_runs and get_runs_compat."""
+    with timed("fetch runs"):
+        runs = list(runs)
+
+    return _apply_run_filters(runs, started_before, started_after, run_filter)
+
+
+def _apply_run_filters(
+    runs: List[_FuegoDocument],
+    started_before: Optional[date],
+    started_after: Optional[date],
+    run_filter: Optional[RunFilter],
+) -> List[_FuegoDocument]:
+    """Filter the fetched runs, raising a NoResultsError if none are left."""
+    # The date range is also part of the fuego query, so this is only a safety
+    # net for runs that the server-side conditions let through.
+    with timed("filter runs"):
+        runs = filter_run_dates(
+            runs=runs, started_before=started_before, started_after=started_after
+        )
 
-    Parameters
-    ----------
-    root_doc : str, optional, default="prod/roar-prod"
-        The Firestore root document. The returned runs will all be under this document.
+        if run_filter is not None:
+            runs = run_filter(runs)
 
-    return_trials : bool, optional, default=False
-        If True, return the trials for each run as well.
+    if not runs:
+        raise NoResultsError("Your query returned no results.")
 
-    query_kwargs : dict, optional, default=None
-        The query to run. If None, all runs will be returned.
+    return runs
 
-    started_before : date, optional, default=None
-        Return only runs started before this date.
 
-    started_after : date, optional, default=None
-        Return only runs started after this date.
+def _trials_frame(
+    df_runs: pd.DataFrame,
+    run_trials: Dict[str, List[Dict[str, Any]]],
+    parse_timestamps: bool,
+) -> pd.DataFrame:
+    """Build one DataFrame of the trials of many runs, with the run columns."""
+    with timed("build trials frame"):
+        run_frames = {
+            run_id: pd.DataFrame(trials)
+            for run_id, trials in run_trials.items()
+            if trials
+        }
+
+        for run_id, df in run_frames.items():
+            df["runId"] = run_id
+
+        df_trials = pd.concat(run_frames.values())
+
+        df_trials.set_index("trialId", inplace=True)
+        df_trials = df_trials.merge(
+            df_runs, left_on="runId", right_index=True, how="left"
+        )
 
-    merge_user_info : bool, optional, default=False
-        If True, merge the user doc info into the run data.
+    if parse_timestamps:
+        df_trials = parse_timestamp_columns(df_trials)
 
-    Returns
-    -------
-    List[dict]
-        The runs that satisfy the query.
+    return df_trials
+
+
+def _run_trials_frame(
+    df_runs: pd.DataFrame,
+    run_id: str,
+    trials: List[Dict[str, Any]],
+    parse_timestamps: bool,
+) -> pd.DataFrame:
+    """Build the DataFrame of the trials of one run, with the run columns."""
+    with timed("build trials frame"):
+        df = pd.DataFrame(trials)
+        df["runId"] = run_id
+        df.set_index("trialId", inplace=True)
+        df = df.merge(df_runs.loc[[run_id]], left_on="runId", right_index=True)
+
+    if parse_timestamps:
+        df = parse_timestamp_columns(df)
+
+    return df
+
+
+def _iter_run_trials(
+    run_paths: Dict[str, str],
+    max_workers: int,
+    trial_conditions: Optional[List[str]],
+    failed_runs: Optional[Dict[str, Exception]] = None,
+) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Fetch the trials of each run, choosing how to query them.
+
+    The trials are fetched with a collection-group scan if
+    ``trial_conditions`` are given and there are at least
+    ``TRIAL_SCAN_MIN_RUNS`` runs, and otherwise with one query per run,
+    ``max_workers`` at a time. The scan is never chosen on its own: it reads
+    every trial that satisfies the conditions between the first and last
+    runs, so only the caller knows whether the conditions narrow it to about
+    the requested runs. If ``failed_runs`` is given, the runs whose trials
+    could not be fetched are added to it instead of raising a ``FetchError``.
     """
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.environ.get(
-        "ROAR_QUERY_LEGACY_CREDENTIALS", "NONE"
+    if trial_conditions is not None and len(run_paths) >= TRIAL_SCAN_MIN_RUNS:
+        run_trials = iter_trials_from_group(run_paths, trial_conditions, max_workers)
+    else:
+        run_trials = iter_concurrently(
+            get_trials_from_run,
+            run_paths,
+            max_workers=max_workers,
+            desc="Getting trials",
+        )
+
+    if failed_runs is None:
+        return run_trials
+    return _skip_failed_runs(run_trials, failed_runs)
+
+
+def _skip_failed_runs(
+    run_trials: Iterator[Tuple[str, List[Dict[str, Any]]]],
+    failed_runs: Dict[str, Exception],
+) -> Iterator[Tuple[str, List[Dict[str, Any]]]]:
+    """Yield the trials of the runs that succeeded, recording the failures."""
+    try:
+        yield from run_trials
+    except FetchError as exc:
+        # The error is only raised once every other run has been fetched.
+        failed_runs.update(exc.errors)
+        count("failed runs", len(exc.errors))
+
+
+def _merge_trials(
+    df_runs: pd.DataFrame,
+    run_paths: Dict[str, str],
+    max_workers: int,
+    parse_timestamps: bool = False,
+    trial_conditions: Optional[List[str]] = None,
+    failed_runs: Optional[Dict[str, Exception]] = None,
+) -> pd.DataFrame:
+    """Fetch the trials for each run and merge in the run columns."""
+    run_trials: Dict[str, List[Dict[str, Any]]] = {}
+    try:
+        for run_id, trials in _iter_run_trials(
+            run_paths, max_workers, trial_conditions, failed_runs
+        ):
+            run_trials.setdefault(run_id, []).extend(trials)
+    except FetchError as exc:
+        exc.results = run_trials
+        raise
+
+    # Keep the order of the runs, in whatever order their trials arrived.
+    run_trials = {
+        run_id: run_trials[run_id] for run_id in run_paths if run_id in run_trials
+    }
+    return _trials_frame(df_runs, run_trials, parse_timestamps)
+
+
+def _stream_trials(
+    df_runs: pd.DataFrame,
+    run_paths: Dict[str, str],
+    max_workers: int,
+    trials_writer: ChunkWriter,
+    parse_timestamps: bool = False,
+    trial_conditions: Optional[List[str]] = None,
+    compactor: Optional[DtypeCompactor] = None,
+    failed_runs: Optional[Dict[str, Exception]] = None,
+) -> pd.DataFrame:
+    """Fetch the trials for each run and write them as soon as they arrive.
+
+    Each run's trials are merged with that run's columns and appended to
+    ``trials_writer``, so the full trials DataFrame is never materialized.
+    The runs are known up front, so ``compactor`` fixes the dtypes of their
+    columns from all of the runs.
+    """
+    if compactor is not None:
+        compactor.fit(df_runs)
+    for run_id, trials in _iter_run_trials(
+        run_paths, max_workers, trial_conditions, failed_runs
+    ):
+        if trials:
+            df = _run_trials_frame(df_runs, run_id, trials, parse_timestamps)
+            if compactor is not None:
+                df = compactor.compact(df)
+            trials_writer.write(df)
+
+    return df_runs
+
+
+def _get_trials(
+    df_runs: pd.DataFrame,
+    run_paths: Dict[str, str],
+    max_workers: int,
+    trials_writer: Optional[ChunkWriter],
+    parse_timestamps: bool,
+    trial_conditions: Optional[List[str]],
+    compact: bool = False,
+    failed_runs: Optional[Dict[str, Exception]] = None,
+) -> pd.DataFrame:
+    """Stream the trials to ``trials_writer`` if there is one, else merge them."""
+    if trials_writer is not None:
+        return _stream_trials(
+            df_runs,
+            run_paths,
+            max_workers,
+            trials_writer,
+            parse_timestamps,
+            trial_conditions,
+            DtypeCompactor() if compact else None,
+            failed_runs,
+        )
+
+    df_trials = _merge_trials(
+        df_runs,
+        run_paths,
+        max_workers,
+        parse_timestamps,
+        trial_conditions,
+        failed_runs,
     )
+    return compact_dtypes(df_trials) if compact else df_trials
+
+
+def _compat_runs_query(
+    root_doc: str,
+    query_kwargs: Optional[Dict[str, str]],
+    started_before: Optional[date],
+    started_after: Optional[date],
+) -> Tuple[List[str], Optional[str]]:
+    """Build the runs query of get_runs_compat.
 
+    Also returns the path prefix of the users whose runs to keep, if
+    ``pidPrefix`` was given.
+    """
     # Build the fuego query dynamically
     fuego_args = ["fuego", "query"]
     for select in [
@@ -272,107 +837,37 @@ def get_runs_compat(
     for key, value in query_kwargs.items():
         query.append(f'{key} == "{value}"')
 
+    query.extend(date_conditions(started_before, started_after))
     fuego_args.extend(query)
-    runs = page_results(fuego_args)
-
-    if not runs:
-        raise ValueError("Your query returned no results.")
-
-    # Get rid of results that are not in the root_doc
-    runs = [run for run in runs if root_doc in run["Path"]]
 
+    user_prefix = None
     if pid_prefix is not None:
-        # Get rid of results that do not have the UID prefix
-        pid_prefix = "/".join([root_doc.rstrip("/"), "users", pid_prefix.strip("/")])
-        runs = [run for run in runs if pid_prefix in run["Path"]]
-
-    # Get rid of runs that are outside of the date range
-    runs = filter_run_dates(
-        runs=runs, started_before=started_before, started_after=started_after
-    )
-
-    df_runs = pd.DataFrame(
-        merge_data_with_metadata(
-            fuego_response=runs,
-            metadata_params={"CreateTime": "CreateTime", "runId": "ID"},
-        )
-    )
-
-    df_runs.set_index("runId", inplace=True)
-    run_paths = {run["ID"]: run["Path"] for run in runs}
-
-    if merge_user_info:
-        users = [
-            get_user_from_run(run_path, legacy=True) for run_path in run_paths.values()
-        ]
-
-        df_users = pd.DataFrame(users)
-        df_users.set_index("runId", inplace=True)
-
-        df_runs = df_runs.merge(df_users, left_index=True, right_index=True, how="left")
-
-    if not return_trials:
-        return df_runs
-
-    run_trials = {
-        run_id: get_trials_from_run(run_path)
-        for run_id, run_path in tqdm(run_paths.items(), desc="Getting trials")
-    }
-
-    run_trials = {
-        run_id: pd.DataFrame(trials) for run_id, trials in run_trials.items() if trials
-    }
-
-    for run_id, df in run_trials.items():
-        df["runId"] = run_id  # type: ignore [call-overload]
-
-    df_trials = pd.concat(run_trials.values())
-
-    df_trials.set_index("trialId", inplace=True)
-    df_trials = df_trials.merge(df_runs, left_on="runId", right_index=True, how="left")
-
-    return df_trials
-
-
-def get_runs(
-    return_trials: bool = False,
-    query_kwargs: Optional[Dict[str, str]] = None,
-    started_before: Optional[date] = None,
-    started_after: Optional[date] = None,
-    user_type: Optional[str] = "users",
-    merge_user_info: bool = True,
-) -> pd.DataFrame:
-    """Get all runs that satisfy a specific query.
+        user_prefix = "/".join([root_doc.rstrip("/"), "users", pid_prefix.strip("/")])
 
-    Parameters
-    ----------
-    return_trials : bool, optional, default=False
-        If True, return the trials for each run as well.
+    return fuego_args, user_prefix
 
-    query_kwargs : dict, optional, default=None
-        The query to run. If None, all runs will be returned.
-
-    started_before : date, optional, default=None
-        Return only runs started before this date.
 
-    started_after : date, optional, default=None
-        Return only runs started after this date.
+def _keep_compat_runs(
+    runs: Iterable[_FuegoDocument], root_doc: str, user_prefix: Optional[str]
+) -> Iterable[_FuegoDocument]:
+    """Lazily drop the runs outside of root_doc or of the users with a PID prefix."""
+    # Get rid of results that are not in the root_doc
+    runs = (run for run in runs if root_doc in run["Path"])
 
-    user_type : str, optional, default="users"
-        The user type to query. Either "users" or "guests".
+    if user_prefix is not None:
+        # Get rid of results that do not have the UID prefix
+        runs = (run for run in runs if user_prefix in run["Path"])
 
-    merge_user_info : bool, optional, default=True
-        If True, merge the user doc info into the run data.
+    return runs
 
-    Returns
-    -------
-    List[dict]
-        The runs that satisfy the query.
-    """
-    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.environ.get(
-        "ROAR_QUERY_CREDENTIALS", "NONE"
-    )
 
+def _runs_query(
+    query_kwargs: Optional[Dict[str, str]],
+    started_before: Optional[date],
+    started_after: Optional[date],
+    user_type: Optional[str],
+) -> List[str]:
+    """Build the runs query of get_runs."""
     if user_type not in ["users", "guests"]:
         raise ValueError("user_type must be either 'users' or 'guests'")
 
@@ -413,88 +908,1010 @@ def get_runs(
         else:
             query.append(f'{key} == "{value}"')
 
+    query.extend(date_conditions(started_before, started_after))
     fuego_args.extend(query)
-    runs = page_results(fuego_args)
+    return fuego_args
 
-    if not runs:
-        raise ValueError("Your query returned no results.")
 
-    # Get rid of runs that are outside of the date range
-    runs = filter_run_dates(
-        runs=runs, started_before=started_before, started_after=started_after
-    )
+def _runs_frame(runs: List[_FuegoDocument], legacy: bool) -> pd.DataFrame:
+    """Build the runs DataFrame, indexed by runId.
 
-    df_runs = pd.DataFrame(
-        merge_data_with_metadata(
+    The nested fields of current runs (``NESTED_RUN_FIELDS``) are flattened
+    into columns.
+    """
+    with timed("build runs frame"):
+        run_data = merge_data_with_metadata(
             fuego_response=runs,
             metadata_params={"CreateTime": "CreateTime", "runId": "ID"},
         )
-    )
+        if legacy:
+            df_runs = pd.DataFrame(run_data)
+            df_runs.set_index("runId", inplace=True)
+            return df_runs
+
+        df_runs = normalize_runs(run_data, nested_fields=NESTED_RUN_FIELDS)
+        df_runs.set_index("runId", inplace=True)
+        df_runs.index.name = "runId"
+        return df_runs
 
-    df_runs.set_index("runId", inplace=True)
 
-    expanded_columns = df_runs["assigningOrgs"].apply(
-        partial(pd.Series, dtype="object")
-    )
+def _merge_users(
+    df_runs: pd.DataFrame, users: List[Dict[str, Any]], legacy: bool
+) -> pd.DataFrame:
+    """Merge the user info rows into the runs DataFrame.
 
-    df_runs = pd.concat(
-        [
-            df_runs.drop("assigningOrgs", axis=1),
-            expanded_columns.add_prefix("assigningOrgs."),
-        ],
-        axis=1,
-    )
+    The user columns of current runs are prefixed with "user.".
+    """
+    df_users = pd.DataFrame(users)
+    df_users.set_index("runId", inplace=True)
+    if not legacy:
+        df_users = df_users.add_prefix("user.")
 
-    # Normalize the 'scores' column
-    if "scores" in df_runs.columns:
-        expanded_df = json_normalize(df_runs["scores"])
-        expanded_df["runId"] = df_runs.index
-        expanded_df.set_index("runId", inplace=True, drop=True)
-
-        # Drop the original 'scores' column and concatenate the expanded data
-        df_runs = pd.concat(
-            [
-                df_runs.drop("scores", axis=1),
-                expanded_df.add_prefix("scores."),
-            ],
-            axis=1,
-        )
+    return df_runs.merge(df_users, left_index=True, right_index=True, how="left")
 
-    df_runs.index.name = "runId"
 
-    run_paths = {run["ID"]: run["Path"] for run in runs}
+def get_runs_compat(
+    root_doc: str = "prod/roar-prod",
+    return_trials: bool = False,
+    query_kwargs: Optional[Dict[str, str]] = None,
+    started_before: Optional[date] = None,
+    started_after: Optional[date] = None,
+    merge_user_info: bool = False,
+    max_workers: int = 1,
+    user_resolver: Optional[UserResolver] = None,
+    run_filter: Optional[RunFilter] = None,
+    trials_writer: Optional[ChunkWriter] = None,
+    parse_timestamps: bool = False,
+    shards: Optional[Sequence[Shard]] = None,
+    trial_conditions: Optional[List[str]] = None,
+    compact: bool = False,
+    failed_runs: Optional[Dict[str, Exception]] = None,
+) -> pd.DataFrame:
+    """Get all runs that satisfy a specific query.
 
-    if merge_user_info:
-        users = [
-            get_user_from_run(run_path, legacy=False)
-            for run_path in tqdm(run_paths.values(), desc="Merging user info")
-        ]
+    Parameters
+    ----------
+    root_doc : str, optional, default="prod/roar-prod"
+        The Firestore root document. The returned runs will all be under this document.
 
-        df_users = pd.DataFrame(users)
-        df_users.set_index("runId", inplace=True)
+    return_trials : bool, optional, default=False
+        If True, return the trials for each run as well.
 
-        df_runs = df_runs.merge(
-            df_users.add_prefix("user."), left_index=True, right_index=True, how="left"
-        )
+    query_kwargs : dict, optional, default=None
+        The query to run. If None, all runs will be returned.
 
-    if not return_trials:
+    started_before : date, optional, default=None
+        Return only runs started before this date.
+
+    started_after : date, optional, default=None
+        Return only runs started after this date.
+
+    merge_user_info : bool, optional, default=False
+        If True, merge the user doc info into the run data.
+
+    max_workers : int, optional, default=1
+        The maximum number of runs whose trials (or users) are fetched
+        concurrently.
+
+    user_resolver : UserResolver, optional, default=None
+        The resolver used to look up user docs when ``merge_user_info`` is True.
+        Pass one in to share its cache between calls or to persist it to disk.
+        If None, a new in-memory resolver is used.
+
+    run_filter : callable, optional, default=None
+        A function applied to the raw run documents after the date filters and
+        before any user docs or trials are fetched. It receives and returns a
+        list of fuego responses. ``roarquery.sync`` uses this to keep only the
+        runs that changed since the last sync.
+
+    trials_writer : ChunkWriter, optional, default=None
+        If provided with ``return_trials``, each run's trials are merged with
+        that run's columns and written to this writer as soon as they are
+        fetched, and the runs (not the trials) are returned. This keeps memory
+        use roughly constant regardless of the number of trials.
+
+    parse_timestamps : bool, optional, default=False
+        If True, return the timestamp columns (``CreateTime``, ``timeStarted``,
+        ``timeFinished``, ...) as tz-aware ``datetime64[ns, UTC]`` instead of
+        ISO strings.
+
+    shards : Sequence[Shard], optional, default=None
+        If provided, split the runs query into these shards (see
+        ``roarquery.shards``) and paginate up to ``max_workers`` of them at
+        once. The runs are returned shard by shard.
+
+    trial_conditions : List[str], optional, default=None
+        If provided with ``return_trials``, and there are at least
+        ``TRIAL_SCAN_MIN_RUNS`` runs, fetch the trials with a ``-g trials``
+        collection-group scan filtered by these fuego conditions instead of
+        one query per run (see ``iter_trials_from_group``). Every trial of
+        the requested runs must satisfy the conditions, and at least one
+        equality condition (see ``TRIAL_SCAN_OPERATORS``) is required.
+
+    compact : bool, optional, default=False
+        If True, convert the returned runs or trials, or the trials written to
+        ``trials_writer``, to compact dtypes (see ``DtypeCompactor``):
+        categorical strings, nullable booleans and downcast numbers. The
+        dtypes of streamed trials are chosen from all the runs for the run
+        columns, and from the first trials for the others, whose strings are
+        therefore left as they are. A dtype is widened if later trials do
+        not fit it.
+
+    failed_runs : dict, optional, default=None
+        If provided with ``return_trials``, the runs whose trials could not be
+        fetched are left out of the trials and added to this dict, keyed by run
+        ID, with the exception raised for each. By default, such a failure
+        raises a ``FetchError`` once every other run has been fetched, and the
+        trials of the other runs are in its ``results`` attribute.
+
+    Returns
+    -------
+    List[dict]
+        The runs that satisfy the query.
+    """
+    if return_trials and trial_conditions is not None:
+        check_trial_conditions(trial_conditions)
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.environ.get(
+        "ROAR_QUERY_LEGACY_CREDENTIALS", "NONE"
+    )
+
+    fuego_args, user_prefix = _compat_runs_query(
+        root_doc, query_kwargs, started_before, started_after
+    )
+    # Stream the results so that only the runs that pass the filters are kept
+    raw_runs = _keep_compat_runs(
+        _iter_runs(fuego_args, shards, max_workers), root_doc, user_prefix
+    )
+    runs = _filter_runs(raw_runs, started_before, started_after, run_filter)
+
+    df_runs = _runs_frame(runs, legacy=True)
+    run_paths = {run["ID"]: run["Path"] for run in runs}
+
+    if merge_user_info:
+        resolver = user_resolver if user_resolver is not None else UserResolver()
+        with timed("merge users"):
+            users = resolver.get_users_from_runs(
+                run_paths.values(), legacy=True, max_workers=max_workers
+            )
+            df_runs = _merge_users(df_runs, users, legacy=True)
+
+    if parse_timestamps:
+        df_runs = parse_timestamp_columns(df_runs)
+
+    if not return_trials:
+        return compact_dtypes(df_runs) if compact else df_runs
+
+    return _get_trials(
+        df_runs,
+        run_paths,
+        max_workers,
+        trials_writer,
+        parse_timestamps,
+        trial_conditions,
+        compact,
+        failed_runs,
+    )
+
+
+def get_runs(
+    return_trials: bool = False,
+    query_kwargs: Optional[Dict[str, str]] = None,
+    started_before: Optional[date] = None,
+    started_after: Optional[date] = None,
+    user_type: Optional[str] = "users",
+    merge_user_info: bool = True,
+    max_workers: int = 1,
+    user_resolver: Optional[UserResolver] = None,
+    run_filter: Optional[RunFilter] = None,
+    trials_writer: Optional[ChunkWriter] = None,
+    parse_timestamps: bool = False,
+    shards: Optional[Sequence[Shard]] = None,
+    trial_conditions: Optional[List[str]] = None,
+    compact: bool = False,
+    failed_runs: Optional[Dict[str, Exception]] = None,
+) -> pd.DataFrame:
+    """Get all runs that satisfy a specific query.
+
+    Parameters
+    ----------
+    return_trials : bool, optional, default=False
+        If True, return the trials for each run as well.
+
+    query_kwargs : dict, optional, default=None
+        The query to run. If None, all runs will be returned.
+
+    started_before : date, optional, default=None
+        Return only runs started before this date.
+
+    started_after : date, optional, default=None
+        Return only runs started after this date.
+
+    user_type : str, optional, default="users"
+        The user type to query. Either "users" or "guests".
+
+    merge_user_info : bool, optional, default=True
+        If True, merge the user doc info into the run data.
+
+    max_workers : int, optional, default=1
+        The maximum number of runs whose trials (or users) are fetched
+        concurrently.
+
+    user_resolver : UserResolver, optional, default=None
+        The resolver used to look up user docs when ``merge_user_info`` is True.
+        Pass one in to share its cache between calls or to persist it to disk.
+        If None, a new in-memory resolver is used.
+
+    run_filter : callable, optional, default=None
+        A function applied to the raw run documents after the date filters and
+        before any user docs or trials are fetched. It receives and returns a
+        list of fuego responses. ``roarquery.sync`` uses this to keep only the
+        runs that changed since the last sync.
+
+    trials_writer : ChunkWriter, optional, default=None
+        If provided with ``return_trials``, each run's trials are merged with
+        that run's columns and written to this writer as soon as they are
+        fetched, and the runs (not the trials) are returned. This keeps memory
+        use roughly constant regardless of the number of trials.
+
+    parse_timestamps : bool, optional, default=False
+        If True, return the timestamp columns (``CreateTime``, ``timeStarted``,
+        ``timeFinished``, ...) as tz-aware ``datetime64[ns, UTC]`` instead of
+        ISO strings.
+
+    shards : Sequence[Shard], optional, default=None
+        If provided, split the runs query into these shards (see
+        ``roarquery.shards``) and paginate up to ``max_workers`` of them at
+        once. The runs are returned shard by shard.
+
+    trial_conditions : List[str], optional, default=None
+        If provided with ``return_trials``, and there are at least
+        ``TRIAL_SCAN_MIN_RUNS`` runs, fetch the trials with a ``-g trials``
+        collection-group scan filtered by these fuego conditions instead of
+        one query per run (see ``iter_trials_from_group``). Every trial of
+        the requested runs must satisfy the conditions, and at least one
+        equality condition (see ``TRIAL_SCAN_OPERATORS``) is required.
+
+    compact : bool, optional, default=False
+        If True, convert the returned runs or trials, or the trials written to
+        ``trials_writer``, to compact dtypes (see ``DtypeCompactor``):
+        categorical strings, nullable booleans and downcast numbers. The
+        dtypes of streamed trials are chosen from all the runs for the run
+        columns, and from the first trials for the others, whose strings are
+        therefore left as they are. A dtype is widened if later trials do
+        not fit it.
+
+    failed_runs : dict, optional, default=None
+        If provided with ``return_trials``, the runs whose trials could not be
+        fetched are left out of the trials and added to this dict, keyed by run
+        ID, with the exception raised for each. By default, such a failure
+        raises a ``FetchError`` once every other run has been fetched, and the
+        trials of the other runs are in its ``results`` attribute.
+
+    Returns
+    -------
+    List[dict]
+        The runs that satisfy the query.
+    """
+    if return_trials and trial_conditions is not None:
+        check_trial_conditions(trial_conditions)
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.environ.get(
+        "ROAR_QUERY_CREDENTIALS", "NONE"
+    )
+
+    fuego_args = _runs_query(query_kwargs, started_before, started_after, user_type)
+    runs = _filter_runs(
+        _iter_runs(fuego_args, shards, max_workers),
+        started_before,
+        started_after,
+        run_filter,
+    )
+
+    df_runs = _runs_frame(runs, legacy=False)
+    run_paths = {run["ID"]: run["Path"] for run in runs}
+
+    if merge_user_info:
+        resolver = user_resolver if user_resolver is not None else UserResolver()
+        with timed("merge users"):
+            users = resolver.get_users_from_runs(
+                run_paths.values(),
+                legacy=False,
+                max_workers=max_workers,
+                desc="Merging user info",
+            )
+            df_runs = _merge_users(df_runs, users, legacy=False)
+
+    if parse_timestamps:
+        df_runs = parse_timestamp_columns(df_runs)
+
+    if not return_trials:
+        return compact_dtypes(df_runs) if compact else df_runs
+
+    return _get_trials(
+        df_runs,
+        run_paths,
+        max_workers,
+        trials_writer,
+        parse_timestamps,
+        trial_conditions,
+        compact,
+        failed_runs,
+    )
+
+
+def _runs_source(
+    legacy: bool,
+    root_doc: str,
+    query_kwargs: Optional[Dict[str, str]],
+    started_before: Optional[date],
+    started_after: Optional[date],
+    user_type: Optional[str],
+    shards: Optional[Sequence[Shard]],
+    max_workers: int,
+) -> Iterable[_FuegoDocument]:
+    """Select the credentials and lazily page through the runs query."""
+    if legacy:
+        os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.environ.get(
+            "ROAR_QUERY_LEGACY_CREDENTIALS", "NONE"
+        )
+        fuego_args, user_prefix = _compat_runs_query(
+            root_doc, query_kwargs, started_before, started_after
+        )
+        return _keep_compat_runs(
+            _iter_runs(fuego_args, shards, max_workers), root_doc, user_prefix
+        )
+
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.environ.get(
+        "ROAR_QUERY_CREDENTIALS", "NONE"
+    )
+    fuego_args = _runs_query(query_kwargs, started_before, started_after, user_type)
+    return _iter_runs(fuego_args, shards, max_workers)
+
+
+def _iter_run_frames(
+    raw_runs: Iterable[_FuegoDocument],
+    batch_size: int,
+    legacy: bool,
+    started_before: Optional[date],
+    started_after: Optional[date],
+    run_filter: Optional[RunFilter],
+    user_resolver: Optional[UserResolver],
+    max_workers: int,
+    parse_timestamps: bool,
+) -> Iterator[Tuple[pd.DataFrame, Dict[str, str]]]:
+    """Build a runs DataFrame for each batch of runs as the batch arrives.
+
+    Yields each DataFrame with the paths of its runs. ``user_resolver`` is
+    None when user info is not merged.
+    """
+    raw_runs = iter(raw_runs)
+    while True:
+        batch = list(islice(raw_runs, batch_size))
+        if not batch:
+            return
+
+        with timed("filter runs"):
+            runs = filter_run_dates(batch, started_before, started_after)
+            if run_filter is not None:
+                runs = run_filter(runs)
+        if not runs:
+            continue
+
+        df_runs = _runs_frame(runs, legacy=legacy)
+        run_paths = {run["ID"]: run["Path"] for run in runs}
+        if user_resolver is not None:
+            with timed("merge users"):
+                users = user_resolver.get_users_from_runs(
+                    run_paths.values(), legacy=legacy, max_workers=max_workers
+                )
+                df_runs = _merge_users(df_runs, users, legacy=legacy)
+
+        if parse_timestamps:
+            df_runs = parse_timestamp_columns(df_runs)
+
+        yield df_runs, run_paths
+
+
+def _iter_trial_frames(
+    run_frames: Iterable[Tuple[pd.DataFrame, Dict[str, str]]],
+    max_workers: int,
+    trial_conditions: Optional[List[str]],
+    parse_timestamps: bool,
+    failed_runs: Optional[Dict[str, Exception]] = None,
+) -> Iterator[pd.DataFrame]:
+    """Fetch the trials of each batch of runs, yielding one DataFrame per run."""
+    for df_runs, run_paths in run_frames:
+        for run_id, trials in _iter_run_trials(
+            run_paths, max_workers, trial_conditions, failed_runs
+        ):
+            if trials:
+                yield _run_trials_frame(df_runs, run_id, trials, parse_timestamps)
+
+
+def rechunk(
+    frames: Iterable[pd.DataFrame],
+    chunk_size: int,
+    columns: Optional[Sequence[str]] = None,
+) -> Iterator[pd.DataFrame]:
+    """Regroup DataFrames into chunks of the same length.
+
+    Without ``columns``, the schema of the chunks only grows. Like
+    ``ChunkWriter``, this keeps a stable union of the columns seen so far, in
+    the order in which they first appeared. Each chunk has every column of
+    the chunks before it, in the same order, with missing values where its
+    rows have none. A column that first appears in a later chunk is added at
+    the end, so the chunks before it do not have it. With ``columns``, every
+    chunk has exactly the same columns.
+
+    Parameters
+    ----------
+    frames : Iterable[pd.DataFrame]
+        The DataFrames, which may have different columns.
+
+    chunk_size : int
+        The number of rows in each chunk but the last.
+
+    columns : Sequence[str], optional, default=None
+        If provided, every chunk has exactly these columns, in this order.
+        Other columns are dropped, and missing ones are filled with missing
+        values.
+
+    Yields
+    ------
+    pd.DataFrame
+        The chunks.
+
+    Examples
+    --------
+    >>> chunks = rechunk([pd.DataFrame({"a": [1, 2, 3]}), pd.DataFrame({"b": [4]})], 2)
+    >>> [chunk.columns.tolist() for chunk in chunks]
+    [['a'], ['a', 'b']]
+    """
+    schema = list(columns) if columns is not None else []
+    known = set(schema)
+    pending: List[pd.DataFrame] = []
+    n_pending = 0
+    for df in frames:
+        if columns is None:
+            new_columns = [column for column in df.columns if column not in known]
+            schema.extend(new_columns)
+            known.update(new_columns)
+
+        pending.append(df)
+        n_pending += len(df)
+        while n_pending >= chunk_size:
+            rows = pd.concat(pending) if len(pending) > 1 else pending[0]
+            pending = [rows.iloc[chunk_size:]]
+            n_pending -= chunk_size
+            yield rows.iloc[:chunk_size].reindex(columns=schema)
+
+    if n_pending:
+        yield pd.concat(pending).reindex(columns=schema)
+
+
+def _compact_chunks(chunks: Iterable[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Convert a stream of chunks to compact dtypes, consistently."""
+    compactor = DtypeCompactor()
+    for chunk in chunks:
+        yield compactor.compact(chunk)
+
+
+def get_runs_iter(
+    chunk_size: int = 1000,
+    legacy: bool = False,
+    root_doc: str = "prod/roar-prod",
+    query_kwargs: Optional[Dict[str, str]] = None,
+    started_before: Optional[date] = None,
+    started_after: Optional[date] = None,
+    user_type: Optional[str] = "users",
+    merge_user_info: bool = True,
+    max_workers: int = 1,
+    user_resolver: Optional[UserResolver] = None,
+    run_filter: Optional[RunFilter] = None,
+    parse_timestamps: bool = False,
+    shards: Optional[Sequence[Shard]] = None,
+    columns: Optional[Sequence[str]] = None,
+    compact: bool = False,
+) -> Iterator[pd.DataFrame]:
+    """Get the runs that satisfy a query, one DataFrame chunk at a time.
+
+    Like ``get_runs`` (or ``get_runs_compat`` with ``legacy``), but the runs
+    are yielded as their pages arrive, with the user info of each chunk
+    merged in, so that only about one chunk of runs is held in memory and
+    processing can start before the query finishes.
+
+    Unless ``columns`` is given, the schema of the chunks only grows: each
+    chunk has the columns of the chunks before them, in the same order, and a
+    field that first appears in a later run adds a column that the earlier
+    chunks lack (see ``rechunk``).
+
+    Parameters
+    ----------
+    chunk_size : int, optional, default=1000
+        The number of runs in each chunk but the last.
+
+    legacy : bool, optional, default=False
+        If True, query the legacy database, like ``get_runs_compat``.
+
+    root_doc : str, optional, default="prod/roar-prod"
+        The Firestore root document of the legacy database.
+
+    query_kwargs : dict, optional, default=None
+        The query to run. If None, all runs will be returned.
+
+    started_before : date, optional, default=None
+        Return only runs started before this date.
+
+    started_after : date, optional, default=None
+        Return only runs started after this date.
+
+    user_type : str, optional, default="users"
+        The user type to query. Either "users" or "guests".
+
+    merge_user_info : bool, optional, default=True
+        If True, merge the user doc info into the run data.
+
+    max_workers : int, optional, default=1
+        The maximum number of users (or shards) fetched concurrently.
+
+    user_resolver : UserResolver, optional, default=None
+        The resolver used to look up user docs when ``merge_user_info`` is True.
+        It is shared by every chunk, so each user is fetched once.
+
+    run_filter : callable, optional, default=None
+        A function applied to the raw run documents of each chunk after the
+        date filters.
+
+    parse_timestamps : bool, optional, default=False
+        If True, return the timestamp columns as tz-aware datetimes.
+
+    shards : Sequence[Shard], optional, default=None
+        If provided, split the runs query into these shards.
+
+    columns : Sequence[str], optional, default=None
+        If provided, every chunk has exactly these columns, in this order:
+        other columns are dropped and missing ones are filled with missing
+        values. Pass it when every chunk needs the same schema, e.g. to write
+        them to one Parquet file.
+
+    compact : bool, optional, default=False
+        If True, convert the chunks to compact dtypes with one
+        ``DtypeCompactor``, so that the chunks share their dtypes. The
+        dtypes are chosen by the first chunk, so strings are left as they
+        are, and widened if later chunks do not fit them.
+        For categories, convert the chunks with a ``DtypeCompactor`` that
+        declares them instead.
+
+    Returns
+    -------
+    Iterator[pd.DataFrame]
+        The chunks of runs, indexed by runId. If no run satisfies the query,
+        there are no chunks.
+    """
+    raw_runs = _runs_source(
+        legacy,
+        root_doc,
+        query_kwargs,
+        started_before,
+        started_after,
+        user_type,
+        shards,
+        max_workers,
+    )
+    if merge_user_info and user_resolver is None:
+        user_resolver = UserResolver()
+
+    run_frames = _iter_run_frames(
+        raw_runs,
+        chunk_size,
+        legacy,
+        started_before,
+        started_after,
+        run_filter,
+        user_resolver if merge_user_info else None,
+        max_workers,
+        parse_timestamps,
+    )
+    chunks = rechunk((df_runs for df_runs, _ in run_frames), chunk_size, columns)
+    return _compact_chunks(chunks) if compact else chunks
+
+
+def get_trials_iter(
+    chunk_size: int = 10_000,
+    run_chunk_size: int = 1000,
+    legacy: bool = False,
+    root_doc: str = "prod/roar-prod",
+    query_kwargs: Optional[Dict[str, str]] = None,
+    started_before: Optional[date] = None,
+    started_after: Optional[date] = None,
+    user_type: Optional[str] = "users",
+    merge_user_info: bool = True,
+    max_workers: int = 1,
+    user_resolver: Optional[UserResolver] = None,
+    run_filter: Optional[RunFilter] = None,
+    parse_timestamps: bool = False,
+    shards: Optional[Sequence[Shard]] = None,
+    trial_conditions: Optional[List[str]] = None,
+    columns: Optional[Sequence[str]] = None,
+    compact: bool = False,
+    failed_runs: Optional[Dict[str, Exception]] = None,
+) -> Iterator[pd.DataFrame]:
+    """Get the trials of the runs that satisfy a query, one chunk at a time.
+
+    Like ``get_runs`` with ``return_trials`` (or ``get_runs_compat`` with
+    ``legacy``), but the runs are fetched ``run_chunk_size`` at a time, and
+    the trials of each batch of runs are yielded, merged with the run
+    columns, as they arrive. Only about one batch of runs and one chunk of
+    trials are held in memory, and processing can start before the query
+    finishes.
+
+    Unless ``columns`` is given, the schema of the chunks only grows: each
+    chunk has the columns of the chunks before them, in the same order, and a
+    field that first appears in a later trial adds a column that the earlier
+    chunks lack (see ``rechunk``).
+
+    Parameters
+    ----------
+    chunk_size : int, optional, default=10_000
+        The number of trials in each chunk but the last.
+
+    run_chunk_size : int, optional, default=1000
+        The number of runs whose trials are fetched together.
+
+    legacy : bool, optional, default=False
+        If True, query the legacy database, like ``get_runs_compat``.
+
+    root_doc : str, optional, default="prod/roar-prod"
+        The Firestore root document of the legacy database.
+
+    query_kwargs : dict, optional, default=None
+        The query to run. If None, all runs will be returned.
+
+    started_before : date, optional, default=None
+        Return only runs started before this date.
+
+    started_after : date, optional, default=None
+        Return only runs started after this date.
+
+    user_type : str, optional, default="users"
+        The user type to query. Either "users" or "guests".
+
+    merge_user_info : bool, optional, default=True
+        If True, merge the user doc info into the run data.
+
+    max_workers : int, optional, default=1
+        The maximum number of runs whose trials (or users) are fetched
+        concurrently.
+
+    user_resolver : UserResolver, optional, default=None
+        The resolver used to look up user docs when ``merge_user_info`` is True.
+
+    run_filter : callable, optional, default=None
+        A function applied to the raw run documents of each batch after the
+        date filters.
+
+    parse_timestamps : bool, optional, default=False
+        If True, return the timestamp columns as tz-aware datetimes.
+
+    shards : Sequence[Shard], optional, default=None
+        If provided, split the runs query into these shards.
+
+    trial_conditions : List[str], optional, default=None
+        If provided, fetch the trials of each batch of runs with a
+        collection-group scan (see ``get_runs``).
+
+    columns : Sequence[str], optional, default=None
+        If provided, every chunk has exactly these columns, in this order:
+        other columns are dropped and missing ones are filled with missing
+        values. Pass it when every chunk needs the same schema, e.g. to write
+        them to one Parquet file.
+
+    compact : bool, optional, default=False
+        If True, convert the chunks to compact dtypes with one
+        ``DtypeCompactor``, so that the chunks share their dtypes. The
+        dtypes are chosen by the first chunk, so strings are left as they
+        are, and widened if later chunks do not fit them.
+        For categories, convert the chunks with a ``DtypeCompactor`` that
+        declares them instead.
+
+    failed_runs : dict, optional, default=None
+        If provided, the runs whose trials could not be fetched are left out
+        and added to this dict, keyed by run ID, with the exception raised for
+        each, instead of raising a ``FetchError``.
+
+    Returns
+    -------
+    Iterator[pd.DataFrame]
+        The chunks of trials, indexed by trialId. If no run satisfies the
+        query, there are no chunks.
+    """
+    if trial_conditions is not None:
+        check_trial_conditions(trial_conditions)
+    raw_runs = _runs_source(
+        legacy,
+        root_doc,
+        query_kwargs,
+        started_before,
+        started_after,
+        user_type,
+        shards,
+        max_workers,
+    )
+    if merge_user_info and user_resolver is None:
+        user_resolver = UserResolver()
+
+    run_frames = _iter_run_frames(
+        raw_runs,
+        run_chunk_size,
+        legacy,
+        started_before,
+        started_after,
+        run_filter,
+        user_resolver if merge_user_info else None,
+        max_workers,
+        parse_timestamps,
+    )
+    trial_frames = _iter_trial_frames(
+        run_frames, max_workers, trial_conditions, parse_timestamps, failed_runs
+    )
+    chunks = rechunk(trial_frames, chunk_size, columns)
+    return _compact_chunks(chunks) if compact else chunks
+
+
+async def get_trials_from_run_async(
+    run_path: str, runner: AsyncRunner
+) -> List[Dict[str, Any]]:
+    """Get all trials from a run, like ``get_trials_from_run``.
+
+    Parameters
+    ----------
+    run_path : str
+        The Firestore path to the run.
+
+    runner : AsyncRunner
+        The runner that executes the fuego calls.
+
+    Returns
+    -------
+    List[Dict[str, str]]
+        The trials from the run.
+    """
+    trial_path = f"{trim_doc_path(run_path)}/trials"
+    fuego_query = ["fuego", "query", trial_path]
+    with timed("fetch trials"):
+        return merge_data_with_metadata(
+            fuego_response=await runner.page_records(
+                fuego_query, drop=TRIAL_DROPPED_FIELDS
+            ),
+            metadata_params={"CreateTime": "CreateTime", "trialId": "ID"},
+        )
+
+
+async def _finish_runs_async(
+    runner: AsyncRunner,
+    runs: List[_FuegoDocument],
+    legacy: bool,
+    return_trials: bool,
+    user_resolver: Optional[UserResolver],
+    trials_writer: Optional[ChunkWriter],
+    parse_timestamps: bool,
+) -> pd.DataFrame:
+    """Build the runs frame, fetching the users and trials concurrently.
+
+    The trial fetches start before the user lookups, and the runner's
+    semaphore interleaves their fuego calls. ``user_resolver`` is None when
+    user info is not merged.
+    """
+    df_runs = _runs_frame(runs, legacy=legacy)
+    run_paths = {run["ID"]: run["Path"] for run in runs}
+    trial_tasks = {}
+    if return_trials:
+        trial_tasks = runner.start(
+            lambda run_path: get_trials_from_run_async(run_path, runner), run_paths
+        )
+
+    try:
+        if user_resolver is not None:
+            with timed("merge users"):
+                users = await runner.get_users_from_runs(
+                    user_resolver, run_paths.values(), legacy=legacy
+                )
+                df_runs = _merge_users(df_runs, users, legacy=legacy)
+
+        if parse_timestamps:
+            df_runs = parse_timestamp_columns(df_runs)
+
+        if not return_trials:
+            return df_runs
+
+        if trials_writer is None:
+            run_trials = await gather_tasks(trial_tasks)
+            return _trials_frame(df_runs, run_trials, parse_timestamps)
+
+        async for run_id, trials in iter_tasks(trial_tasks):
+            if trials:
+                trials_writer.write(
+                    _run_trials_frame(df_runs, run_id, trials, parse_timestamps)
+                )
         return df_runs
+    finally:
+        for task in trial_tasks.values():
+            task.cancel()
 
-    run_trials = {
-        run_id: get_trials_from_run(run_path)
-        for run_id, run_path in tqdm(run_paths.items(), desc="Getting trials")
-    }
 
-    run_trials = {
-        run_id: pd.DataFrame(trials) for run_id, trials in run_trials.items() if trials
-    }
+async def get_runs_compat_async(
+    root_doc: str = "prod/roar-prod",
+    return_trials: bool = False,
+    query_kwargs: Optional[Dict[str, str]] = None,
+    started_before: Optional[date] = None,
+    started_after: Optional[date] = None,
+    merge_user_info: bool = False,
+    max_concurrency: int = 8,
+    user_resolver: Optional[UserResolver] = None,
+    run_filter: Optional[RunFilter] = None,
+    trials_writer: Optional[ChunkWriter] = None,
+    parse_timestamps: bool = False,
+) -> pd.DataFrame:
+    """Get all runs that satisfy a query, with concurrent fuego calls.
 
-    for run_id, df in run_trials.items():
-        df["runId"] = run_id  # type: ignore [call-overload]
+    This is the asyncio counterpart of ``get_runs_compat``. It runs the fuego
+    calls with an ``AsyncRunner`` and fetches the users and the trials of the
+    runs at the same time. In a notebook, await it directly::
 
-    df_trials = pd.concat(run_trials.values())
+        df = await get_runs_compat_async(return_trials=True)
 
-    df_trials.set_index("trialId", inplace=True)
-    df_trials = df_trials.merge(df_runs, left_on="runId", right_index=True, how="left")
+    Parameters
+    ----------
+    root_doc : str, optional, default="prod/roar-prod"
+        The Firestore root document. The returned runs will all be under this document.
 
-    return df_trials
+    return_trials : bool, optional, default=False
+        If True, return the trials for each run as well.
+
+    query_kwargs : dict, optional, default=None
+        The query to run. If None, all runs will be returned.
+
+    started_before : date, optional, default=None
+        Return only runs started before this date.
+
+    started_after : date, optional, default=None
+        Return only runs started after this date.
+
+    merge_user_info : bool, optional, default=False
+        If True, merge the user doc info into the run data.
+
+    max_concurrency : int, optional, default=8
+        The maximum number of concurrent fuego calls.
+
+    user_resolver : UserResolver, optional, default=None
+        The resolver used to look up user docs when ``merge_user_info`` is True.
+
+    run_filter : callable, optional, default=None
+        A function applied to the raw run documents after the date filters.
+
+    trials_writer : ChunkWriter, optional, default=None
+        If provided with ``return_trials``, each run's trials are written to
+        this writer, in the order of the runs, and the runs are returned.
+
+    parse_timestamps : bool, optional, default=False
+        If True, return the timestamp columns as tz-aware datetimes.
+
+    Returns
+    -------
+    pd.DataFrame
+        The runs, or the trials, that satisfy the query.
+    """
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.environ.get(
+        "ROAR_QUERY_LEGACY_CREDENTIALS", "NONE"
+    )
+
+    fuego_args, user_prefix = _compat_runs_query(
+        root_doc, query_kwargs, started_before, started_after
+    )
+    if merge_user_info and user_resolver is None:
+        user_resolver = UserResolver()
+
+    async with AsyncRunner(max_concurrency) as runner:
+        with timed("fetch runs"):
+            raw_runs = await runner.page_records(fuego_args, drop=RUN_DROPPED_FIELDS)
+        runs = _apply_run_filters(
+            list(_keep_compat_runs(raw_runs, root_doc, user_prefix)),
+            started_before,
+            started_after,
+            run_filter,
+        )
+        return await _finish_runs_async(
+            runner,
+            runs,
+            legacy=True,
+            return_trials=return_trials,
+            user_resolver=user_resolver if merge_user_info else None,
+            trials_writer=trials_writer,
+            parse_timestamps=parse_timestamps,
+        )
+
+
+async def get_runs_async(
+    return_trials: bool = False,
+    query_kwargs: Optional[Dict[str, str]] = None,
+    started_before: Optional[date] = None,
+    started_after: Optional[date] = None,
+    user_type: Optional[str] = "users",
+    merge_user_info: bool = True,
+    max_concurrency: int = 8,
+    user_resolver: Optional[UserResolver] = None,
+    run_filter: Optional[RunFilter] = None,
+    trials_writer: Optional[ChunkWriter] = None,
+    parse_timestamps: bool = False,
+) -> pd.DataFrame:
+    """Get all runs that satisfy a query, with concurrent fuego calls.
+
+    This is the asyncio counterpart of ``get_runs``. It runs the fuego calls
+    with an ``AsyncRunner`` and fetches the users and the trials of the runs
+    at the same time. In a notebook, await it directly::
+
+        df = await get_runs_async(return_trials=True, max_concurrency=16)
+
+    Parameters
+    ----------
+    return_trials : bool, optional, default=False
+        If True, return the trials for each run as well.
+
+    query_kwargs : dict, optional, default=None
+        The query to run. If None, all runs will be returned.
+
+    started_before : date, optional, default=None
+        Return only runs started before this date.
+
+    started_after : date, optional, default=None
+        Return only runs started after this date.
+
+    user_type : str, optional, default="users"
+        The user type to query. Either "users" or "guests".
+
+    merge_user_info : bool, optional, default=True
+        If True, merge the user doc info into the run data.
+
+    max_concurrency : int, optional, default=8
+        The maximum number of concurrent fuego calls.
+
+    user_resolver : UserResolver, optional, default=None
+        The resolver used to look up user docs when ``merge_user_info`` is True.
+
+    run_filter : callable, optional, default=None
+        A function applied to the raw run documents after the date filters.
+
+    trials_writer : ChunkWriter, optional, default=None
+        If provided with ``return_trials``, each run's trials are written to
+        this writer, in the order of the runs, and the runs are returned.
+
+    parse_timestamps : bool, optional, default=False
+        If True, return the timestamp columns as tz-aware datetimes.
+
+    Returns
+    -------
+    pd.DataFrame
+        The runs, or the trials, that satisfy the query.
+    """
+    os.environ["GOOGLE_APPLICATION_CREDENTIALS"] = os.environ.get(
+        "ROAR_QUERY_CREDENTIALS", "NONE"
+    )
+
+    fuego_args = _runs_query(query_kwargs, started_before, started_after, user_type)
+    if merge_user_info and user_resolver is None:
+        user_resolver = UserResolver()
+
+    async with AsyncRunner(max_concurrency) as runner:
+        with timed("fetch runs"):
+            raw_runs = await runner.page_records(fuego_args, drop=RUN_DROPPED_FIELDS)
+        runs = _apply_run_filters(
+            list(raw_runs), started_before, started_after, run_filter
+        )
+        return await _finish_runs_async(
+            runner,
+            runs,
+            legacy=False,
+            return_trials=return_trials,
+            user_resolver=user_resolver if merge_user_info else None,
+            trials_writer=trials_writer,
+            parse_timestamps=parse_timestamps,
+        )
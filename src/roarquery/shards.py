@@ -0,0 +1,386 @@
+"""Split a paginated query into shards that are paginated in parallel.
+
+Each page of a paginated query starts after the last document of the page
+before it, so one query can only ever fetch one page at a time. A query
+split into independent shards, e.g. one per date window, per task or per
+range of document paths, can fetch a page of every shard at once.
+``iter_sharded_records`` does so and merges the results, keeping the first
+copy of any document that more than one shard returned.
+"""
+from datetime import date
+from datetime import datetime
+from datetime import timezone
+from functools import partial
+from typing import Collection
+from typing import Iterable
+from typing import Iterator
+from typing import List
+from typing import Optional
+from typing import Sequence
+from typing import Set
+from typing import Union
+
+from .backends import format_timestamp
+from .backends import FuegoCommand
+from .backends import path_key
+from .metrics import timed
+from .utils import FuegoRecord
+from .utils import iter_concurrently
+from .utils import iter_pages
+from .utils import trim_doc_path
+
+# The operators of range conditions, whose results Firestore orders by the
+# range field rather than by document path.
+RANGE_OPERATORS = ("<", "<=", ">", ">=", "!=", "<not-in>")
+
+
+class Shard:
+    """One independent part of a query.
+
+    A shard adds conditions to the query, e.g. ``timeStarted >= ...``, and/or
+    limits it to a range of document paths. Path ranges rely on documents
+    being returned in path order, so they cannot be combined with range
+    conditions, which Firestore orders by the range field instead.
+
+    Parameters
+    ----------
+    conditions : Iterable[str], optional, default=()
+        The fuego conditions to add to the query.
+
+    start_after : str, optional, default=None
+        Return only documents after this path. Like fuego's ``--startafter``,
+        it must be the path of an existing document.
+
+    end_at : str, optional, default=None
+        Return only documents up to and including this path.
+    """
+
+    def __init__(
+        self,
+        conditions: Iterable[str] = (),
+        start_after: Optional[str] = None,
+        end_at: Optional[str] = None,
+    ) -> None:
+        """Initialize the shard."""
+        self.conditions = list(conditions)
+        self.start_after = start_after
+        self.end_at = end_at
+
+    def apply(self, query: List[str]) -> List[str]:
+        """Return the query for this shard.
+
+        Parameters
+        ----------
+        query : List[str]
+            The fuego argv of the whole query. It is not modified.
+
+        Returns
+        -------
+        List[str]
+            The fuego argv of the shard.
+
+        Raises
+        ------
+        ValueError
+            If the shard is a range of paths and the query has range
+            conditions.
+        """
+        shard_query = [*query, *self.conditions]
+        if self.start_after is not None or self.end_at is not None:
+            ranges = [
+                f"{field} {op}"
+                for field, op, _ in FuegoCommand(shard_query).conditions
+                if op in RANGE_OPERATORS
+            ]
+            if ranges:
+                raise ValueError(
+                    "Path shards cannot be combined with range conditions "
+                    f"({', '.join(ranges)}), which Firestore orders by field."
+                )
+        if self.start_after is not None:
+            idx = shard_query.index("query") + 1
+            shard_query[idx:idx] = ["--startafter", self.start_after]
+        return shard_query
+
+    def past_end(self, path: str) -> bool:
+        """Return whether a document comes after the end of this shard.
+
+        Parameters
+        ----------
+        path : str
+            The document path.
+
+        Returns
+        -------
+        bool
+            True if the shard has an end and the document is past it.
+        """
+        return self.end_at is not None and path_key(path) > path_key(self.end_at)
+
+    def __repr__(self) -> str:
+        """Return a short representation of the shard."""
+        parts = [repr(condition) for condition in self.conditions]
+        if self.start_after is not None:
+            parts.append(f"start_after={self.start_after!r}")
+        if self.end_at is not None:
+            parts.append(f"end_at={self.end_at!r}")
+        return f"Shard({', '.join(parts)})"
+
+
+def date_shards(
+    started_after: Union[date, datetime],
+    started_before: Union[date, datetime],
+    n_shards: int,
+    field: str = "timeStarted",
+) -> List[Shard]:
+    """Split a date range into windows of equal length.
+
+    Dates and naive datetimes are interpreted as local time, as in
+    ``roarquery.runs.date_conditions``.
+
+    Parameters
+    ----------
+    started_after : date or datetime
+        The start of the first window.
+
+    started_before : date or datetime
+        The end of the last window.
+
+    n_shards : int
+        The number of windows.
+
+    field : str, optional, default="timeStarted"
+        The timestamp field to split on.
+
+    Returns
+    -------
+    List[Shard]
+        One shard per window, each including its start and excluding its end.
+
+    Raises
+    ------
+    ValueError
+        If the range is empty or ``n_shards`` is not positive.
+    """
+    start = _as_utc(started_after)
+    end = _as_utc(started_before)
+    if n_shards < 1 or end <= start:
+        raise ValueError(
+            "Date shards need a positive number of shards and a non-empty range."
+        )
+
+    bounds = [start + (end - start) * idx / n_shards for idx in range(n_shards)]
+    bounds.append(end)
+    return [
+        Shard(
+            [
+                f"{field} >= {format_timestamp(window_start)}",
+                f"{field} < {format_timestamp(window_end)}",
+            ]
+        )
+        for window_start, window_end in zip(bounds, bounds[1:])
+    ]
+
+
+def _as_utc(value: Union[date, datetime]) -> datetime:
+    """Convert a date (local midnight) or datetime to an aware UTC datetime."""
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    return value.astimezone(timezone.utc)
+
+
+def value_shards(field: str, values: Iterable[str]) -> List[Shard]:
+    """Split a query by the values of a field, e.g. the task IDs of runs.
+
+    Documents whose field has none of the values are in none of the shards,
+    so ``values`` must list every value of interest.
+
+    Parameters
+    ----------
+    field : str
+        The field to split on, e.g. "taskId".
+
+    values : Iterable[str]
+        The values of the field.
+
+    Returns
+    -------
+    List[Shard]
+        One shard per value.
+
+    Examples
+    --------
+    >>> value_shards("taskId", ["swr", "sre"])
+    [Shard('taskId == "swr"'), Shard('taskId == "sre"')]
+    """
+    return [Shard([f'{field} == "{value}"']) for value in values]
+
+
+def path_shards(boundaries: Iterable[str]) -> List[Shard]:
+    """Split a query into ranges of document paths.
+
+    Parameters
+    ----------
+    boundaries : Iterable[str]
+        The paths of existing documents at which to split, e.g. the paths of
+        runs from an earlier export. Each boundary is the last document of
+        one shard, and the next shard starts after it.
+
+    Returns
+    -------
+    List[Shard]
+        One more shard than there are boundaries.
+
+    Examples
+    --------
+    >>> path_shards(["users/m/runs/r"])
+    [Shard(end_at='users/m/runs/r'), Shard(start_after='users/m/runs/r')]
+    """
+    paths = sorted({trim_doc_path(path) for path in boundaries}, key=path_key)
+    starts: List[Optional[str]] = [None, *paths]
+    ends: List[Optional[str]] = [*paths, None]
+    return [Shard(start_after=start, end_at=end) for start, end in zip(starts, ends)]
+
+
+def make_shards(
+    spec: str,
+    started_after: Optional[Union[date, datetime]] = None,
+    started_before: Optional[Union[date, datetime]] = None,
+) -> List[Shard]:
+    """Create the shards of a runs query from their description.
+
+    Parameters
+    ----------
+    spec : str
+        One of "date:<number of windows>", "task:<task ID>,<task ID>,..." or
+        "path:<document path>,<document path>,...".
+
+    started_after : date or datetime, optional, default=None
+        The start of the date range of the query. Required for date shards
+        and not allowed with path shards.
+
+    started_before : date or datetime, optional, default=None
+        The end of the date range of the query. Required for date shards and
+        not allowed with path shards.
+
+    Returns
+    -------
+    List[Shard]
+        The shards.
+
+    Raises
+    ------
+    ValueError
+        If the description is invalid, or path shards are combined with a
+        date range.
+
+    Examples
+    --------
+    >>> make_shards("task:swr,sre")
+    [Shard('taskId == "swr"'), Shard('taskId == "sre"')]
+    """
+    name, _, argument = spec.partition(":")
+    values = [value.strip() for value in argument.split(",") if value.strip()]
+    if name == "date" and argument.isdigit():
+        if started_after is None or started_before is None:
+            raise ValueError("Date shards require a start and an end date.")
+        return date_shards(started_after, started_before, int(argument))
+    if name == "task" and values:
+        return value_shards("taskId", values)
+    if name == "path" and values:
+        if started_after is not None or started_before is not None:
+            raise ValueError("Path shards cannot be combined with a date range.")
+        return path_shards(values)
+
+    raise ValueError(
+        f"Unknown shards {spec!r}. Use 'date:<N>', 'task:<ID>,<ID>,...' or "
+        "'path:<PATH>,<PATH>,...'."
+    )
+
+
+def fetch_shard(
+    query: List[str], shard: Shard, drop: Collection[str] = ("ReadTime",)
+) -> List[FuegoRecord]:
+    """Page through one shard of a query.
+
+    Parameters
+    ----------
+    query : List[str]
+        The fuego argv of the whole query.
+
+    shard : Shard
+        The shard to fetch.
+
+    drop : Collection[str], optional, default=("ReadTime",)
+        The metadata fields to leave out of each record.
+
+    Returns
+    -------
+    List[FuegoRecord]
+        The documents of the shard, in the order fuego returned them.
+    """
+    records: List[FuegoRecord] = []
+    with timed("fetch shard", shard=repr(shard)) as span:
+        for page in iter_pages(shard.apply(query)):
+            records.extend(
+                FuegoRecord.from_json(doc, drop)
+                for doc in page
+                if not shard.past_end(doc["Path"])
+            )
+            # Pages are in path order, so the rest of the shard is past its end.
+            if shard.past_end(page[-1]["Path"]):
+                break
+        span["documents"] = len(records)
+    return records
+
+
+def iter_sharded_records(
+    query: List[str],
+    shards: Sequence[Shard],
+    drop: Iterable[str] = ("ReadTime",),
+    max_workers: int = 1,
+) -> Iterator[FuegoRecord]:
+    """Page through the shards of a query in parallel, yielding compact records.
+
+    Like ``iter_records``, but the shards are paginated concurrently and their
+    documents are yielded shard by shard, in the order of ``shards``. A
+    document returned by more than one shard is yielded once.
+
+    Parameters
+    ----------
+    query : List[str]
+        The fuego argv of the whole query. It is not modified.
+
+    shards : Sequence[Shard]
+        The shards. Together, they should cover the whole query.
+
+    drop : Iterable[str], optional, default=("ReadTime",)
+        The metadata fields to leave out of each record.
+
+    max_workers : int, optional, default=1
+        The maximum number of shards paginated at once.
+
+    Yields
+    ------
+    FuegoRecord
+        Each document returned by the query.
+
+    Raises
+    ------
+    ValueError
+        If path shards are combined with range conditions (see ``Shard``).
+    """
+    # Check every shard before fetching any of them.
+    for shard in shards:
+        shard.apply(query)
+
+    fetch = partial(fetch_shard, query, drop=tuple(drop))
+    seen: Set[str] = set()
+    for _, records in iter_concurrently(
+        fetch, dict(enumerate(shards)), max_workers=max_workers
+    ):
+        for record in records:
+            path = record.path
+            if path not in seen:
+                seen.add(path)
+                yield record
@@ -0,0 +1,304 @@
+"""Incrementally sync ROAR runs and trials into an existing export."""
+import json
+import os
+import tempfile
+from datetime import date
+from datetime import datetime
+from typing import Any
+from typing import Dict
+from typing import List
+from typing import Optional
+from typing import Sequence
+
+import pandas as pd
+from dateutil.parser import isoparse
+
+from .runs import get_runs
+from .runs import get_runs_compat
+from .runs import NoResultsError
+from .utils import _FuegoDocument
+from .writers import open_writer
+from .writers import read_export
+
+
+def query_key(**query: Any) -> str:
+    """Return a stable key identifying a query in the sync state file.
+
+    Parameters
+    ----------
+    **query : Any
+        The parameters that define the query. Dates are converted to ISO
+        strings.
+
+    Returns
+    -------
+    str
+        A JSON string with sorted keys.
+
+    Examples
+    --------
+    >>> query_key(task_id="swr", started_after=date(2021, 5, 10))
+    '{"started_after": "2021-05-10", "task_id": "swr"}'
+    """
+    return json.dumps(
+        {
+            key: value.isoformat() if isinstance(value, date) else value
+            for key, value in query.items()
+        },
+        sort_keys=True,
+    )
+
+
+def load_state(state_filename: str) -> Dict[str, Dict[str, str]]:
+    """Load the sync state file.
+
+    Parameters
+    ----------
+    state_filename : str
+        The path to the state file. A missing file is treated as empty.
+
+    Returns
+    -------
+    Dict[str, Dict[str, str]]
+        The sync state for each query key.
+    """
+    if not os.path.exists(state_filename):
+        return {}
+
+    with open(state_filename) as fp:
+        return json.load(fp)  # type: ignore[no-any-return]
+
+
+def save_state(state_filename: str, state: Dict[str, Dict[str, str]]) -> None:
+    """Atomically write the sync state file.
+
+    Parameters
+    ----------
+    state_filename : str
+        The path to the state file.
+
+    state : Dict[str, Dict[str, str]]
+        The sync state for each query key.
+    """
+    state_dir = os.path.dirname(os.path.abspath(state_filename))
+    fd, tmp_path = tempfile.mkstemp(dir=state_dir, suffix=".tmp")
+    try:
+        with os.fdopen(fd, "w") as fp:
+            json.dump(state, fp, indent=2, sort_keys=True)
+        os.replace(tmp_path, state_filename)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+
+
+def _is_newer(run: _FuegoDocument, watermark: datetime) -> bool:
+    """Return True if a run was updated or started after the watermark."""
+    if isoparse(run["UpdateTime"]) > watermark:
+        return True
+
+    time_started = run["Data"].get("timeStarted")
+    return time_started is not None and isoparse(time_started) > watermark
+
+
+class WatermarkFilter:
+    """Keep only the runs that changed after a watermark.
+
+    Used as the ``run_filter`` of ``get_runs``/``get_runs_compat``. A run is
+    kept if its ``UpdateTime`` or ``timeStarted`` is newer than the watermark.
+    The filter also records the newest ``UpdateTime`` among all of the runs it
+    sees, which becomes the watermark for the next sync.
+
+    Parameters
+    ----------
+    watermark : str, optional, default=None
+        The ``UpdateTime`` recorded by the previous sync. If None, every run is
+        kept.
+    """
+
+    def __init__(self, watermark: Optional[str] = None) -> None:
+        """Initialize the filter."""
+        self.watermark = watermark
+        self.max_update_time = watermark
+        self.seen = 0
+        self.kept = 0
+
+    def __call__(self, runs: Sequence[_FuegoDocument]) -> List[_FuegoDocument]:
+        """Filter the runs and update the newest ``UpdateTime`` seen.
+
+        Parameters
+        ----------
+        runs : Sequence[_FuegoDocument]
+            The runs returned by the query.
+
+        Returns
+        -------
+        List[_FuegoDocument]
+            The runs that changed after the watermark.
+        """
+        self.seen += len(runs)
+        newest = isoparse(self.max_update_time) if self.max_update_time else None
+        for run in runs:
+            update_time = isoparse(run["UpdateTime"])
+            if newest is None or update_time > newest:
+                newest = update_time
+                self.max_update_time = run["UpdateTime"]
+
+        if self.watermark is None:
+            changed = list(runs)
+        else:
+            watermark = isoparse(self.watermark)
+            changed = [run for run in runs if _is_newer(run, watermark)]
+
+        self.kept += len(changed)
+        return changed
+
+
+def merge_exports(previous: pd.DataFrame, changed: pd.DataFrame) -> pd.DataFrame:
+    """Merge newly fetched runs or trials into a previous export.
+
+    Every row of the previous export that belongs to a changed run is replaced
+    by the changed rows, so trials deleted from a changed run are dropped too.
+
+    Parameters
+    ----------
+    previous : pd.DataFrame
+        The previous export, indexed by ``runId`` or ``trialId``.
+
+    changed : pd.DataFrame
+        The runs or trials fetched for the changed runs, with the same index.
+
+    Returns
+    -------
+    pd.DataFrame
+        The merged export.
+    """
+    if "runId" in previous.columns:
+        previous_run_ids = previous["runId"]
+        changed_run_ids = changed["runId"]
+    else:
+        previous_run_ids = previous.index.to_series()
+        changed_run_ids = changed.index.to_series()
+
+    kept = previous[~previous_run_ids.isin(changed_run_ids).to_numpy()]
+    return pd.concat([kept, changed])
+
+
+def sync_runs(
+    output_filename: str,
+    state_filename: Optional[str] = None,
+    legacy: bool = False,
+    root_doc: str = "prod/roar-prod",
+    return_trials: bool = False,
+    query_kwargs: Optional[Dict[str, str]] = None,
+    started_before: Optional[date] = None,
+    started_after: Optional[date] = None,
+    output_format: Optional[str] = None,
+    **get_runs_kwargs: Any,
+) -> pd.DataFrame:
+    """Update an export with only the runs that changed since the last sync.
+
+    The state file holds the newest ``UpdateTime`` seen for each query. Only
+    runs newer than that watermark have their user docs and trials fetched,
+    and the results are merged into the existing export by ``runId`` (and
+    therefore ``trialId``) before it is rewritten.
+
+    If ``failed_runs`` is passed (see ``get_runs``) and any run is skipped,
+    the export is still written but the watermark is left where it was, so
+    the next sync fetches the skipped runs again.
+
+    Parameters
+    ----------
+    output_filename : str
+        The export to create or update.
+
+    state_filename : str, optional, default=None
+        The sync state file. Defaults to ``output_filename`` + ".sync.json".
+
+    legacy : bool, optional, default=False
+        If True, query the legacy database with ``get_runs_compat``.
+
+    root_doc : str, optional, default="prod/roar-prod"
+        The Firestore root document. Only used for the legacy database.
+
+    return_trials : bool, optional, default=False
+        If True, sync the trials for each run as well.
+
+    query_kwargs : dict, optional, default=None
+        The query to run. If None, all runs will be synced.
+
+    started_before : date, optional, default=None
+        Sync only runs started before this date.
+
+    started_after : date, optional, default=None
+        Sync only runs started after this date.
+
+    output_format : str, optional, default=None
+        One of "csv", "parquet" or "feather". If None, the format is inferred
+        from the extension of ``output_filename``.
+
+    **get_runs_kwargs : Any
+        Additional arguments passed to ``get_runs`` or ``get_runs_compat``.
+
+    Returns
+    -------
+    pd.DataFrame
+        The updated export.
+    """
+    if state_filename is None:
+        state_filename = f"{output_filename}.sync.json"
+
+    query_kwargs = dict(query_kwargs) if query_kwargs is not None else {}
+    key = query_key(
+        output=os.path.abspath(output_filename),
+        legacy=legacy,
+        root_doc=root_doc if legacy else None,
+        return_trials=return_trials,
+        query_kwargs=query_kwargs,
+        started_before=started_before,
+        started_after=started_after,
+    )
+
+    state = load_state(state_filename)
+    previous: Optional[pd.DataFrame] = None
+    watermark = None
+    if os.path.exists(output_filename):
+        previous = read_export(output_filename, output_format)
+        watermark = state.get(key, {}).get("UpdateTime")
+
+    run_filter = WatermarkFilter(watermark)
+    kwargs: Dict[str, Any] = dict(
+        return_trials=return_trials,
+        query_kwargs=query_kwargs,
+        started_before=started_before,
+        started_after=started_after,
+        run_filter=run_filter,
+        **get_runs_kwargs,
+    )
+
+    try:
+        if legacy:
+            changed = get_runs_compat(root_doc=root_doc, **kwargs)
+        else:
+            changed = get_runs(**kwargs)
+    except NoResultsError:
+        # Nothing changed since the last sync, so keep the previous export.
+        if previous is None or not run_filter.seen or run_filter.kept:
+            raise
+        merged = previous
+    else:
+        merged = changed if previous is None else merge_exports(previous, changed)
+        with open_writer(output_filename, output_format) as writer:
+            writer.write(merged)
+
+    # A skipped run is older than the new watermark, so advancing it would
+    # leave the run's trials out of every later sync.
+    if run_filter.max_update_time is not None and not get_runs_kwargs.get(
+        "failed_runs"
+    ):
+        state[key] = {
+            "UpdateTime": run_filter.max_update_time,
+            "syncedAt": datetime.now().astimezone().isoformat(),
+        }
+        save_state(state_filename, state)
+
+    return merged
@@ -0,0 +1,345 @@
+"""Resolve and cache the user documents that own ROAR runs."""
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any
+from typing import cast
+from typing import Dict
+from typing import Iterable
+from typing import List
+from typing import Optional
+from typing import Tuple
+
+from .metrics import timed
+from .utils import _FuegoResponse
+from .utils import bytes2json
+from .utils import map_concurrently
+from .utils import run_fuego
+from .utils import trim_doc_path
+
+
+INVALID_USER_KEYS = ["districts", "schools", "classes", "groups", "families"]
+
+
+def split_run_path(run_path: str) -> Tuple[str, str]:
+    """Split a run path into the owning user's path and the run ID.
+
+    Parameters
+    ----------
+    run_path : str
+        The Firestore path to the run.
+
+    Returns
+    -------
+    Tuple[str, str]
+        The user path (e.g. "users/aa-0001") and the run ID.
+
+    Examples
+    --------
+    >>> split_run_path("databases/(default)/documents/users/aa-0001/runs/run-1")
+    ('users/aa-0001', 'run-1')
+    """
+    user_path, run_id = trim_doc_path(run_path).split("/runs/")
+    return user_path, run_id
+
+
+def fetch_user(user_path: str) -> _FuegoResponse:
+    """Fetch a single user document with fuego.
+
+    Parameters
+    ----------
+    user_path : str
+        The Firestore path to the user, e.g. "users/aa-0001".
+
+    Returns
+    -------
+    _FuegoResponse
+        The raw user document.
+    """
+    user_collection, user_id = user_path.rsplit("/", 1)
+    fuego_query = ["fuego", "get", user_collection, user_id]
+    with timed("fetch user"):
+        return cast(_FuegoResponse, bytes2json(run_fuego(fuego_query)))
+
+
+def user_from_doc(
+    user_result: _FuegoResponse, run_id: str, legacy: bool = False
+) -> Dict[str, Any]:
+    """Build the user info row for one run from a raw user document.
+
+    Parameters
+    ----------
+    user_result : _FuegoResponse
+        The raw user document, as returned by ``fetch_user``.
+
+    run_id : str
+        The ID of the run that the user owns.
+
+    legacy : bool, optional
+        If True, the returned user will be identified by PID, otherwise the user
+        will be identified by roarUid. Default: False.
+
+    Returns
+    -------
+    Dict[str, Any]
+        The user info, with organization lists removed.
+    """
+    user = dict(user_result["Data"])
+    user["CreateTime"] = user_result["CreateTime"]
+
+    uid_key = "PID" if legacy else "roarUid"
+    user[uid_key] = user_result["ID"]
+    user["runId"] = run_id
+
+    return {key: value for key, value in user.items() if key not in INVALID_USER_KEYS}
+
+
+class UserResolver:
+    """Fetch each user document once and keep it in a bounded LRU cache.
+
+    Runs are grouped by the path of the user that owns them so that a user
+    with many runs costs a single ``fuego get``. Documents can optionally be
+    persisted to a JSON file so that later invocations within ``ttl`` seconds
+    skip user fetches entirely.
+
+    Parameters
+    ----------
+    max_size : int, optional, default=100000
+        The maximum number of user documents held in memory.
+
+    cache_path : str, optional, default=None
+        If provided, load cached user documents from this file and write them
+        back when ``save`` is called.
+
+    ttl : float, optional, default=86400
+        The number of seconds after which a persisted user document is stale.
+        If None, persisted documents never expire.
+
+    Attributes
+    ----------
+    hits : int
+        The number of lookups served from the cache.
+
+    misses : int
+        The number of lookups that required a fuego call.
+    """
+
+    def __init__(
+        self,
+        max_size: int = 100_000,
+        cache_path: Optional[str] = None,
+        ttl: Optional[float] = 86_400,
+    ) -> None:
+        """Initialize the resolver, loading any persisted documents."""
+        self.max_size = max_size
+        self.cache_path = cache_path
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._docs: "OrderedDict[str, Tuple[float, _FuegoResponse]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+        if cache_path is not None and os.path.exists(cache_path):
+            self._load(cache_path)
+
+    def __len__(self) -> int:
+        """Return the number of cached user documents."""
+        return len(self._docs)
+
+    def _is_fresh(self, fetched_at: float) -> bool:
+        return self.ttl is None or time.time() - fetched_at < self.ttl
+
+    def _load(self, cache_path: str) -> None:
+        with open(cache_path) as fp:
+            entries = json.load(fp)
+
+        for user_path, entry in entries.items():
+            if self._is_fresh(entry["fetched_at"]):
+                self._put(user_path, entry["doc"], entry["fetched_at"])
+
+    def _put(self, user_path: str, doc: _FuegoResponse, fetched_at: float) -> None:
+        with self._lock:
+            self._docs[user_path] = (fetched_at, doc)
+            self._docs.move_to_end(user_path)
+            while len(self._docs) > self.max_size:
+                self._docs.popitem(last=False)
+
+    def _get_cached(self, user_path: str) -> Optional[_FuegoResponse]:
+        with self._lock:
+            entry = self._docs.get(user_path)
+            if entry is None:
+                return None
+            if not self._is_fresh(entry[0]):
+                del self._docs[user_path]
+                return None
+            self._docs.move_to_end(user_path)
+            return entry[1]
+
+    def get_user(self, user_path: str) -> _FuegoResponse:
+        """Return a user document, fetching it only if it is not cached.
+
+        Parameters
+        ----------
+        user_path : str
+            The Firestore path to the user, e.g. "users/aa-0001".
+
+        Returns
+        -------
+        _FuegoResponse
+            The raw user document.
+        """
+        return self.get_users([user_path])[user_path]
+
+    def get_users(
+        self,
+        user_paths: Iterable[str],
+        max_workers: int = 1,
+        desc: Optional[str] = None,
+    ) -> Dict[str, _FuegoResponse]:
+        """Return many user documents, fetching each uncached user once.
+
+        Parameters
+        ----------
+        user_paths : Iterable[str]
+            The Firestore paths to the users. Repeated paths count as cache hits.
+
+        max_workers : int, optional, default=1
+            The maximum number of concurrent user fetches.
+
+        desc : str, optional, default=None
+            If provided, show a progress bar with this description.
+
+        Returns
+        -------
+        Dict[str, _FuegoResponse]
+            The raw user documents keyed by user path.
+        """
+        docs, to_fetch = self.lookup(user_paths)
+        fetched = map_concurrently(
+            fetch_user, {path: path for path in to_fetch}, max_workers, desc
+        )
+        self.add(fetched)
+        docs.update(fetched)
+        return docs
+
+    def lookup(
+        self, user_paths: Iterable[str]
+    ) -> Tuple[Dict[str, _FuegoResponse], List[str]]:
+        """Split user paths into cached documents and users to fetch.
+
+        Each uncached user counts as one miss, and every other path as a hit.
+
+        Parameters
+        ----------
+        user_paths : Iterable[str]
+            The Firestore paths to the users.
+
+        Returns
+        -------
+        Tuple[Dict[str, _FuegoResponse], List[str]]
+            The cached documents keyed by user path, and the distinct paths
+            of the users that are not cached.
+        """
+        docs: Dict[str, _FuegoResponse] = {}
+        to_fetch: Dict[str, None] = {}
+        for user_path in user_paths:
+            if user_path in docs or user_path in to_fetch:
+                self.hits += 1
+                continue
+
+            doc = self._get_cached(user_path)
+            if doc is None:
+                self.misses += 1
+                to_fetch[user_path] = None
+            else:
+                self.hits += 1
+                docs[user_path] = doc
+
+        return docs, list(to_fetch)
+
+    def add(self, docs: Dict[str, _FuegoResponse]) -> None:
+        """Cache freshly fetched user documents.
+
+        Parameters
+        ----------
+        docs : Dict[str, _FuegoResponse]
+            The raw user documents keyed by user path.
+        """
+        now = time.time()
+        for user_path, doc in docs.items():
+            self._put(user_path, doc, now)
+
+    def get_users_from_runs(
+        self,
+        run_paths: Iterable[str],
+        legacy: bool = False,
+        max_workers: int = 1,
+        desc: Optional[str] = None,
+    ) -> List[Dict[str, Any]]:
+        """Return the user info for each run, fetching each user once.
+
+        Parameters
+        ----------
+        run_paths : Iterable[str]
+            The Firestore paths to the runs.
+
+        legacy : bool, optional
+            If True, users are identified by PID, otherwise by roarUid.
+            Default: False.
+
+        max_workers : int, optional, default=1
+            The maximum number of concurrent user fetches.
+
+        desc : str, optional, default=None
+            If provided, show a progress bar with this description.
+
+        Returns
+        -------
+        List[Dict[str, Any]]
+            One user info row per run, in the order of ``run_paths``.
+        """
+        split_paths = [split_run_path(run_path) for run_path in run_paths]
+        docs = self.get_users(
+            (user_path for user_path, _ in split_paths),
+            max_workers=max_workers,
+            desc=desc,
+        )
+        return [
+            user_from_doc(docs[user_path], run_id, legacy=legacy)
+            for user_path, run_id in split_paths
+        ]
+
+    def stats(self) -> Dict[str, int]:
+        """Return the cache hit and miss counts.
+
+        Returns
+        -------
+        Dict[str, int]
+            The number of hits, misses, and cached documents.
+        """
+        return {"hits": self.hits, "misses": self.misses, "size": len(self)}
+
+    def save(self) -> None:
+        """Atomically write the cached user documents to ``cache_path``."""
+        if self.cache_path is None:
+            return
+
+        with self._lock:
+            entries = {
+                user_path: {"fetched_at": fetched_at, "doc": doc}
+                for user_path, (fetched_at, doc) in self._docs.items()
+            }
+
+        cache_dir = os.path.dirname(os.path.abspath(self.cache_path))
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_path = tempfile.mkstemp(dir=cache_dir, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as fp:
+                json.dump(entries, fp)
+            os.replace(tmp_path, self.cache_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
@@ -1,14 +1,38 @@
 """Utilities functions."""
-import json
-import subprocess  # nosec
+import sys
+import time
+from collections import deque
+from contextlib import contextmanager
+from concurrent.futures import Future
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 from re import sub
 from typing import Any
+from typing import Callable
 from typing import cast
+from typing import Collection
+from typing import ContextManager
+from typing import Deque
 from typing import Dict
+from typing import Hashable
+from typing import Iterable
+from typing import Iterator
 from typing import List
 from typing import Literal
+from typing import Mapping
 from typing import Optional
+from typing import Tuple
 from typing import TypedDict
+from typing import TypeVar
+from typing import Union
+
+from .backends import get_backend
+from .cache import get_response_cache
+from .checkpoint import get_checkpoint
+from .decoding import decode_page
+from .metrics import count
+from .metrics import timed
+from .retry import get_retry_policy
 
 
 _FuegoKey = Literal["CreateTime", "Data", "ID", "Path", "ReadTime", "UpdateTime"]
@@ -23,6 +47,199 @@ class _FuegoResponse(TypedDict):
     UpdateTime: str
 
 
+# The attribute of a FuegoRecord that holds each fuego key.
+_RECORD_ATTRS: Dict[str, str] = {
+    "CreateTime": "create_time",
+    "Data": "data",
+    "ID": "doc_id",
+    "Path": "path",
+    "ReadTime": "read_time",
+    "UpdateTime": "update_time",
+}
+
+
+class FuegoRecord:
+    """A compact fuego document.
+
+    A ``FuegoRecord`` holds the same fields as the dict that fuego prints, but
+    in slots rather than in a dict of its own, and the parent of its path is
+    interned, so that the many trials of a run share one parent path string.
+    Metadata fields that are not needed can be dropped when the record is
+    created.
+
+    Records can be indexed like the dicts they replace, e.g.
+    ``record["Data"]`` or ``record["Path"]``. Indexing a dropped field raises
+    a ``KeyError``, just as a missing dict key would.
+
+    Parameters
+    ----------
+    doc_id : str
+        The document ID.
+
+    path : str
+        The full path to the document.
+
+    data : Dict[str, Any]
+        The document data. It is not copied.
+
+    create_time : str, optional, default=None
+        The time the document was created.
+
+    update_time : str, optional, default=None
+        The time the document was last updated.
+
+    read_time : str, optional, default=None
+        The time the document was read.
+
+    Examples
+    --------
+    >>> record = FuegoRecord.from_json(
+    ...     {
+    ...         "ID": "run-1",
+    ...         "Data": {"a": "b"},
+    ...         "Path": "prod/roar-prod/users/aa/runs/run-1",
+    ...         "CreateTime": "2020-04-01T00:00:00Z",
+    ...         "ReadTime": "2020-04-01T00:00:00Z",
+    ...         "UpdateTime": "2020-04-01T00:00:00Z",
+    ...     },
+    ...     drop=["ReadTime"],
+    ... )
+    >>> record["Path"]
+    'prod/roar-prod/users/aa/runs/run-1'
+    >>> record.get("ReadTime") is None
+    True
+    """
+
+    __slots__ = (
+        "doc_id",
+        "data",
+        "create_time",
+        "update_time",
+        "read_time",
+        "_parent",
+        "_path",
+    )
+
+    def __init__(
+        self,
+        doc_id: str,
+        path: str,
+        data: Dict[str, Any],
+        create_time: Optional[str] = None,
+        update_time: Optional[str] = None,
+        read_time: Optional[str] = None,
+    ) -> None:
+        """Initialize the record."""
+        self.doc_id = doc_id
+        self.data = data
+        self.create_time = create_time
+        self.update_time = update_time
+        self.read_time = read_time
+
+        parent, _, name = path.rpartition("/")
+        if name == doc_id:
+            self._parent: Optional[str] = sys.intern(parent)
+            self._path: Optional[str] = None
+        else:
+            self._parent = None
+            self._path = path
+
+    @classmethod
+    def from_json(
+        cls, doc: Mapping[str, Any], drop: Collection[str] = ()
+    ) -> "FuegoRecord":
+        """Create a record from a decoded fuego document.
+
+        Parameters
+        ----------
+        doc : Mapping[str, Any]
+            The document, as decoded from fuego's output.
+
+        drop : Collection[str], optional, default=()
+            The metadata fields to leave out, e.g. ``["ReadTime"]``. ``ID``,
+            ``Path`` and ``Data`` are always kept.
+
+        Returns
+        -------
+        FuegoRecord
+            The compact record.
+        """
+        return cls(
+            doc["ID"],
+            doc["Path"],
+            doc["Data"],
+            create_time=None if "CreateTime" in drop else doc.get("CreateTime"),
+            update_time=None if "UpdateTime" in drop else doc.get("UpdateTime"),
+            read_time=None if "ReadTime" in drop else doc.get("ReadTime"),
+        )
+
+    @property
+    def path(self) -> str:
+        """The full path to the document."""
+        if self._path is not None:
+            return self._path
+        return f"{self._parent}/{self.doc_id}"
+
+    def __getitem__(self, key: str) -> Any:
+        """Return a field by its fuego key, e.g. ``record["Data"]``."""
+        value = getattr(self, _RECORD_ATTRS[key]) if key in _RECORD_ATTRS else None
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key: str, default: Any = None) -> Any:
+        """Return a field by its fuego key, or ``default`` if it is missing."""
+        try:
+            return self[key]
+        except KeyError:
+            return default
+
+    def to_json(self) -> Dict[str, Any]:
+        """Return the record as the dict that fuego prints, without dropped fields."""
+        return {key: self[key] for key in _RECORD_ATTRS if self.get(key) is not None}
+
+    def __repr__(self) -> str:
+        """Return a short representation of the record."""
+        return f"FuegoRecord({self.path!r})"
+
+
+_FuegoDocument = Union[_FuegoResponse, FuegoRecord]
+
+
+_PAGE_SIZE = 100
+_MAX_PAGE_SIZE: Optional[int] = None
+
+_K = TypeVar("_K", bound=Hashable)
+_A = TypeVar("_A")
+_R = TypeVar("_R")
+
+
+class FetchError(RuntimeError):
+    """Raised when one or more items of a concurrent fetch fail."""
+
+    def __init__(
+        self,
+        errors: Dict[Any, Exception],
+        results: Optional[Dict[Any, Any]] = None,
+    ) -> None:
+        """Initialize the error.
+
+        Parameters
+        ----------
+        errors : Dict[Hashable, Exception]
+            The exception raised for each item that failed, keyed by item key.
+
+        results : Dict[Hashable, Any], optional
+            The results of the items that succeeded, keyed by item key.
+        """
+        self.errors = errors
+        self.results = results if results is not None else {}
+        key, exc = next(iter(errors.items()))
+        super().__init__(
+            f"Failed to fetch {len(errors)} item(s). First failure for {key!r}: {exc!r}"
+        )
+
+
 def camel_case(string: str) -> str:
     """Convert a string to camel case.
 
@@ -51,6 +268,9 @@ def camel_case(string: str) -> str:
 def bytes2json(bytes: bytes) -> List[_FuegoResponse]:
     r"""Convert bytes to json.
 
+    The bytes are parsed once with the decoder chosen in
+    ``roarquery.decoding``.
+
     Parameters
     ----------
     bytes : bytes
@@ -83,52 +303,577 @@ def bytes2json(bytes: bytes) -> List[_FuegoResponse]:
     ... }])
     True
     """
-    if not bytes:
-        return []
-    return cast(List[_FuegoResponse], json.loads(bytes.decode("utf-8")))
+    with timed("decode"):
+        documents = decode_page(bytes)
+    count("documents decoded", len(documents) if isinstance(documents, list) else 1)
+    return cast(List[_FuegoResponse], documents)
+
+
+def summarize_argv(query: List[str], max_length: int = 200) -> str:
+    """Return a fuego command as a string, shortened for logs and traces.
+
+    Parameters
+    ----------
+    query : List[str]
+        The fuego argv, starting with "fuego".
+
+    max_length : int, optional, default=200
+        The longest summary to return.
+
+    Returns
+    -------
+    str
+        The command, with "..." in place of anything past ``max_length``.
+
+    Examples
+    --------
+    >>> summarize_argv(["fuego", "query", "-g", "runs"])
+    'fuego query -g runs'
+    >>> summarize_argv(["fuego", "query", "-g", "runs"], max_length=10)
+    'fuego q...'
+    """
+    summary = " ".join(query)
+    if len(summary) > max_length:
+        summary = summary[: max_length - 3] + "..."
+    return summary
+
+
+def _run_backend(query: List[str]) -> bytes:
+    """Run a fuego command once with the active backend, recording metrics."""
+    with timed("fuego", argv=summarize_argv(query)) as span:
+        output = get_backend().run(query)
+        span["bytes"] = len(output)
+    count("fuego calls")
+    count("bytes received", len(output))
+    return output
+
+
+def run_fuego(query: List[str]) -> bytes:
+    """Run a fuego command and return its raw output.
+
+    Every fuego call made by roarquery goes through this function. The command
+    is executed by the active backend (see ``roarquery.backends.get_backend``),
+    which defaults to the fuego binary. If a response cache is active (see
+    ``roarquery.cache.set_response_cache``), a fresh cached response is returned
+    instead, and new responses are stored in the cache. If a retry policy is
+    active (see ``roarquery.retry.set_retry_policy``), failed calls are retried
+    with exponential backoff.
+
+    Parameters
+    ----------
+    query : List[str]
+        The fuego argv, starting with "fuego".
+
+    Returns
+    -------
+    bytes
+        The output of the fuego command.
+    """
+    cache = get_response_cache()
+    if cache is not None:
+        output = cache.get(query)
+        if output is not None:
+            count("cached responses")
+            return output
+
+    policy = get_retry_policy()
+    if policy is None:
+        output = _run_backend(query)
+    else:
+        output = policy.call(lambda: _run_backend(query))
+
+    if cache is not None:
+        cache.set(query, output)
+
+    return output
+
+
+class PageSizer:
+    """Adapt the page size of a paginated query to the observed pages.
+
+    The page size doubles after a full page that arrived quickly and was
+    small, up to ``max_page_size``, and halves after a page that was slow or
+    large, down to ``min_page_size``. Big scans therefore settle on large pages
+    and few round-trips, while pages stay small enough to keep each request
+    responsive.
+
+    Parameters
+    ----------
+    page_size : int, optional, default=100
+        The size of the first page.
 
+    max_page_size : int, optional, default=None
+        The largest page size. If None, the page size never changes.
 
-def page_results(query: List[str], limit: Optional[int] = None) -> List[_FuegoResponse]:
+    min_page_size : int, optional, default=10
+        The smallest page size.
+
+    target_seconds : float, optional, default=2.0
+        Pages slower than this shrink the page size. Pages faster than half of
+        this may grow it.
+
+    target_bytes : int, optional, default=8 * 2**20
+        Pages larger than this shrink the page size. Pages smaller than half of
+        this may grow it.
+    """
+
+    def __init__(
+        self,
+        page_size: int = 100,
+        max_page_size: Optional[int] = None,
+        min_page_size: int = 10,
+        target_seconds: float = 2.0,
+        target_bytes: int = 8 * 2**20,
+    ) -> None:
+        """Initialize the page sizer."""
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.min_page_size = min(min_page_size, page_size)
+        self.target_seconds = target_seconds
+        self.target_bytes = target_bytes
+
+    def update(self, n_docs: int, seconds: float, n_bytes: int) -> int:
+        """Record a page and return the size of the next one.
+
+        Parameters
+        ----------
+        n_docs : int
+            The number of documents in the page.
+
+        seconds : float
+            The time it took to fetch the page.
+
+        n_bytes : int
+            The size of the raw page.
+
+        Returns
+        -------
+        int
+            The next page size. Without a ``max_page_size`` this is always the
+            size of the first page.
+        """
+        if self.max_page_size is None:
+            return self.page_size
+
+        if seconds > self.target_seconds or n_bytes > self.target_bytes:
+            self.page_size = max(self.page_size // 2, self.min_page_size)
+        elif (
+            n_docs >= self.page_size
+            and seconds < self.target_seconds / 2
+            and n_bytes < self.target_bytes / 2
+        ):
+            self.page_size = min(self.page_size * 2, self.max_page_size)
+
+        return self.page_size
+
+
+def get_page_size() -> Tuple[int, Optional[int]]:
+    """Return the default page size and maximum page size of queries.
+
+    Returns
+    -------
+    Tuple[int, Optional[int]]
+        The initial page size and the maximum page size. A maximum of None
+        means that the page size is fixed.
+    """
+    return _PAGE_SIZE, _MAX_PAGE_SIZE
+
+
+def set_page_size(page_size: int = 100, max_page_size: Optional[int] = None) -> None:
+    """Set the default page size and maximum page size of queries.
+
+    Parameters
+    ----------
+    page_size : int, optional, default=100
+        The size of the first page of each query.
+
+    max_page_size : int, optional, default=None
+        The largest page size that adaptive paging may grow to. If None, the
+        page size is fixed.
+    """
+    global _PAGE_SIZE, _MAX_PAGE_SIZE
+    _PAGE_SIZE = page_size
+    _MAX_PAGE_SIZE = max_page_size
+
+
+@contextmanager
+def use_page_size(
+    page_size: int = 100, max_page_size: Optional[int] = None
+) -> Iterator[None]:
+    """Temporarily set the default page size and maximum page size of queries.
+
+    Parameters
+    ----------
+    page_size : int, optional, default=100
+        The size of the first page of each query.
+
+    max_page_size : int, optional, default=None
+        The largest page size that adaptive paging may grow to.
+
+    Yields
+    ------
+    None
+    """
+    previous = get_page_size()
+    set_page_size(page_size, max_page_size)
+    try:
+        yield
+    finally:
+        set_page_size(*previous)
+
+
+def iter_pages(
+    query: List[str], limit: Optional[int] = None, max_limit: Optional[int] = None
+) -> Iterator[List[_FuegoResponse]]:
+    """Page through results from a query, yielding each page as it arrives.
+
+    Only one page is held in memory at a time, so callers that consume the
+    pages incrementally use memory proportional to the page size rather than
+    to the size of the whole result. If ``max_limit`` is larger than ``limit``,
+    the page size adapts to the latency and size of each page (see
+    ``PageSizer``). If a checkpoint is active (see
+    ``roarquery.checkpoint.set_checkpoint``), each page is saved in it, and the
+    pages saved by an interrupted run are replayed before fetching the rest.
+
+    Parameters
+    ----------
+    query : List[str]
+        The query to run. This is a list of strings that will be passed to
+        fuego. It is not modified.
+
+    limit : int, optional, default=100
+        The number of results to return in the first page. Defaults to the
+        value set with ``set_page_size``.
+
+    max_limit : int, optional, default=None
+        The largest number of results to return per page. Defaults to the
+        value set with ``set_page_size``, which is None (a fixed page size)
+        unless changed.
+
+    Yields
+    ------
+    List[_FuegoResponse]
+        The documents in each page of results.
+    """
+    pager = _Pager(query, limit, max_limit)
+    yield from pager.replay()
+    while not pager.done:
+        start = time.perf_counter()
+        with pager.fetching() as span:
+            output = run_fuego(pager.query)
+            page = bytes2json(output)
+            span["documents"] = len(page)
+        pager.record(page, time.perf_counter() - start, len(output))
+        if page:
+            yield page
+
+
+class _Pager:
+    """The state of a paginated query, shared by the sync and async pagers.
+
+    It adds ``--limit`` and ``--startafter`` to the query, adapts the page
+    size with a ``PageSizer`` and saves each page in the active checkpoint.
+    """
+
+    def __init__(
+        self, query: List[str], limit: Optional[int], max_limit: Optional[int]
+    ) -> None:
+        """Prepare the query for its first page."""
+        if limit is None:
+            limit, default_max_limit = get_page_size()
+            max_limit = max_limit if max_limit is not None else default_max_limit
+
+        self.limit = limit
+        self.sizer = PageSizer(limit, max_limit)
+        self.checkpoint = get_checkpoint()
+        self.original_query = query
+        self.query = list(query)
+        self.query_idx = self.query.index("query")
+        self.query.insert(self.query_idx + 1, "--limit")
+        self.query.insert(self.query_idx + 2, str(limit))
+        self.page_number = 0
+        self.done = False
+
+    def replay(self) -> List[List[_FuegoResponse]]:
+        """Return the pages saved in the checkpoint and continue after them."""
+        if self.checkpoint is None:
+            return []
+
+        pages, cursor, self.done = self.checkpoint.load(self.original_query)
+        self.page_number = len(pages)
+        if cursor is not None:
+            self._set_start_after(cursor)
+        return [page for page in pages if page]
+
+    def fetching(self) -> ContextManager[Dict[str, Any]]:
+        """Time the fetch of the next page."""
+        self.page_number += 1
+        return timed("fetch page", page=self.page_number, limit=self.limit)
+
+    def record(self, page: List[_FuegoResponse], seconds: float, n_bytes: int) -> None:
+        """Save a page and prepare the query for the next one."""
+        self.done = len(page) < self.limit
+        cursor = None if self.done else trim_doc_path(page[-1]["Path"])
+        if self.checkpoint is not None:
+            self.checkpoint.save_page(self.original_query, page, cursor, self.done)
+
+        if cursor is not None:
+            self.limit = self.sizer.update(len(page), seconds, n_bytes)
+            self.query[self.query.index("--limit") + 1] = str(self.limit)
+            self._set_start_after(cursor)
+
+    def _set_start_after(self, path: str) -> None:
+        if "--startafter" in self.query:
+            self.query[self.query.index("--startafter") + 1] = path
+        else:
+            self.query.insert(self.query_idx + 1, "--startafter")
+            self.query.insert(self.query_idx + 2, path)
+
+
+def iter_results(
+    query: List[str], limit: Optional[int] = None, max_limit: Optional[int] = None
+) -> Iterator[_FuegoResponse]:
+    """Page through results from a query, yielding one document at a time.
+
+    Parameters
+    ----------
+    query : List[str]
+        The query to run. This is a list of strings that will be passed to
+        fuego. It is not modified.
+
+    limit : int, optional, default=100
+        The number of results to return in the first page.
+
+    max_limit : int, optional, default=None
+        The largest number of results to return per page. See ``iter_pages``.
+
+    Yields
+    ------
+    _FuegoResponse
+        Each document returned by the query.
+    """
+    for page in iter_pages(query, limit=limit, max_limit=max_limit):
+        yield from page
+
+
+def iter_records(
+    query: List[str],
+    drop: Iterable[str] = ("ReadTime",),
+    limit: Optional[int] = None,
+    max_limit: Optional[int] = None,
+) -> Iterator[FuegoRecord]:
+    """Page through results from a query, yielding compact records.
+
+    Like ``iter_results``, but each document is converted to a
+    ``FuegoRecord`` as its page arrives, so that only one page of full dicts
+    is alive at a time.
+
+    Parameters
+    ----------
+    query : List[str]
+        The query to run. This is a list of strings that will be passed to
+        fuego. It is not modified.
+
+    drop : Iterable[str], optional, default=("ReadTime",)
+        The metadata fields to leave out of each record.
+
+    limit : int, optional, default=100
+        The number of results to return in the first page.
+
+    max_limit : int, optional, default=None
+        The largest number of results to return per page. See ``iter_pages``.
+
+    Yields
+    ------
+    FuegoRecord
+        Each document returned by the query.
+    """
+    drop = tuple(drop)
+    for page in iter_pages(query, limit=limit, max_limit=max_limit):
+        for doc in page:
+            yield FuegoRecord.from_json(doc, drop)
+
+
+def page_results(
+    query: List[str], limit: Optional[int] = None, max_limit: Optional[int] = None
+) -> List[_FuegoResponse]:
     """Page through results from a query.
 
     Parameters
     ----------
     query : List[str]
         The query to run. This is a list of strings that will be passed to
-        subprocess.check_output.
+        fuego. It is not modified.
 
     limit : int, optional, default=100
-        The number of results to return per page.
+        The number of results to return in the first page.
+
+    max_limit : int, optional, default=None
+        The largest number of results to return per page. See ``iter_pages``.
 
     Returns
     -------
     List[_FuegoResponse]
         The results of the query.
     """
-    limit = limit if limit is not None else 100
-    query_idx = query.index("query")
-    query.insert(query_idx + 1, "--limit")
-    query.insert(query_idx + 2, str(limit))
+    return list(iter_results(query, limit=limit, max_limit=max_limit))
+
+
+def iter_concurrently(
+    func: Callable[[_A], _R],
+    items: Mapping[_K, _A],
+    max_workers: int = 1,
+    desc: Optional[str] = None,
+) -> Iterator[Tuple[_K, _R]]:
+    """Apply a function to many items using a bounded thread pool.
+
+    Results are yielded in the order of ``items``, regardless of the order in
+    which they complete, so the output is deterministic. At most
+    ``2 * max_workers`` calls are in flight at any time. A failure for one item
+    does not cancel the others; once every item has been attempted, a
+    ``FetchError`` listing all of the failures is raised.
+
+    Threads, rather than processes, are used because the work is dominated by
+    waiting on ``fuego`` subprocesses and the network.
 
-    output = []
-    this_page = subprocess.check_output(query)  # nosec
+    Parameters
+    ----------
+    func : Callable
+        The function to apply to each item's value.
+
+    items : Mapping
+        The items to process. The keys identify each item in the output and in
+        any error report.
+
+    max_workers : int, optional, default=1
+        The maximum number of concurrent calls. If 1, the items are processed
+        sequentially in the calling thread.
+
+    desc : str, optional, default=None
+        If provided, show a progress bar with this description.
 
-    while this_page:
-        output.extend(bytes2json(this_page))
+    Yields
+    ------
+    Tuple[Hashable, Any]
+        The key and result for each item that succeeded.
 
-        if len(bytes2json(this_page)) == limit:
-            if "--startafter" in query:
-                start_after_idx = query.index("--startafter")
-                query[start_after_idx + 1] = trim_doc_path(output[-1]["Path"])
+    Raises
+    ------
+    FetchError
+        If any of the calls raised an exception.
+    """
+    # tqdm is slow to import, so load it only when there is work to show.
+    from tqdm.auto import tqdm
+
+    errors: Dict[Any, Exception] = {}
+    with tqdm(total=len(items), desc=desc, disable=desc is None) as pbar:
+        if max_workers <= 1:
+            calls = _iter_sequential(func, items, pbar)
+        else:
+            calls = _iter_threaded(func, items, max_workers, pbar)
+
+        for key, result, exc in calls:
+            if exc is not None:
+                errors[key] = exc
             else:
-                query.insert(query_idx + 1, "--startafter")
-                query.insert(query_idx + 2, trim_doc_path(output[-1]["Path"]))
+                yield key, cast(_R, result)
+
+    if errors:
+        raise FetchError(errors) from next(iter(errors.values()))
 
-            this_page = subprocess.check_output(query)  # nosec
+
+def _iter_sequential(
+    func: Callable[[_A], _R], items: Mapping[_K, _A], pbar: Any
+) -> Iterator[Tuple[_K, Optional[_R], Optional[Exception]]]:
+    """Call ``func`` on each item in turn, capturing any exception raised."""
+    for key, arg in items.items():
+        try:
+            result = func(arg)
+        except Exception as exc:
+            yield key, None, exc
         else:
-            this_page = b""
+            yield key, result, None
+        finally:
+            pbar.update()
+
+
+def _iter_threaded(
+    func: Callable[[_A], _R], items: Mapping[_K, _A], max_workers: int, pbar: Any
+) -> Iterator[Tuple[_K, Optional[_R], Optional[Exception]]]:
+    """Call ``func`` on each item in a thread pool, yielding in input order."""
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        pending: Deque[Tuple[_K, "Future[_R]"]] = deque()
+
+        def submit(key: _K, arg: _A) -> None:
+            future = executor.submit(func, arg)
+            future.add_done_callback(lambda _: pbar.update())
+            pending.append((key, future))
+
+        remaining = iter(items.items())
+        for key, arg in islice(remaining, 2 * max_workers):
+            submit(key, arg)
+
+        while pending:
+            key, future = pending.popleft()
+            for next_key, next_arg in islice(remaining, 1):
+                submit(next_key, next_arg)
+            try:
+                result = future.result()
+            except Exception as exc:
+                yield key, None, exc
+            else:
+                yield key, result, None
 
-    return output
+
+def map_concurrently(
+    func: Callable[[_A], _R],
+    items: Mapping[_K, _A],
+    max_workers: int = 1,
+    desc: Optional[str] = None,
+) -> Dict[_K, _R]:
+    """Apply a function to many items and collect the results in a dict.
+
+    This is a convenience wrapper around ``iter_concurrently``.
+
+    Parameters
+    ----------
+    func : Callable
+        The function to apply to each item's value.
+
+    items : Mapping
+        The items to process.
+
+    max_workers : int, optional, default=1
+        The maximum number of concurrent calls.
+
+    desc : str, optional, default=None
+        If provided, show a progress bar with this description.
+
+    Returns
+    -------
+    Dict[Hashable, Any]
+        The result for each item, in the order of ``items``.
+
+    Raises
+    ------
+    FetchError
+        If any of the calls raised an exception. The results of the successful
+        calls are available in the ``results`` attribute of the error.
+
+    Examples
+    --------
+    >>> map_concurrently(len, {"a": "x", "b": "yy"}, max_workers=2)
+    {'a': 1, 'b': 2}
+    """
+    results: Dict[_K, _R] = {}
+    try:
+        for key, result in iter_concurrently(func, items, max_workers, desc):
+            results[key] = result
+    except FetchError as exc:
+        exc.results = results
+        raise
+
+    return results
 
 
 def drop_empty(iterable: List[Any]) -> List[Any]:
@@ -0,0 +1,543 @@
+"""Write runs and trials to disk in chunks."""
+import csv
+import json
+import os
+import shutil
+import tempfile
+import uuid
+from abc import ABC
+from abc import abstractmethod
+from types import TracebackType
+from typing import Any
+from typing import Dict
+from typing import IO
+from typing import List
+from typing import Optional
+from typing import Set
+from typing import Type
+from typing import TYPE_CHECKING
+
+from .metrics import timed
+
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+FORMATS = ("csv", "parquet", "feather")
+EXTENSIONS = {
+    ".csv": "csv",
+    ".parquet": "parquet",
+    ".pq": "parquet",
+    ".feather": "feather",
+    ".arrow": "feather",
+}
+
+
+class ChunkWriter(ABC):
+    """Base class for writers that append DataFrame chunks to one file.
+
+    Chunks may have different columns. The writer keeps a stable union of the
+    columns seen so far, in the order in which they first appeared, and every
+    chunk is written with that union so that memory use is bounded by the
+    chunk size rather than by the size of the export.
+
+    The chunks are written to a hidden temporary file next to ``path``, which
+    replaces ``path`` only when the writer is closed. If the ``with`` block
+    of the writer raises, or ``abort`` is called, the temporary file is
+    removed instead, so a failed export never leaves a file that looks
+    complete.
+
+    Parameters
+    ----------
+    path : str
+        The output file.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Initialize the writer."""
+        self.path = path
+        self.columns: List[str] = []
+        self.rows_written = 0
+        self._column_set: Set[str] = set()
+        self._tmp_path = os.path.join(
+            os.path.dirname(os.path.abspath(path)),
+            f".{os.path.basename(path)}.{uuid.uuid4().hex[:8]}.tmp",
+        )
+
+    def _add_columns(self, df: "pd.DataFrame") -> None:
+        for column in df.columns:
+            if column not in self._column_set:
+                self._column_set.add(column)
+                self.columns.append(column)
+
+    def write(self, df: "pd.DataFrame") -> None:
+        """Append a chunk of rows.
+
+        Parameters
+        ----------
+        df : pd.DataFrame
+            The rows to append. The index is written as the first column.
+        """
+        with timed("write"):
+            self._add_columns(df)
+            self._write(df.reindex(columns=self.columns))
+        self.rows_written += len(df)
+
+    @abstractmethod
+    def _write(self, df: "pd.DataFrame") -> None:
+        """Write a chunk with the current columns to the temporary file."""
+
+    @abstractmethod
+    def _finish(self) -> None:
+        """Finish writing the temporary file."""
+
+    def _discard(self) -> None:
+        """Release the resources of an unfinished file."""
+
+    def close(self) -> None:
+        """Finish writing the file and move it into place."""
+        try:
+            self._finish()
+        except BaseException:
+            self.abort()
+            raise
+        os.replace(self._tmp_path, self.path)
+
+    def abort(self) -> None:
+        """Discard everything written so far, leaving ``path`` untouched."""
+        self._discard()
+        if os.path.exists(self._tmp_path):
+            os.unlink(self._tmp_path)
+
+    def __enter__(self) -> "ChunkWriter":
+        """Return the writer."""
+        return self
+
+    def __exit__(
+        self,
+        exc_type: Optional[Type[BaseException]],
+        exc_value: Optional[BaseException],
+        traceback: Optional[TracebackType],
+    ) -> None:
+        """Close the writer, or abort it if an error occurred while writing."""
+        with timed("write"):
+            if exc_type is None:
+                self.close()
+            else:
+                self.abort()
+
+
+class CsvWriter(ChunkWriter):
+    """Append DataFrame chunks to a CSV file.
+
+    Columns that first appear after the header has been written are appended
+    to the end of each later row. When the writer is closed, the header is
+    reconciled: if new columns appeared, the file is rewritten once, line by
+    line, with the full header and the earlier rows padded with empty values.
+
+    Parameters
+    ----------
+    path : str
+        The output CSV file.
+    """
+
+    def __init__(self, path: str) -> None:
+        """Initialize the writer."""
+        super().__init__(path)
+        self._fp: Optional[IO[str]] = None
+        self._header: List[str] = []
+
+    def _write(self, df: "pd.DataFrame") -> None:
+        if self._fp is None:
+            self._fp = open(self._tmp_path, "w", newline="")
+            self._header = [df.index.name or ""] + list(df.columns)
+            df.to_csv(self._fp, index=True)
+        else:
+            df.to_csv(self._fp, index=True, header=False)
+
+    def _finish(self) -> None:
+        """Close the file, rewriting the header if new columns appeared."""
+        if self._fp is None:
+            # Nothing was written, but still leave a valid (empty) file behind.
+            open(self._tmp_path, "w").close()
+            return
+
+        self._fp.close()
+        self._fp = None
+
+        header = self._header[:1] + self.columns
+        if header != self._header:
+            self._reconcile_header(header)
+
+    def _discard(self) -> None:
+        if self._fp is not None:
+            self._fp.close()
+            self._fp = None
+
+    def _reconcile_header(self, header: List[str]) -> None:
+        out_dir = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=out_dir, suffix=".tmp")
+        try:
+            with open(self._tmp_path, newline="") as src, os.fdopen(
+                fd, "w", newline=""
+            ) as dst:
+                reader = csv.reader(src)
+                writer = csv.writer(dst)
+                next(reader)
+                writer.writerow(header)
+                for row in reader:
+                    writer.writerow(row + [""] * (len(header) - len(row)))
+            os.replace(tmp_path, self._tmp_path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+
+def _import_pyarrow() -> Any:
+    """Import pyarrow, which is needed for the columnar formats."""
+    try:
+        import pyarrow
+        import pyarrow.compute  # noqa: F401
+        import pyarrow.ipc  # noqa: F401
+        import pyarrow.parquet  # noqa: F401
+    except ImportError as exc:  # pragma: no cover
+        raise ImportError(
+            "Writing Parquet or Feather files requires pyarrow. Install it with "
+            "`pip install roarquery[parquet]`."
+        ) from exc
+    return pyarrow
+
+
+def _to_arrow(df: "pd.DataFrame") -> Any:
+    """Convert a chunk to an Arrow table with export-friendly types."""
+    import pandas as pd
+
+    from .dtypes import preserve_dtypes
+
+    pa = _import_pyarrow()
+    df = preserve_dtypes(df)
+    arrays = []
+    for column in df.columns:
+        values = df[column]
+        if values.isna().all():
+            arrays.append(pa.nulls(len(values)))
+        elif isinstance(values.dtype, pd.CategoricalDtype):
+            arrays.append(
+                pa.array(
+                    values.astype(str).where(values.notna(), None)
+                ).dictionary_encode()
+            )
+        else:
+            try:
+                arrays.append(pa.array(values, from_pandas=True))
+            except (pa.ArrowInvalid, pa.ArrowTypeError):
+                # Mixed types (e.g. str and dict) are stored as JSON strings.
+                arrays.append(
+                    pa.array(
+                        values.map(
+                            lambda value: value
+                            if value is None or isinstance(value, str)
+                            else json.dumps(value, default=str)
+                        ),
+                        from_pandas=True,
+                    )
+                )
+
+    return pa.Table.from_arrays(arrays, names=[str(column) for column in df.columns])
+
+
+def _unify_types(types: List[Any]) -> Any:
+    """Return one Arrow type that can hold values of all of ``types``."""
+    pa = _import_pyarrow()
+    types = [type_ for type_ in types if not pa.types.is_null(type_)]
+    if not types:
+        return pa.null()
+    if any(pa.types.is_dictionary(type_) for type_ in types):
+        return pa.dictionary(pa.int32(), pa.string())
+    try:
+        schemas = [pa.schema([("field", type_)]) for type_ in types]
+        return pa.unify_schemas(schemas, promote_options="permissive").field(0).type
+    except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+        return pa.string()
+
+
+class ArrowWriter(ChunkWriter):
+    """Base class for writers of columnar (Arrow-based) formats.
+
+    Chunks are buffered until ``row_group_size`` rows are available and then
+    spilled to a temporary Arrow part file next to the output. On close, the
+    part schemas are unified (columns that appear late are filled with nulls,
+    and categorical columns share one dictionary) and the parts are copied,
+    one row group at a time, into the final file.
+
+    The index is written as the first column.
+
+    Parameters
+    ----------
+    path : str
+        The output file.
+
+    row_group_size : int, optional, default=100000
+        The number of rows in each row group (or record batch).
+    """
+
+    def __init__(self, path: str, row_group_size: int = 100_000) -> None:
+        """Initialize the writer."""
+        super().__init__(path)
+        _import_pyarrow()
+        self.row_group_size = row_group_size
+        self._buffer: List["pd.DataFrame"] = []
+        self._buffered_rows = 0
+        self._parts_dir = tempfile.mkdtemp(
+            dir=os.path.dirname(os.path.abspath(path)),
+            prefix=f".{os.path.basename(path)}.",
+        )
+        self._parts: List[str] = []
+
+    def _write(self, df: "pd.DataFrame") -> None:
+        self._buffer.append(df.reset_index())
+        self._buffered_rows += len(df)
+        if self._buffered_rows >= self.row_group_size:
+            self._flush()
+
+    def _flush(self) -> None:
+        if not self._buffer:
+            return
+
+        import pandas as pd
+
+        pa = _import_pyarrow()
+        table = _to_arrow(pd.concat(self._buffer, ignore_index=True))
+        self._buffer = []
+        self._buffered_rows = 0
+
+        part = os.path.join(self._parts_dir, f"{len(self._parts):06d}.arrow")
+        with pa.ipc.new_file(part, table.schema) as part_writer:
+            part_writer.write_table(table)
+        self._parts.append(part)
+
+    def _read_part(self, part: str) -> Any:
+        pa = _import_pyarrow()
+        with pa.memory_map(part) as source:
+            return pa.ipc.open_file(source).read_all()
+
+    def _unified_schema(self) -> Any:
+        pa = _import_pyarrow()
+        types: Dict[str, List[Any]] = {}
+        for part in self._parts:
+            with pa.memory_map(part) as source:
+                for field in pa.ipc.open_file(source).schema:
+                    types.setdefault(field.name, []).append(field.type)
+
+        return pa.schema(
+            [(name, _unify_types(field_types)) for name, field_types in types.items()]
+        )
+
+    def _dictionaries(self, schema: Any) -> Dict[str, Any]:
+        """Return one shared dictionary for each categorical column."""
+        pa = _import_pyarrow()
+        names = [field.name for field in schema if pa.types.is_dictionary(field.type)]
+        values: Dict[str, Dict[str, None]] = {name: {} for name in names}
+        for part in self._parts:
+            table = self._read_part(part)
+            for name in names:
+                if name in table.column_names:
+                    strings = table[name].cast(pa.string()).drop_null()
+                    values[name].update(dict.fromkeys(strings.to_pylist()))
+
+        return {
+            name: pa.array(list(value), pa.string()) for name, value in values.items()
+        }
+
+    def _conform(self, table: Any, schema: Any, dictionaries: Dict[str, Any]) -> Any:
+        pa = _import_pyarrow()
+        arrays = []
+        for field in schema:
+            if field.name in table.column_names:
+                column = table[field.name].combine_chunks()
+            else:
+                column = pa.nulls(len(table))
+
+            if field.name in dictionaries:
+                dictionary = dictionaries[field.name]
+                indices = pa.compute.index_in(
+                    column.cast(pa.string()), value_set=dictionary
+                )
+                column = pa.DictionaryArray.from_arrays(indices, dictionary)
+            elif column.type != field.type:
+                column = column.cast(field.type)
+
+            arrays.append(column)
+
+        return pa.Table.from_arrays(arrays, schema=schema)
+
+    @abstractmethod
+    def _open(self, schema: Any) -> Any:
+        """Open a writer of the output format for the temporary file."""
+
+    def _discard(self) -> None:
+        self._buffer = []
+        shutil.rmtree(self._parts_dir, ignore_errors=True)
+
+    def _finish(self) -> None:
+        """Assemble the part files into the output file."""
+        try:
+            self._flush()
+            if not self._parts:
+                self._parts.append(os.path.join(self._parts_dir, "empty.arrow"))
+                pa = _import_pyarrow()
+                with pa.ipc.new_file(self._parts[0], pa.schema([])):
+                    pass
+
+            schema = self._unified_schema()
+            dictionaries = self._dictionaries(schema)
+            with self._open(schema) as writer:
+                for part in self._parts:
+                    table = self._conform(self._read_part(part), schema, dictionaries)
+                    writer.write_table(table, **self._write_kwargs())
+        finally:
+            shutil.rmtree(self._parts_dir, ignore_errors=True)
+
+    def _write_kwargs(self) -> Dict[str, Any]:
+        return {}
+
+
+class ParquetWriter(ArrowWriter):
+    """Write DataFrame chunks to a Parquet file, one row group at a time.
+
+    Parameters
+    ----------
+    path : str
+        The output Parquet file.
+
+    row_group_size : int, optional, default=100000
+        The number of rows in each row group.
+    """
+
+    def _open(self, schema: Any) -> Any:
+        pa = _import_pyarrow()
+        return pa.parquet.ParquetWriter(self._tmp_path, schema)
+
+    def _write_kwargs(self) -> Dict[str, Any]:
+        return {"row_group_size": self.row_group_size}
+
+
+class FeatherWriter(ArrowWriter):
+    """Write DataFrame chunks to a Feather (Arrow IPC) file.
+
+    Parameters
+    ----------
+    path : str
+        The output Feather file.
+
+    row_group_size : int, optional, default=100000
+        The number of rows in each record batch.
+    """
+
+    def _open(self, schema: Any) -> Any:
+        pa = _import_pyarrow()
+        compression = "lz4" if pa.Codec.is_available("lz4_frame") else None
+        options = pa.ipc.IpcWriteOptions(compression=compression)
+        return pa.ipc.new_file(self._tmp_path, schema, options=options)
+
+    def _write_kwargs(self) -> Dict[str, Any]:
+        return {"max_chunksize": self.row_group_size}
+
+
+def infer_format(path: str, output_format: Optional[str] = None) -> str:
+    """Return the output format for a file.
+
+    Parameters
+    ----------
+    path : str
+        The output file.
+
+    output_format : str, optional, default=None
+        The requested format. If None, the format is inferred from the file
+        extension, defaulting to "csv".
+
+    Returns
+    -------
+    str
+        One of "csv", "parquet" or "feather".
+
+    Raises
+    ------
+    ValueError
+        If ``output_format`` is not a supported format.
+
+    Examples
+    --------
+    >>> infer_format("trials.parquet")
+    'parquet'
+
+    >>> infer_format("trials.txt")
+    'csv'
+    """
+    if output_format is None:
+        extension = os.path.splitext(path)[1].lower()
+        return EXTENSIONS.get(extension, "csv")
+
+    if output_format not in FORMATS:
+        raise ValueError(f"output_format must be one of {FORMATS}")
+
+    return output_format
+
+
+def open_writer(
+    path: str, output_format: Optional[str] = None, row_group_size: int = 100_000
+) -> ChunkWriter:
+    """Open a chunk writer for the requested output format.
+
+    Parameters
+    ----------
+    path : str
+        The output file.
+
+    output_format : str, optional, default=None
+        One of "csv", "parquet" or "feather". If None, the format is inferred
+        from the file extension.
+
+    row_group_size : int, optional, default=100000
+        The number of rows per row group for the columnar formats.
+
+    Returns
+    -------
+    ChunkWriter
+        The writer. Use it as a context manager so that it is closed.
+    """
+    output_format = infer_format(path, output_format)
+    if output_format == "parquet":
+        return ParquetWriter(path, row_group_size=row_group_size)
+    if output_format == "feather":
+        return FeatherWriter(path, row_group_size=row_group_size)
+    return CsvWriter(path)
+
+
+def read_export(path: str, output_format: Optional[str] = None) -> "pd.DataFrame":
+    """Read a file written by one of the writers in this module.
+
+    Parameters
+    ----------
+    path : str
+        The exported file.
+
+    output_format : str, optional, default=None
+        One of "csv", "parquet" or "feather". If None, the format is inferred
+        from the file extension.
+
+    Returns
+    -------
+    pd.DataFrame
+        The export, indexed by its first column.
+    """
+    import pandas as pd
+
+    output_format = infer_format(path, output_format)
+    if output_format == "csv":
+        return pd.read_csv(path, index_col=0)
+    if output_format == "parquet":
+        df = pd.read_parquet(path)
+    else:
+        df = pd.read_feather(path)
+    return df.set_index(df.columns[0])
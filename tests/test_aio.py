@@ -0,0 +1,134 @@
+"""Test cases for the aio module."""
+import asyncio
+import json
+import os
+import subprocess  # nosec
+import sys
+import threading
+import time
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
+
+import pytest
+
+from .mock_bytes import TRIALS_1_BYTES
+from roarquery.aio import AsyncRunner
+from roarquery.aio import exec_fuego
+from roarquery.aio import gather_tasks
+from roarquery.backends import Backend
+from roarquery.backends import FuegoBackend
+from roarquery.backends import LocalBackend
+from roarquery.backends import use_backend
+from roarquery.metrics import Metrics
+from roarquery.metrics import use_metrics
+from roarquery.retry import RetryPolicy
+from roarquery.retry import use_retry_policy
+from roarquery.users import UserResolver
+from roarquery.utils import bytes2json
+from roarquery.utils import FetchError
+from roarquery.utils import page_results
+
+
+TRIALS_QUERY = ["fuego", "query", "prod/roar-prod/users/aa-0001/runs/run-1/trials"]
+
+
+class SlowBackend(Backend):
+    """A backend that records how many calls overlap, and fails on request."""
+
+    def __init__(self, failures: int = 0) -> None:
+        """Fail the first ``failures`` calls."""
+        self.failures = failures
+        self.running = 0
+        self.max_running = 0
+        self._lock = threading.Lock()
+
+    def run(self, query: List[str]) -> bytes:
+        """Return the query after a short wait."""
+        with self._lock:
+            self.running += 1
+            self.max_running = max(self.max_running, self.running)
+            self.failures -= 1
+            fail = self.failures >= 0
+        time.sleep(0.02)
+        with self._lock:
+            self.running -= 1
+        if fail or query[-1] == "fail":
+            raise subprocess.CalledProcessError(1, query)
+        doc = {"ID": query[-1], "Data": {}, "CreateTime": "2024-01-01T00:00:00Z"}
+        return json.dumps(doc).encode("utf-8")
+
+
+def test_exec_fuego() -> None:
+    """It returns the output of a subprocess and raises on failure."""
+    code = "import sys; sys.stdout.write('ok'); sys.exit(int(sys.argv[1]))"
+    assert asyncio.run(exec_fuego([sys.executable, "-c", code, "0"])) == b"ok"
+    with pytest.raises(subprocess.CalledProcessError) as excinfo:
+        asyncio.run(exec_fuego([sys.executable, "-c", code, "3"]))
+    assert excinfo.value.returncode == 3
+    assert excinfo.value.output == b"ok"
+
+
+def test_async_runner_concurrency() -> None:
+    """It bounds the calls in flight and collects every failure."""
+    backend = SlowBackend()
+    runner = AsyncRunner(max_concurrency=2)
+    users = {f"users/u{idx}": f"users/u{idx}" for idx in range(6)}
+    users["users/bad"] = "users/fail"
+
+    async def fetch() -> Dict[str, Any]:
+        return await gather_tasks(runner.start(runner.fetch_user, users))
+
+    with use_backend(backend), pytest.raises(FetchError) as excinfo:
+        asyncio.run(fetch())
+
+    assert backend.max_running == 2
+    assert list(excinfo.value.errors) == ["users/bad"]
+    assert len(excinfo.value.results) == 6
+    assert excinfo.value.results["users/u5"]["ID"] == "u5"
+
+
+def test_async_runner_retries_and_users() -> None:
+    """It retries failed calls and fetches each uncached user once."""
+    backend = SlowBackend(failures=1)
+    resolver = UserResolver()
+    metrics = Metrics()
+    run_paths = ["users/aa/runs/r1", "users/aa/runs/r2", "users/bb/runs/r3"]
+
+    policy = RetryPolicy(base_delay=0)
+    with use_backend(backend), use_retry_policy(policy), use_metrics(metrics):
+        users = asyncio.run(AsyncRunner().get_users_from_runs(resolver, run_paths))
+
+    assert [user["runId"] for user in users] == ["r1", "r2", "r3"]
+    assert (resolver.hits, resolver.misses) == (1, 2)
+    assert metrics.counters["fuego retries"] == 1
+    assert metrics.counters["fuego calls"] == 2
+
+
+def test_async_runner_pages(tmp_path: Path, monkeypatch: pytest.MonkeyPatch) -> None:
+    """It pages through results like page_results, with any backend."""
+    backend = LocalBackend()
+    for doc in bytes2json(TRIALS_1_BYTES):
+        backend.add_document(doc["Path"], doc["Data"], doc["CreateTime"])
+
+    async def pages() -> List[List[Any]]:
+        return [page async for page in AsyncRunner().iter_pages(TRIALS_QUERY, 4)]
+
+    with use_backend(backend):
+        expected = page_results(TRIALS_QUERY)
+        assert [len(page) for page in asyncio.run(pages())] == [4, 2]
+        records = asyncio.run(AsyncRunner().page_records(TRIALS_QUERY))
+    assert [record["ID"] for record in records] == [doc["ID"] for doc in expected]
+
+    if sys.platform == "win32":
+        return
+
+    # The fuego binary runs in subprocesses, here served by the fake fuego.
+    backend.save(str(tmp_path / "db"))
+    shim = Path(__file__).parents[1] / "benchmarks" / "bin"
+    monkeypatch.setenv("PATH", f"{shim}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("PYTHON", sys.executable)
+    monkeypatch.setenv("FAKE_FUEGO_ROOT", str(tmp_path / "db"))
+    with use_backend(FuegoBackend()):
+        assert [len(page) for page in asyncio.run(pages())] == [4, 2]
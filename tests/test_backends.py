@@ -0,0 +1,304 @@
+"""Test cases for the backends module."""
+import json
+import os
+from datetime import date
+from datetime import datetime
+from datetime import timezone
+from pathlib import Path
+from typing import List
+from unittest.mock import Mock
+from unittest.mock import patch
+
+import pytest
+
+from .mock_bytes import RUNS
+from .mock_bytes import RUNS_BYTES
+from .mock_bytes import TRIALS_1_BYTES
+from .mock_bytes import TRIALS_4_BYTES
+from roarquery.backends import Backend
+from roarquery.backends import BackendError
+from roarquery.backends import FirestoreBackend
+from roarquery.backends import FuegoBackend
+from roarquery.backends import FuegoCommand
+from roarquery.backends import get_backend
+from roarquery.backends import LocalBackend
+from roarquery.backends import make_backend
+from roarquery.backends import to_json
+from roarquery.backends import TransientBackendError
+from roarquery.backends import use_backend
+from roarquery.collections import get_collections
+from roarquery.runs import date_conditions
+from roarquery.runs import get_runs_compat
+from roarquery.utils import bytes2json
+from roarquery.utils import page_results
+
+
+def _fake_fuego(query: List[str]) -> bytes:
+    """Return canned fuego output based on the queried path."""
+    if "prod/roar-prod/users/aa-0001/runs/run-1/trials" in query:
+        return TRIALS_1_BYTES
+    if "prod/roar-prod/users/bb-0001/runs/run-4/trials" in query:
+        return TRIALS_4_BYTES
+    return RUNS_BYTES
+
+
+@pytest.fixture
+def local_backend(tmp_path: Path) -> LocalBackend:
+    """A local backend holding the mock runs and trials, saved to disk."""
+    backend = LocalBackend()
+    for doc in [
+        *RUNS,
+        *bytes2json(TRIALS_1_BYTES),
+        *bytes2json(TRIALS_4_BYTES),
+    ]:
+        backend.add_document(
+            doc["Path"], doc["Data"], doc["CreateTime"], doc["UpdateTime"]
+        )
+    backend.add_document("prod/roar-prod/users/aa-0001", {"name": "aa-0001"})
+
+    backend.save(str(tmp_path / "db"))
+    return LocalBackend(str(tmp_path / "db"))
+
+
+def test_fuego_command() -> None:
+    """It parses the fuego argv built by roarquery."""
+    command = FuegoCommand(
+        [
+            "fuego",
+            "query",
+            "--startafter",
+            "users/a/runs/r",
+            "--limit",
+            "100",
+            "--select",
+            "taskId",
+            "-g",
+            "runs",
+            'taskId == "swr"',
+            "timeStarted >= 2024-01-01T08:00:00Z",
+            'assigningOrgs.schools <array-contains> "s1"',
+        ]
+    )
+    assert (command.command, command.path, command.group) == ("query", "runs", True)
+    assert (command.limit, command.start_after) == (100, "users/a/runs/r")
+    assert command.selects == ["taskId"]
+    assert command.conditions == [
+        ("taskId", "==", "swr"),
+        ("timeStarted", ">=", datetime(2024, 1, 1, 8, tzinfo=timezone.utc)),
+        ("assigningOrgs.schools", "<array-contains>", "s1"),
+    ]
+
+    assert FuegoCommand(["fuego", "get", "users", "aa"]).path == "users/aa"
+    with pytest.raises(BackendError):
+        FuegoCommand(["fuego", "set", "users/aa", "{}"])
+    with pytest.raises(BackendError):
+        FuegoCommand(["fuego", "query", "runs", "taskId is swr"])
+    with pytest.raises(BackendError):
+        FuegoCommand(["fuego", "query"])
+
+
+def test_to_json() -> None:
+    """It converts Firestore values into fuego's JSON."""
+    reference = Mock(path="users/aa", parent="users", spec=["path", "parent"])
+    geopoint = Mock(latitude=1.0, longitude=2.0, spec=["latitude", "longitude"])
+    assert to_json(
+        {
+            "t": [datetime(2024, 1, 1, tzinfo=timezone.utc)],
+            "b": b"\x00",
+            "ref": reference,
+            "geo": geopoint,
+            "n": 1,
+        }
+    ) == {
+        "t": ["2024-01-01T00:00:00Z"],
+        "b": "AA==",
+        "ref": "users/aa",
+        "geo": {"Latitude": 1.0, "Longitude": 2.0},
+        "n": 1,
+    }
+
+
+def test_local_backend_query(local_backend: LocalBackend) -> None:
+    """It answers paginated, filtered fuego queries from local documents."""
+    with use_backend(local_backend):
+        runs = page_results(
+            [
+                "fuego",
+                "query",
+                "--select",
+                "name",
+                "-g",
+                "runs",
+                'classId == "class-1"',
+            ],
+            limit=2,
+        )
+        assert [run["ID"] for run in runs] == ["run-1", "run-4"]
+        assert runs[0]["Data"] == {"name": "run-1"}
+        assert set(runs[0]) == {
+            "CreateTime",
+            "Data",
+            "ID",
+            "Path",
+            "ReadTime",
+            "UpdateTime",
+        }
+
+        runs = page_results(
+            ["fuego", "query", "-g", "runs"]
+            + date_conditions(started_after=datetime(2020, 2, 15, tzinfo=timezone.utc)),
+            limit=1,
+        )
+        assert [run["ID"] for run in runs] == ["run-3", "run-6"]
+
+        trials = page_results(
+            ["fuego", "query", "prod/roar-prod/users/aa-0001/runs/run-1/trials"]
+        )
+        assert len(trials) == 6
+
+        user = json.loads(
+            local_backend.run(["fuego", "get", "prod/roar-prod/users", "aa-0001"])
+        )
+        assert user["Data"] == {"name": "aa-0001"}
+        with pytest.raises(BackendError):
+            local_backend.run(["fuego", "get", "prod/roar-prod/users", "zz"])
+
+        assert get_collections() == ["prod"]
+
+        # Documents added after a query are found by the next one.
+        local_backend.add_document(
+            "prod/roar-prod/users/aa-0001/runs/run-1/trials/trial-99", {}
+        )
+        trials = page_results(
+            ["fuego", "query", "prod/roar-prod/users/aa-0001/runs/run-1/trials"]
+        )
+        assert trials[-1]["ID"] == "trial-99"
+
+
+def test_local_backend_get_runs(local_backend: LocalBackend) -> None:
+    """It returns the same runs and trials as the fuego binary."""
+    kwargs = dict(
+        query_kwargs=dict(), return_trials=True, started_before=date(2020, 1, 15)
+    )
+    with patch("subprocess.check_output", side_effect=_fake_fuego):
+        expected = get_runs_compat(**kwargs)  # type: ignore[arg-type]
+
+    with use_backend(local_backend):
+        trials = get_runs_compat(**kwargs)  # type: ignore[arg-type]
+
+    # The local backend honors --select, which the canned output does not.
+    assert "name" not in trials.columns
+    expected = expected.drop(columns="name")
+    assert trials.sort_index().equals(expected.sort_index())
+
+
+@patch("subprocess.check_output", return_value=b"prod\n")
+def test_backend_selection(
+    mock_subproc_check_output: Mock, monkeypatch: pytest.MonkeyPatch, tmp_path: Path
+) -> None:
+    """It picks the backend from the active setting or the environment."""
+    monkeypatch.delenv("ROAR_QUERY_BACKEND", raising=False)
+    assert isinstance(get_backend(), FuegoBackend)
+    assert get_backend() is get_backend()
+    assert get_collections() == ["prod"]
+    mock_subproc_check_output.assert_called_once_with(["fuego", "c"])
+
+    monkeypatch.setenv("ROAR_QUERY_BACKEND", f"local:{tmp_path}")
+    assert isinstance(get_backend(), LocalBackend)
+    assert get_collections() == []
+
+    backend = FuegoBackend()
+    with use_backend(backend):
+        assert get_backend() is backend
+
+    assert isinstance(make_backend("firestore:my-project"), FirestoreBackend)
+    with pytest.raises(ValueError):
+        make_backend("local")
+
+
+def test_firestore_backend(monkeypatch: pytest.MonkeyPatch) -> None:
+    """It translates fuego queries into Firestore queries."""
+    firestore = pytest.importorskip("google.cloud.firestore")
+    credentials = pytest.importorskip("google.auth.credentials")
+
+    client = firestore.Client(
+        project="test", credentials=credentials.AnonymousCredentials()
+    )
+    command = FuegoCommand(
+        [
+            "fuego",
+            "query",
+            "--limit",
+            "10",
+            "--select",
+            "taskId",
+            "-g",
+            "runs",
+            'taskId == "swr"',
+            "timeStarted < 2024-01-01T08:00:00Z",
+            'assigningOrgs.schools <array-contains> "s1"',
+        ]
+    )
+    query = FirestoreBackend().build_query(client, command)
+    proto = query._to_protobuf()
+    assert proto.from_[0].collection_id == "runs"
+    assert proto.from_[0].all_descendants
+    assert proto.limit == 10
+    assert [field.field_path for field in proto.select.fields] == ["taskId"]
+    filters = [f.field_filter for f in proto.where.composite_filter.filters]
+    assert [f.field.field_path for f in filters] == [
+        "taskId",
+        "timeStarted",
+        "assigningOrgs.schools",
+    ]
+
+    snapshot = Mock(
+        create_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        read_time=datetime(2024, 1, 2, tzinfo=timezone.utc),
+        update_time=datetime(2024, 1, 1, tzinfo=timezone.utc),
+        id="run-1",
+    )
+    snapshot.to_dict.return_value = {"taskId": "swr"}
+    snapshot.reference.path = "users/aa/runs/run-1"
+    backend = FirestoreBackend()
+    monkeypatch.setattr(backend, "build_query", Mock())
+    backend.build_query.return_value.stream.return_value = [snapshot]  # type: ignore
+    backend._clients[os.environ.get("GOOGLE_APPLICATION_CREDENTIALS", "")] = Mock()
+    output = json.loads(backend.run(["fuego", "query", "-g", "runs"]))
+    assert output == [
+        {
+            "CreateTime": "2024-01-01T00:00:00Z",
+            "Data": {"taskId": "swr"},
+            "ID": "run-1",
+            "Path": "users/aa/runs/run-1",
+            "ReadTime": "2024-01-02T00:00:00Z",
+            "UpdateTime": "2024-01-01T00:00:00Z",
+        }
+    ]
+
+    exceptions = pytest.importorskip("google.api_core.exceptions")
+    backend.build_query.side_effect = exceptions.ServiceUnavailable("down")  # type: ignore
+    with pytest.raises(TransientBackendError, match="down"):
+        backend.run(["fuego", "query", "-g", "runs"])
+    backend.build_query.side_effect = exceptions.PermissionDenied("no")  # type: ignore
+    with pytest.raises(exceptions.PermissionDenied):
+        backend.run(["fuego", "query", "-g", "runs"])
+
+    backend.close()
+    assert backend._clients == {}
+
+
+def test_backend_requires_run() -> None:
+    """It requires backends to implement run."""
+
+    class IncompleteBackend(Backend):
+        pass
+
+    with pytest.raises(TypeError, match="run"):
+        IncompleteBackend()  # type: ignore[abstract]
+
+
+def test_local_backend_save_requires_root() -> None:
+    """It needs a directory to save to."""
+    with pytest.raises(ValueError):
+        LocalBackend().save()
@@ -0,0 +1,118 @@
+"""Test cases for the cache module."""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+from unittest.mock import Mock
+from unittest.mock import patch
+
+import pytest
+
+from roarquery.cache import get_response_cache
+from roarquery.cache import normalize_query
+from roarquery.cache import ResponseCache
+from roarquery.cache import use_response_cache
+from roarquery.utils import run_fuego
+
+
+QUERY = ["fuego", "query", "--select", "taskId", "-g", "runs", 'taskId == "swr"']
+
+
+def test_normalize_query() -> None:
+    """It sorts selects and collapses whitespace outside of quotes."""
+    assert normalize_query(
+        ["fuego", "query", "--select", "b", "--select", "a", "x  ==  1"]
+    ) == ["fuego", "query", "x == 1", "--select", "a", "--select", "b"]
+
+    # Whitespace within quoted values is significant.
+    assert normalize_query(['x  ==  "a  b"']) == ['x == "a  b"']
+    assert normalize_query(['x == "a  b"']) != normalize_query(['x == "a b"'])
+
+
+def test_key(monkeypatch: pytest.MonkeyPatch, tmp_path: Path) -> None:
+    """It keys on the normalized query and the credentials target."""
+    cache = ResponseCache(str(tmp_path))
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", "current.json")
+    key = cache.key(QUERY)
+    assert key == cache.key([arg.replace(" ", "  ") for arg in QUERY])
+    assert key != cache.key(QUERY + ['completed == "true"'])
+
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", "legacy.json")
+    assert key != cache.key(QUERY)
+
+    credentials = tmp_path / "creds.json"
+    credentials.write_text("{}")
+    monkeypatch.setenv("GOOGLE_APPLICATION_CREDENTIALS", str(credentials))
+    assert cache.key(QUERY) != key
+
+
+def test_get_and_set(tmp_path: Path) -> None:
+    """It round trips responses and honors refresh and the TTL."""
+    cache = ResponseCache(str(tmp_path))
+    assert cache.get(QUERY) is None
+
+    cache.set(QUERY, b"[]")
+    assert cache.get(QUERY) == b"[]"
+    assert not [path for path in tmp_path.rglob("*.tmp")]
+
+    assert ResponseCache(str(tmp_path), refresh=True).get(QUERY) is None
+    assert ResponseCache(str(tmp_path), ttl=0).get(QUERY) is None
+    assert ResponseCache(str(tmp_path), ttl=None).get(QUERY) == b"[]"
+
+    cache.clear()
+    assert cache.get(QUERY) is None
+
+
+def test_prune(tmp_path: Path) -> None:
+    """It evicts the oldest entries once the cache is too large."""
+    cache = ResponseCache(str(tmp_path), max_size=10)
+    queries = [QUERY + [f"n == {idx}"] for idx in range(3)]
+    for idx, query in enumerate(queries):
+        cache.set(query, b"12345")
+        path = cache._path(cache.key(query))
+        os.utime(path, (time.time() - 100 + idx, time.time() - 100 + idx))
+
+    assert cache.get(queries[0]) is None
+    assert cache.get(queries[1]) == b"12345"
+    assert cache.get(queries[2]) == b"12345"
+
+    expiring = ResponseCache(str(tmp_path), ttl=0)
+    expiring.prune()
+    assert not [path for path in tmp_path.rglob("*") if path.is_file()]
+
+
+def test_set_size(tmp_path: Path) -> None:
+    """It tracks the size of the cache across overwrites and threads."""
+    cache = ResponseCache(str(tmp_path), max_size=1000)
+    for _ in range(50):
+        cache.set(QUERY, b"12345")
+    assert cache._size == 5
+
+    queries = [QUERY + [f"n == {idx}"] for idx in range(20)]
+    with ThreadPoolExecutor(max_workers=8) as executor:
+        list(executor.map(lambda query: cache.set(query, b"12345"), queries * 5))
+    assert cache._size == sum(size for _, _, size in cache._entries()) == 105
+
+
+def test_key_includes_limit() -> None:
+    """It keeps pages of different sizes apart."""
+    cache = ResponseCache("unused")
+    page = ["fuego", "query", "--limit", "100", "-g", "runs"]
+    assert cache.key(page) != cache.key(
+        ["fuego", "query", "--limit", "200", "-g", "runs"]
+    )
+
+
+@patch("subprocess.check_output", return_value=b"[]")
+def test_run_fuego_uses_cache(mock_subproc_check_output: Mock, tmp_path: Path) -> None:
+    """It serves repeated fuego calls from the active cache."""
+    assert get_response_cache() is None
+    with use_response_cache(ResponseCache(str(tmp_path))):
+        assert run_fuego(QUERY) == b"[]"
+        assert run_fuego(QUERY) == b"[]"
+
+    assert get_response_cache() is None
+    mock_subproc_check_output.assert_called_once_with(QUERY)
+
+    assert run_fuego(QUERY) == b"[]"
+    assert mock_subproc_check_output.call_count == 2
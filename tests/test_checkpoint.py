@@ -0,0 +1,86 @@
+"""Test cases for the checkpoint module."""
+from pathlib import Path
+from typing import List
+
+import pytest
+
+from .mock_bytes import TRIALS_1
+from roarquery.backends import BackendError
+from roarquery.backends import LocalBackend
+from roarquery.backends import TransientBackendError
+from roarquery.backends import use_backend
+from roarquery.checkpoint import Checkpoint
+from roarquery.checkpoint import get_checkpoint
+from roarquery.checkpoint import query_key
+from roarquery.checkpoint import use_checkpoint
+from roarquery.utils import iter_results
+
+
+QUERY = ["fuego", "query", "prod/roar-prod/users/aa-0001/runs/run-1/trials"]
+
+
+class FailingBackend(LocalBackend):
+    """A local backend that fails after a number of calls."""
+
+    def __init__(self, calls_before_failure: int) -> None:
+        """Hold the mock trials of run-1."""
+        super().__init__()
+        for trial in TRIALS_1:
+            self.add_document(trial["Path"], trial["Data"], trial["CreateTime"])
+        self.calls_before_failure = calls_before_failure
+        self.calls = 0
+
+    def run(self, query: List[str]) -> bytes:
+        """Answer the query, or fail once the calls run out."""
+        self.calls += 1
+        if self.calls > self.calls_before_failure:
+            raise TransientBackendError("rpc error: code = Unavailable")
+        return super().run(query)
+
+
+def _trial_ids(directory: Path, resume: bool, backend: LocalBackend) -> List[str]:
+    with use_checkpoint(Checkpoint(str(directory), resume=resume)):
+        with use_backend(backend):
+            return [trial["ID"] for trial in iter_results(QUERY, limit=2)]
+
+
+def test_checkpoint_resume(tmp_path: Path) -> None:
+    """It replays the saved pages and continues from the saved cursor."""
+    expected = sorted(trial["ID"] for trial in TRIALS_1)
+    assert len(expected) == 6
+
+    with pytest.raises(BackendError):
+        _trial_ids(tmp_path, False, FailingBackend(calls_before_failure=2))
+
+    checkpoint = Checkpoint(str(tmp_path))
+    assert checkpoint.summary() == {"complete": 0, "unfinished": 1}
+
+    backend = FailingBackend(calls_before_failure=100)
+    assert _trial_ids(tmp_path, True, backend) == expected
+    # Only the third page, and the empty page after it, are fetched again.
+    assert backend.calls == 2
+    assert checkpoint.summary() == {"complete": 1, "unfinished": 0}
+
+    backend = FailingBackend(calls_before_failure=0)
+    assert _trial_ids(tmp_path, True, backend) == expected
+    assert backend.calls == 0
+
+    # Without resume, the query starts over.
+    backend = FailingBackend(calls_before_failure=100)
+    assert _trial_ids(tmp_path, False, backend) == expected
+    assert backend.calls == 4
+    assert get_checkpoint() is None
+
+
+def test_checkpoint_truncated(tmp_path: Path) -> None:
+    """It ignores a page that was cut short and fetches it again."""
+    checkpoint = Checkpoint(str(tmp_path), resume=True)
+    checkpoint.save_page(QUERY, [{"ID": "trial-1"}], "a/trial-1", False)
+    path = tmp_path / f"{query_key(QUERY)}.jsonl"
+    with open(path, "a") as fp:
+        fp.write('{"cursor": "a/trial-2", "complete": fal')
+
+    assert checkpoint.load(QUERY) == ([[{"ID": "trial-1"}]], "a/trial-1", False)
+    checkpoint.save_page(QUERY, [], None, True)
+    assert checkpoint.load(QUERY) == ([[{"ID": "trial-1"}], []], None, True)
+    assert Checkpoint(str(tmp_path)).load(QUERY) == ([], None, False)
@@ -0,0 +1,65 @@
+"""Test cases for the decoding module."""
+import json
+import sys
+from typing import Iterator
+
+import pytest
+
+from .mock_bytes import RUNS_BYTES
+from .mock_bytes import TRIALS_1_BYTES
+from roarquery import decoding
+from roarquery.decoding import available_decoders
+from roarquery.decoding import decode_page
+from roarquery.decoding import FuegoOutputError
+from roarquery.decoding import get_json_decoder
+from roarquery.decoding import set_json_decoder
+from roarquery.decoding import validate_documents
+
+
+@pytest.fixture(autouse=True)
+def reset_decoder() -> Iterator[None]:
+    """Restore the default decoder after each test."""
+    yield
+    set_json_decoder()
+
+
+@pytest.mark.parametrize("name", available_decoders())
+def test_decode_page(name: str) -> None:
+    """Every installed decoder returns what the standard library returns."""
+    set_json_decoder(name, validate=True)
+    assert get_json_decoder() == name
+    for output in [RUNS_BYTES, TRIALS_1_BYTES]:
+        assert decode_page(output) == json.loads(output.decode("utf-8"))
+    assert decode_page(b"") == []
+
+
+def test_decoder_fallback(monkeypatch: pytest.MonkeyPatch) -> None:
+    """It falls back to the standard library when no fast decoder is installed."""
+    monkeypatch.setitem(sys.modules, "orjson", None)
+    monkeypatch.setitem(sys.modules, "msgspec", None)
+    monkeypatch.setattr(decoding, "_AVAILABLE", None)
+    monkeypatch.setattr(decoding, "_DECODERS", {})
+
+    assert available_decoders() == ["json"]
+    assert get_json_decoder() == "json"
+    with pytest.raises(ValueError):
+        set_json_decoder("orjson")
+    assert decode_page(RUNS_BYTES)[0]["ID"] == "run-1"
+
+
+def test_validate_documents() -> None:
+    """It rejects output that does not look like fuego documents."""
+    validate_documents(json.loads(RUNS_BYTES))
+    validate_documents(json.loads(RUNS_BYTES)[0])
+
+    with pytest.raises(FuegoOutputError, match="list of documents"):
+        validate_documents("prod")
+    with pytest.raises(FuegoOutputError, match="not an object"):
+        validate_documents([1])
+    with pytest.raises(FuegoOutputError, match="'CreateTime'"):
+        decode_page(b'[{"ID": "1", "Data": {}}]', validate=True)
+
+    set_json_decoder(validate=True)
+    with pytest.raises(FuegoOutputError):
+        decode_page(b"[1]")
+    assert decode_page(b"[1]", validate=False) == [1]
@@ -0,0 +1,154 @@
+"""Test cases for the dtypes module."""
+from typing import Any
+from typing import List
+from typing import Tuple
+
+import pandas as pd
+
+from roarquery.dtypes import compact_dtypes
+from roarquery.dtypes import DtypeCompactor
+from roarquery.dtypes import parse_timestamps
+from roarquery.dtypes import preserve_dtypes
+
+
+def test_parse_timestamps() -> None:
+    """It parses every timestamp column and leaves the others alone."""
+    df = pd.DataFrame(
+        {
+            "CreateTime_x": ["2022-01-01T00:00:00.123Z", "2022-01-01T00:00:00Z"],
+            "user.CreateTime": ["2021-01-01T00:00:00Z", "not a date"],
+            "timeFinished": [None, "2022-01-01T00:10:00-07:00"],
+            "name": ["2022-01-01T00:00:00Z", "b"],
+        }
+    )
+    parsed = parse_timestamps(df)
+    for column in ["CreateTime_x", "user.CreateTime", "timeFinished"]:
+        assert str(parsed[column].dtype) == "datetime64[ns, UTC]"
+
+    assert parsed["timeFinished"].tolist()[1] == pd.Timestamp("2022-01-01T07:10Z")
+    assert parsed["user.CreateTime"].isna().tolist() == [False, True]
+    assert parsed["name"].tolist() == df["name"].tolist()
+    assert df["CreateTime_x"].dtype == object
+
+
+def test_preserve_dtypes() -> None:
+    """It converts timestamps, booleans and task/variant IDs."""
+    df = pd.DataFrame(
+        {
+            "timeStarted": ["2022-01-01T00:00:00Z", None],
+            "CreateTime_y": ["2022-01-01T01:00:00Z", "2022-01-02T00:00:00Z"],
+            "completed": [True, "false"],
+            "taskId": ["swr", "swr"],
+            "grade": ["1", "2"],
+        }
+    )
+    converted = preserve_dtypes(df)
+    assert str(converted["timeStarted"].dtype) == "datetime64[ns, UTC]"
+    assert str(converted["CreateTime_y"].dtype) == "datetime64[ns, UTC]"
+    assert converted["completed"].dtype == "boolean"
+    assert converted["completed"].tolist() == [True, False]
+    assert converted["taskId"].dtype == "category"
+    assert converted["grade"].dtype == object
+    assert df["completed"].dtype == object
+
+
+def test_compact_dtypes() -> None:
+    """It converts low-cardinality strings, booleans and numbers."""
+    df = pd.DataFrame(
+        {
+            "taskId": ["swr", "swr", "pa", "pa"],
+            "user.grade": ["1", "1", "2", "1"],
+            "completed": [True, "false", None, True],
+            "rt": [512, 610, None, 40_000],
+            "correct": [1, 0, 1, 1],
+            "theta": [0.5, 0.25, -1.5, None],
+            "z": [0.1, 0.2, 0.3, 0.4],
+            "pid": ["a", "b", "c", "d"],
+            "schools": [["s1"], ["s2"], [], ["s1"]],
+        }
+    )
+    compactor = DtypeCompactor()
+    compactor.fit(df)
+    compacted = compactor.compact(df)
+    assert {column: str(dtype) for column, dtype in compacted.dtypes.items()} == {
+        "taskId": "category",
+        "user.grade": "category",
+        "completed": "boolean",
+        "rt": "Int32",
+        "correct": "Int8",
+        "theta": "float32",
+        "z": "float64",
+        "pid": "object",
+        "schools": "object",
+    }
+    assert compacted["completed"].tolist() == [True, False, pd.NA, True]
+    assert compacted["rt"].astype(float).fillna(0).tolist() == [512, 610, 0, 40_000]
+    assert compactor.memory_after < compactor.memory_before
+    assert compact_dtypes(df).equals(compacted)
+
+
+def test_dtype_compactor_chunks() -> None:
+    """It gives every chunk of a stream identical dtypes."""
+    tasks = pd.CategoricalDtype(["pa", "sre", "swr"])
+    compactor = DtypeCompactor(dtypes={"taskId": tasks, "pid": None})
+    compactor.fit(pd.DataFrame({"grade": ["1", "2", "1", "1"], "pid": ["a"] * 4}))
+    chunks = [
+        pd.DataFrame({"taskId": ["swr", "sre"], "rt": [1, 2], "done": [None, None]}),
+        pd.DataFrame({"taskId": ["pa", None], "rt": [70_000, 3], "done": [True, None]}),
+        pd.DataFrame({"taskId": [None], "rt": [None], "done": ["false"]}),
+    ]
+    for chunk in chunks:
+        chunk["grade"] = "1"
+        chunk["pid"] = "b"
+        chunk["item"] = "i1"
+    compacted = [compactor.compact(chunk) for chunk in chunks]
+
+    dtypes = {
+        "taskId": "category",
+        "rt": "Int64",
+        "done": "boolean",
+        "grade": "category",
+        "pid": "object",
+        "item": "object",
+    }
+    for chunk in compacted[1:]:
+        assert {key: str(dtype) for key, dtype in chunk.dtypes.items()} == dtypes
+    # The first chunk has no values to fix the dtype of "done" with.
+    assert compacted[0]["done"].dtype == object
+
+    streamed = pd.concat(compacted[1:])
+    assert streamed.dtypes.equals(compacted[1].dtypes)
+    assert streamed["taskId"].dtype == tasks
+    assert streamed["grade"].cat.categories.tolist() == ["1", "2"]
+    assert streamed["rt"].tolist() == [70_000, 3, pd.NA]
+
+    # Values that do not fit the dtype of their column widen it.
+    for column, values, dtype in [
+        ("taskId", ["vocab"], "object"),
+        ("done", ["maybe"], "object"),
+        ("grade", [3], "object"),
+    ]:
+        widened = compactor.compact(pd.DataFrame({column: values}))
+        assert str(widened[column].dtype) == dtype
+        assert widened[column].tolist() == values
+        assert compactor.dtypes[column] == "object"
+
+
+def test_dtype_compactor_widens() -> None:
+    """It widens a streamed column whose later values do not fit its dtype."""
+    cases: List[Tuple[List[Any], str]] = [
+        ([523.5, None], "float64"),
+        (["fast", 3], "object"),
+    ]
+    for later, dtype in cases:
+        compactor = DtypeCompactor()
+        first = compactor.compact(pd.DataFrame({"rt": [500, 510]}))
+        second = compactor.compact(pd.DataFrame({"rt": later}))
+        third = compactor.compact(pd.DataFrame({"rt": [520]}))
+        assert str(first["rt"].dtype) == "Int64"
+        assert str(second["rt"].dtype) == str(third["rt"].dtype) == dtype
+        assert pd.concat([first, second, third])["rt"].tolist()[:3] == [
+            500,
+            510,
+            later[0],
+        ]
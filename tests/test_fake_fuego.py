@@ -0,0 +1,153 @@
+"""Test cases for the fake_fuego module."""
+import json
+import os
+import sys
+from datetime import date
+from pathlib import Path
+from typing import Any
+from typing import List
+
+import pytest
+
+from .mock_bytes import RUNS
+from .mock_bytes import TRIALS_1_BYTES
+from .mock_bytes import TRIALS_4_BYTES
+from roarquery.backends import BackendError
+from roarquery.backends import FuegoBackend
+from roarquery.backends import LocalBackend
+from roarquery.backends import TransientBackendError
+from roarquery.backends import use_backend
+from roarquery.fake_fuego import FakeFuego
+from roarquery.fake_fuego import main
+from roarquery.runs import get_runs_compat
+from roarquery.utils import bytes2json
+from roarquery.utils import page_results
+
+
+QUERIES = [
+    ["fuego", "c"],
+    ["fuego", "get", "prod/roar-prod/users", "aa-0001"],
+    ["fuego", "query", "--limit", "2", "-g", "runs", 'classId == "class-1"'],
+    ["fuego", "query", "--select", "name", "-g", "runs"],
+    [
+        "fuego",
+        "query",
+        "--startafter",
+        "prod/roar-prod/users/aa-0001/runs/run-1/trials/trial-02",
+        "--limit",
+        "3",
+        "prod/roar-prod/users/aa-0001/runs/run-1/trials",
+    ],
+    ["fuego", "query", "prod/roar-prod/users/zz/runs"],
+]
+
+
+@pytest.fixture
+def dataset(tmp_path: Path) -> str:
+    """A dataset directory holding the mock runs, trials and a user."""
+    backend = LocalBackend()
+    for doc in [*RUNS, *bytes2json(TRIALS_1_BYTES), *bytes2json(TRIALS_4_BYTES)]:
+        backend.add_document(
+            doc["Path"], doc["Data"], doc["CreateTime"], doc["UpdateTime"]
+        )
+    backend.add_document("prod/roar-prod/users/aa-0001", {"name": "aa-0001"})
+    backend.save(str(tmp_path / "db"))
+    return str(tmp_path / "db")
+
+
+def _without_read_time(output: bytes) -> Any:
+    if not output.startswith(b"[") and not output.startswith(b"{"):
+        return output
+    documents = json.loads(output)
+    for document in documents if isinstance(documents, list) else [documents]:
+        document.pop("ReadTime")
+    return documents
+
+
+@pytest.mark.parametrize("query", QUERIES)
+def test_fake_fuego(dataset: str, query: List[str]) -> None:
+    """It answers fuego commands like a LocalBackend holding the dataset."""
+    assert _without_read_time(FakeFuego(dataset).run(query)) == _without_read_time(
+        LocalBackend(dataset).run(query)
+    )
+
+
+@pytest.mark.parametrize("backend_class", [FakeFuego, LocalBackend])
+def test_fake_fuego_paging(tmp_path: Path, backend_class: Any) -> None:
+    """It pages through hyphenated IDs in the same order as a LocalBackend."""
+    backend = LocalBackend()
+    for user in ["a", "a-b", "b"]:
+        backend.add_document(f"prod/roar-prod/users/{user}/runs/run-1", {})
+    backend.save(str(tmp_path / "db"))
+
+    with use_backend(backend_class(str(tmp_path / "db"))):
+        runs = page_results(["fuego", "query", "-g", "runs"], limit=1)
+    assert [run["Path"].split("/")[3] for run in runs] == ["a", "a-b", "b"]
+
+
+def test_fake_fuego_faults(dataset: str) -> None:
+    """It fails with throttling and deadline errors at the configured rates."""
+    with pytest.raises(TransientBackendError, match="ResourceExhausted"):
+        FakeFuego(dataset, error_rate=1.0).run(["fuego", "c"])
+    with pytest.raises(TransientBackendError, match="DeadlineExceeded"):
+        FakeFuego(dataset, timeout_rate=1.0, timeout=0).run(["fuego", "c"])
+
+    fake = FakeFuego.from_env(
+        {
+            "FAKE_FUEGO_ROOT": dataset,
+            "FAKE_FUEGO_LATENCY": "0.5",
+            "FAKE_FUEGO_JITTER": "0.1",
+            "FAKE_FUEGO_ERROR_RATE": "",
+        }
+    )
+    assert (fake.latency, fake.jitter, fake.error_rate, fake.timeout) == (
+        0.5,
+        0.1,
+        0.0,
+        10.0,
+    )
+    with pytest.raises(BackendError):
+        FakeFuego.from_env({})
+
+
+def test_main(
+    dataset: str,
+    tmp_path: Path,
+    monkeypatch: pytest.MonkeyPatch,
+    capsysbinary: pytest.CaptureFixture[bytes],
+) -> None:
+    """It prints the output, logs each call and exits non-zero on errors."""
+    log_path = tmp_path / "calls.jsonl"
+    monkeypatch.setenv("FAKE_FUEGO_ROOT", dataset)
+    monkeypatch.setenv("FAKE_FUEGO_LOG", str(log_path))
+
+    assert main(["get", "prod/roar-prod/users", "aa-0001"]) == 0
+    assert json.loads(capsysbinary.readouterr().out)["ID"] == "aa-0001"
+
+    assert main(["get", "prod/roar-prod/users", "zz"]) == 1
+    captured = capsysbinary.readouterr()
+    assert captured.out == b""
+    assert b"does not exist" in captured.err
+
+    calls = [json.loads(line) for line in log_path.read_text().splitlines()]
+    assert [call["argv"][-1] for call in calls] == ["aa-0001", "zz"]
+    assert calls[0]["bytes"] > 0 and calls[0]["error"] == ""
+    assert "does not exist" in calls[1]["error"]
+
+
+@pytest.mark.skipif(sys.platform == "win32", reason="The shim is a shell script.")
+def test_fake_fuego_on_path(dataset: str, monkeypatch: pytest.MonkeyPatch) -> None:
+    """It stands in for the fuego executable."""
+    shim = Path(__file__).parents[1] / "benchmarks" / "bin"
+    monkeypatch.setenv("PATH", f"{shim}{os.pathsep}{os.environ['PATH']}")
+    monkeypatch.setenv("PYTHON", sys.executable)
+    monkeypatch.setenv("FAKE_FUEGO_ROOT", dataset)
+
+    kwargs: Any = dict(return_trials=True, started_before=date(2020, 1, 15))
+    with use_backend(FuegoBackend()):
+        trials = get_runs_compat(**kwargs)
+    with use_backend(LocalBackend(dataset)):
+        expected = get_runs_compat(**kwargs)
+
+    assert len(trials) == 12
+    assert trials.sort_index().equals(expected.sort_index())
@@ -1,5 +1,9 @@
 """Test cases for the __main__ module."""
+import json
+import subprocess  # nosec
+import sys
 from datetime import date
+from typing import List
 from unittest.mock import Mock
 from unittest.mock import patch
 
@@ -9,13 +13,22 @@ from click.testing import CliRunner
 
 from .mock_bytes import RUNS
 from .mock_bytes import RUNS_BYTES
+from .mock_bytes import TRIALS_1
 from .mock_bytes import TRIALS_1_BYTES
+from .mock_bytes import TRIALS_4
 from .mock_bytes import TRIALS_4_BYTES
 from .mock_bytes import TRIALS_BYTES
 from roarquery import __main__
+from roarquery.backends import BackendError
+from roarquery.backends import LocalBackend
+from roarquery.backends import TransientBackendError
+from roarquery.backends import use_backend
+from roarquery.runs import date_conditions
 from roarquery.runs import filter_run_dates
 from roarquery.runs import merge_data_with_metadata
 from roarquery.utils import bytes2json
+from roarquery.utils import use_page_size
+from roarquery.writers import read_export
 
 
 @pytest.fixture
@@ -43,6 +56,27 @@ def test_runs_yields_help(runner: CliRunner) -> None:
     assert "Examples" in result.output
 
 
+@pytest.mark.parametrize(
+    "args", [["--help"], ["--version"], ["runs", "--help"], ["sync", "--help"]]
+)
+def test_main_imports_lazily(args: List[str]) -> None:
+    """It does not import pandas or other heavy dependencies to show help."""
+    heavy = ["dateutil", "numpy", "pandas", "pyarrow", "tqdm"]
+    code = (
+        "import sys\n"
+        "from roarquery.__main__ import main\n"
+        "try:\n"
+        f"    main({args!r}, prog_name='roarquery')\n"
+        "except SystemExit:\n"
+        "    pass\n"
+        f"print([name for name in {heavy!r} if name in sys.modules])\n"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", code], capture_output=True, check=True, text=True
+    ).stdout
+    assert output.splitlines()[-1] == "[]"
+
+
 @pytest.mark.parametrize("completed", [True, False])
 @patch(
     "subprocess.check_output", side_effect=[RUNS_BYTES, TRIALS_1_BYTES, TRIALS_4_BYTES]
@@ -130,6 +164,8 @@ def test_runs(
     if completed:
         expected_call_args.append('completed == "true"')
 
+    expected_call_args.extend(date_conditions(started_before=date(2020, 1, 15)))
+
     mock_subproc_check_output.assert_any_call(expected_call_args)
     mock_subproc_check_output.assert_any_call(
         [
@@ -149,3 +185,410 @@ def test_runs(
             "prod/roar-prod/users/bb-0001/runs/run-4/trials",
         ]
     )
+
+
+def _fake_fuego(query: List[str]) -> bytes:
+    """Return canned fuego output based on the queried path."""
+    if "prod/roar-prod/users/aa-0001/runs/run-1/trials" in query:
+        return TRIALS_1_BYTES
+    if "prod/roar-prod/users/bb-0001/runs/run-4/trials" in query:
+        return TRIALS_4_BYTES
+    return RUNS_BYTES
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego)
+def test_runs_cache(mock_subproc_check_output: Mock, runner: CliRunner) -> None:
+    """It reuses cached fuego responses unless asked not to."""
+    cli_args = [
+        "runs",
+        "--legacy",
+        "--task-id=swr",
+        "--return-trials",
+        "--started-before=2020-01-15",
+        "--cache-dir=cache",
+        "trials.csv",
+    ]
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(__main__.main, cli_args)
+        assert result.exit_code == 0
+        assert mock_subproc_check_output.call_count == 3
+        expected = pd.read_csv("trials.csv", index_col="trialId")
+
+        result = runner.invoke(__main__.main, cli_args)
+        assert result.exit_code == 0
+        assert mock_subproc_check_output.call_count == 3
+        assert pd.read_csv("trials.csv", index_col="trialId").equals(expected)
+
+        result = runner.invoke(__main__.main, cli_args[:-1] + ["--refresh", "t.csv"])
+        assert result.exit_code == 0
+        assert mock_subproc_check_output.call_count == 6
+
+        result = runner.invoke(__main__.main, cli_args[:-1] + ["--no-cache", "t.csv"])
+        assert result.exit_code == 0
+        assert mock_subproc_check_output.call_count == 9
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego)
+def test_sync(mock_subproc_check_output: Mock, runner: CliRunner) -> None:
+    """It only fetches trials on the first of two identical syncs."""
+    cli_args = [
+        "sync",
+        "--legacy",
+        "--task-id=swr",
+        "--return-trials",
+        "--started-before=2020-01-15",
+        "trials.csv",
+    ]
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(__main__.main, cli_args)
+        assert result.exit_code == 0
+        assert mock_subproc_check_output.call_count == 3
+        expected = pd.read_csv("trials.csv", index_col="trialId")
+
+        result = runner.invoke(__main__.main, cli_args)
+        assert result.exit_code == 0
+        assert mock_subproc_check_output.call_count == 4
+        assert pd.read_csv("trials.csv", index_col="trialId").equals(expected)
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego)
+def test_runs_stream(mock_subproc_check_output: Mock, runner: CliRunner) -> None:
+    """It streams trials to the output file."""
+    cli_args = [
+        "runs",
+        "--legacy",
+        "--return-trials",
+        "--started-before=2020-01-15",
+    ]
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(__main__.main, [*cli_args, "trials.csv"])
+        assert result.exit_code == 0
+        expected = pd.read_csv("trials.csv", index_col="trialId")
+
+        result = runner.invoke(__main__.main, [*cli_args, "--stream", "streamed.csv"])
+        assert result.exit_code == 0
+        streamed = pd.read_csv("streamed.csv", index_col="trialId")
+        assert streamed.equals(expected[streamed.columns])
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego)
+def test_runs_parquet(mock_subproc_check_output: Mock, runner: CliRunner) -> None:
+    """It writes Parquet and Feather exports, with or without streaming."""
+    cli_args = [
+        "runs",
+        "--legacy",
+        "--return-trials",
+        "--started-before=2020-01-15",
+    ]
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(__main__.main, [*cli_args, "trials.csv"])
+        assert result.exit_code == 0
+        expected = pd.read_csv("trials.csv", index_col="trialId")
+
+        for extra_args, filename, output_format in [
+            ([], "trials.parquet", None),
+            (["--stream"], "streamed.parquet", None),
+            (["--format=feather"], "trials.out", "feather"),
+        ]:
+            result = runner.invoke(__main__.main, [*cli_args, *extra_args, filename])
+            assert result.exit_code == 0
+            output = read_export(filename, output_format)
+            assert output.index.tolist() == expected.index.tolist()
+            assert set(output.columns) == set(expected.columns)
+            assert output["correct"].tolist() == expected["correct"].tolist()
+            assert str(output["timeStarted"].dtype) == "datetime64[ns, UTC]"
+            assert str(output["CreateTime_x"].dtype) == "datetime64[ns, UTC]"
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego)
+def test_runs_compact_dtypes(
+    mock_subproc_check_output: Mock, runner: CliRunner
+) -> None:
+    """It writes the same trials with compact dtypes and reports the memory."""
+    cli_args = ["runs", "--legacy", "--return-trials"]
+
+    with runner.isolated_filesystem():
+        result = runner.invoke(__main__.main, [*cli_args, "trials.csv"])
+        assert result.exit_code == 0
+        expected = pd.read_csv("trials.csv", index_col="trialId")
+
+        for extra_args, filename in [
+            ([], "compact.csv"),
+            (["--stream"], "streamed.parquet"),
+        ]:
+            result = runner.invoke(
+                __main__.main, [*cli_args, *extra_args, "--compact-dtypes", filename]
+            )
+            assert result.exit_code == 0
+            assert "Compact dtypes:" in result.output
+            output = read_export(filename)
+            assert output.index.tolist() == expected.index.tolist()
+            correct = output["correct"].astype("boolean")
+            assert correct.equals(expected["correct"].astype("boolean"))
+            assert output["pid"].astype(object).equals(expected["pid"])
+
+
+def test_runs_compact_dtypes_widen(runner: CliRunner) -> None:
+    """It widens a streamed trial column whose later values do not fit."""
+    backend = LocalBackend()
+    for doc in RUNS:
+        backend.add_document(doc["Path"], doc["Data"], doc["CreateTime"])
+    for doc in [*TRIALS_1, *TRIALS_4]:
+        rt = 500 if "run-1/" in doc["Path"] else 523.5
+        backend.add_document(doc["Path"], dict(doc["Data"], rt=rt), doc["CreateTime"])
+
+    args = ["runs", "--legacy", "--return-trials", "--compact-dtypes", "--stream"]
+    with runner.isolated_filesystem(), use_backend(backend):
+        result = runner.invoke(__main__.main, [*args, "out.csv"])
+        assert result.exit_code == 0
+        assert sorted(set(pd.read_csv("out.csv")["rt"])) == [500, 523.5]
+
+
+def test_runs_backend(runner: CliRunner) -> None:
+    """It runs fuego commands with the selected backend."""
+    backend = LocalBackend()
+    for run in RUNS:
+        backend.add_document(run["Path"], run["Data"])
+
+    with runner.isolated_filesystem():
+        backend.save("db")
+        result = runner.invoke(
+            __main__.main, ["runs", "--legacy", "--backend=local:db", "runs.csv"]
+        )
+        assert result.exit_code == 0
+        assert pd.read_csv("runs.csv", index_col="runId").index.tolist() == [
+            run["ID"] for run in RUNS
+        ]
+
+        # Without --backend, the active backend is used.
+        with use_backend(backend):
+            result = runner.invoke(__main__.main, ["runs", "--legacy", "active.csv"])
+        assert result.exit_code == 0
+        assert pd.read_csv("active.csv").equals(pd.read_csv("runs.csv"))
+
+        result = runner.invoke(__main__.main, ["runs", "--backend=grpc", "runs.csv"])
+        assert result.exit_code == 2
+        assert "Unknown backend" in result.output
+
+
+def test_runs_sharded(runner: CliRunner) -> None:
+    """It paginates the shards of the runs query in parallel."""
+    backend = LocalBackend()
+    for run in RUNS:
+        backend.add_document(run["Path"], run["Data"])
+
+    args = ["runs", "--legacy", "--workers=2", "--page-size=1"]
+    with runner.isolated_filesystem(), use_backend(backend):
+        result = runner.invoke(__main__.main, [*args, "runs.csv"])
+        assert result.exit_code == 0
+
+        for shard_by in [
+            "path:prod/roar-prod/users/aa-0001/runs/run-2",
+            "date:3 --started-after=2019-12-01 --started-before=2020-04-01",
+        ]:
+            result = runner.invoke(
+                __main__.main, [*args, *f"--shard-by {shard_by}".split(), "s.csv"]
+            )
+            assert result.exit_code == 0
+            # Date shards return the runs window by window.
+            expected = pd.read_csv("runs.csv", index_col="runId")
+            assert pd.read_csv("s.csv", index_col="runId").sort_index().equals(expected)
+
+        result = runner.invoke(__main__.main, [*args, "--shard-by=date:3", "s.csv"])
+        assert result.exit_code == 2
+        assert "start and an end date" in result.output
+
+        result = runner.invoke(
+            __main__.main,
+            [*args, "--shard-by=path:users/a", "--started-after=2020-01-01", "s.csv"],
+        )
+        assert result.exit_code == 2
+        assert "date range" in result.output
+
+
+def test_runs_page_size(runner: CliRunner) -> None:
+    """It only adapts the page size if a maximum page size is given."""
+    backend = LocalBackend()
+    for run in RUNS:
+        backend.add_document(run["Path"], run["Data"])
+
+    args = ["runs", "--legacy", "--page-size=2"]
+    with runner.isolated_filesystem(), use_backend(backend):
+        for extra_args, expected in [
+            ([], (2, None)),
+            (["--max-page-size=50"], (2, 50)),
+            (["--max-page-size=1"], (2, 2)),
+        ]:
+            with patch.object(
+                __main__, "use_page_size", wraps=use_page_size
+            ) as mock_use_page_size:
+                result = runner.invoke(__main__.main, [*args, *extra_args, "r.csv"])
+            assert result.exit_code == 0
+            mock_use_page_size.assert_called_once_with(*expected)
+
+
+def test_runs_scan_trials(runner: CliRunner, monkeypatch: pytest.MonkeyPatch) -> None:
+    """It fetches the trials with one collection-group scan."""
+    from roarquery import runs
+
+    monkeypatch.setattr(runs, "TRIAL_SCAN_MIN_RUNS", 2)
+    backend = LocalBackend()
+    for doc in [*RUNS, *TRIALS_1, *TRIALS_4]:
+        backend.add_document(doc["Path"], doc["Data"], doc["CreateTime"])
+
+    args = ["runs", "--legacy", "--return-trials"]
+    with runner.isolated_filesystem(), use_backend(backend):
+        calls = []
+        for extra_args in [[], ["--scan-trials", '--trial-condition=grade == "KG"']]:
+            result = runner.invoke(
+                __main__.main, [*args, *extra_args, "--stats-json=s.json", "t.csv"]
+            )
+            assert result.exit_code == 0
+            with open("s.json") as fp:
+                calls.append(json.load(fp)["counters"]["fuego calls"])
+            if not extra_args:
+                expected = pd.read_csv("t.csv")
+
+        assert pd.read_csv("t.csv").equals(expected)
+        assert calls[1] < calls[0]
+
+        for extra_args, message in [
+            (["--scan-trials"], "at least one trial condition"),
+            (["--trial-condition=correct != true"], "equality conditions"),
+        ]:
+            result = runner.invoke(__main__.main, [*args, *extra_args, "t.csv"])
+            assert result.exit_code == 2
+            assert message in result.output
+
+
+def test_runs_stats(runner: CliRunner) -> None:
+    """It reports the time spent in each phase and traces the fuego calls."""
+    backend = LocalBackend()
+    for run in RUNS:
+        backend.add_document(run["Path"], run["Data"])
+
+    with runner.isolated_filesystem(), use_backend(backend):
+        result = runner.invoke(
+            __main__.main,
+            [
+                "runs",
+                "--legacy",
+                "--stats",
+                "--stats-json=stats.json",
+                "--trace=trace.json",
+                "runs.csv",
+            ],
+        )
+        assert result.exit_code == 0
+        assert "fuego calls" in result.output
+        assert "total (wall)" in result.output
+
+        with open("stats.json") as fp:
+            stats = json.load(fp)
+        assert stats["counters"]["fuego calls"] >= 1
+        assert stats["phases"]["fuego"]["calls"] == stats["counters"]["fuego calls"]
+        assert "build runs frame" in stats["phases"]
+        assert stats["wall_seconds"] > 0
+
+        with open("trace.json") as fp:
+            events = json.load(fp)["traceEvents"]
+        fuego_calls = [event for event in events if event["name"] == "fuego"]
+        assert len(fuego_calls) == stats["counters"]["fuego calls"]
+        assert fuego_calls[0]["args"]["argv"].startswith("fuego query")
+        assert fuego_calls[0]["args"]["bytes"] > 0
+        assert {"fetch page", "build runs frame"} <= {event["name"] for event in events}
+
+
+def test_runs_skip_failed_runs(runner: CliRunner) -> None:
+    """It leaves out, and lists, the runs whose trials cannot be fetched."""
+
+    class FailingBackend(LocalBackend):
+        def run(self, query: List[str]) -> bytes:
+            if any(arg.endswith("run-4/trials") for arg in query):
+                raise BackendError("rpc error: code = PermissionDenied")
+            return super().run(query)
+
+    backend = FailingBackend()
+    for doc in [*RUNS, *TRIALS_1, *TRIALS_4]:
+        backend.add_document(doc["Path"], doc["Data"], doc["CreateTime"])
+
+    args = ["runs", "--legacy", "--return-trials", "--retries=0", "--workers=2"]
+    with runner.isolated_filesystem(), use_backend(backend):
+        result = runner.invoke(__main__.main, [*args, "trials.csv"])
+        assert result.exit_code == 1
+
+        result = runner.invoke(__main__.main, [*args, "--skip-failed-runs", "t.csv"])
+        assert result.exit_code == 0
+        assert "Skipped 1 run(s) whose trials could not be fetched" in result.output
+        assert "run-4: BackendError" in result.output
+        trials = pd.read_csv("t.csv")
+        assert set(trials["runId"]) == {"run-1"}
+        assert len(trials) == len(TRIALS_1)
+
+
+def test_runs_failure_saves_user_cache(runner: CliRunner) -> None:
+    """It saves the user cache even if the export fails."""
+
+    class FailingBackend(LocalBackend):
+        def run(self, query: List[str]) -> bytes:
+            if any(arg.endswith("/trials") for arg in query):
+                raise TransientBackendError("rpc error: code = Unavailable")
+            return super().run(query)
+
+    backend = FailingBackend()
+    backend.add_document("users/aa-0001", {"grade": "1"})
+    backend.add_document("users/aa-0001/runs/run-1", {"taskId": "swr"})
+
+    args = ["runs", "--return-trials", "--retries=0", "--user-cache=users.json"]
+    with runner.isolated_filesystem(), use_backend(backend):
+        result = runner.invoke(__main__.main, [*args, "trials.csv"])
+        assert result.exit_code == 1
+        with open("users.json") as fp:
+            assert list(json.load(fp)) == ["users/aa-0001"]
+
+
+def test_runs_resume(runner: CliRunner) -> None:
+    """It retries failed calls and resumes an interrupted export."""
+
+    class FailingBackend(LocalBackend):
+        def __init__(self, calls_before_failure: int) -> None:
+            super().__init__()
+            for doc in [*RUNS, *TRIALS_1, *TRIALS_4]:
+                self.add_document(doc["Path"], doc["Data"], doc["CreateTime"])
+            self.calls_before_failure = calls_before_failure
+            self.calls = 0
+
+        def run(self, query: List[str]) -> bytes:
+            self.calls += 1
+            if self.calls > self.calls_before_failure:
+                raise TransientBackendError("rpc error: code = Unavailable")
+            return super().run(query)
+
+    args = ["runs", "--legacy", "--return-trials", "--checkpoint-dir=checkpoint"]
+    with runner.isolated_filesystem():
+        backend = FailingBackend(calls_before_failure=3)
+        with use_backend(backend):
+            result = runner.invoke(__main__.main, [*args, "--retries=0", "a.csv"])
+        assert result.exit_code == 1
+
+        backend = FailingBackend(calls_before_failure=100)
+        with use_backend(backend):
+            result = runner.invoke(__main__.main, [*args, "--resume", "a.csv"])
+        assert result.exit_code == 0
+        assert "Resuming from checkpoint: 3 queries complete" in result.output
+        resumed_calls = backend.calls
+
+        backend = FailingBackend(calls_before_failure=100)
+        with use_backend(backend):
+            result = runner.invoke(__main__.main, [*args, "b.csv"])
+        assert result.exit_code == 0
+        assert resumed_calls < backend.calls
+        assert pd.read_csv("a.csv").equals(pd.read_csv("b.csv"))
+
+        result = runner.invoke(__main__.main, ["runs", "--resume", "c.csv"])
+        assert result.exit_code == 2
+        assert "--resume requires --checkpoint-dir" in result.output
@@ -0,0 +1,96 @@
+"""Test cases for the metrics module."""
+import json
+import threading
+from pathlib import Path
+
+import pytest
+
+from roarquery.metrics import count
+from roarquery.metrics import get_metrics
+from roarquery.metrics import get_trace
+from roarquery.metrics import Metrics
+from roarquery.metrics import timed
+from roarquery.metrics import Trace
+from roarquery.metrics import use_metrics
+from roarquery.metrics import use_trace
+
+
+def test_metrics() -> None:
+    """It sums the calls and time of each phase and the counters."""
+    metrics = Metrics()
+    metrics.add_time("fuego", 0.5)
+    metrics.add_time("fuego", 0.25)
+    metrics.add_time("decode", 0.125)
+    metrics.increment("fuego calls")
+    metrics.increment("bytes received", 1024)
+
+    stats = metrics.to_dict()
+    assert stats["phases"] == {
+        "fuego": {"calls": 2, "seconds": 0.75},
+        "decode": {"calls": 1, "seconds": 0.125},
+    }
+    assert stats["counters"] == {"fuego calls": 1, "bytes received": 1024}
+    assert stats["wall_seconds"] > 0
+
+    report = metrics.report().splitlines()
+    assert report[1].split() == ["fuego", "2", "0.750"]
+    assert report[2].split() == ["decode", "1", "0.125"]
+    assert "1,024" in metrics.report()
+
+
+def test_timed_and_count() -> None:
+    """They record to the active metrics, from any thread, and else do nothing."""
+    with timed("fuego"):
+        count("fuego calls")
+    assert get_metrics() is None
+
+    metrics = Metrics()
+    with use_metrics(metrics):
+
+        def work() -> None:
+            with timed("fuego"):
+                count("fuego calls")
+
+        threads = [threading.Thread(target=work) for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        assert get_metrics() is metrics
+
+    assert get_metrics() is None
+    assert metrics.phases["fuego"][0] == 4
+    assert metrics.counters == {"fuego calls": 4}
+
+
+def test_trace(tmp_path: Path) -> None:
+    """It records nested spans per thread, with their details and errors."""
+    trace = Trace()
+    with use_trace(trace):
+        with timed("fetch page", page=1) as span:
+            with timed("fuego", argv="fuego query -g runs"):
+                pass
+            span["documents"] = 2
+
+        def fail() -> None:
+            with pytest.raises(ValueError), timed("decode"):
+                raise ValueError("bad output")
+
+        thread = threading.Thread(target=fail, name="worker")
+        thread.start()
+        thread.join()
+    assert get_trace() is None
+
+    trace.save(str(tmp_path / "trace.json"))
+    events = json.loads((tmp_path / "trace.json").read_text())["traceEvents"]
+    names = {event["args"]["name"]: event["tid"] for event in events[:2]}
+    assert set(names) == {threading.current_thread().name, "worker"}
+
+    spans = {event["name"]: event for event in events[2:]}
+    page, fuego, decode = spans["fetch page"], spans["fuego"], spans["decode"]
+    assert fuego["args"] == {"argv": "fuego query -g runs"}
+    assert page["args"] == {"page": 1, "documents": 2}
+    assert page["ts"] <= fuego["ts"]
+    assert fuego["ts"] + fuego["dur"] <= page["ts"] + page["dur"]
+    assert page["tid"] == fuego["tid"] != decode["tid"] == names["worker"]
+    assert decode["args"]["error"] == "ValueError('bad output')"
@@ -0,0 +1,104 @@
+"""Test cases for the retry module."""
+import random
+import subprocess  # nosec
+from typing import List
+
+import pytest
+
+from roarquery.backends import Backend
+from roarquery.backends import BackendError
+from roarquery.backends import TransientBackendError
+from roarquery.backends import use_backend
+from roarquery.metrics import Metrics
+from roarquery.metrics import use_metrics
+from roarquery.retry import get_retry_policy
+from roarquery.retry import RetryPolicy
+from roarquery.retry import use_retry_policy
+from roarquery.utils import run_fuego
+
+
+class FlakyBackend(Backend):
+    """A backend whose first calls fail."""
+
+    def __init__(self, failures: int) -> None:
+        """Fail the first ``failures`` calls."""
+        self.failures = failures
+        self.calls = 0
+
+    def run(self, query: List[str]) -> bytes:
+        """Fail, or return the query."""
+        self.calls += 1
+        if self.calls <= self.failures:
+            raise subprocess.CalledProcessError(1, query)
+        return " ".join(query).encode("utf-8")
+
+
+def test_retry_policy() -> None:
+    """It retries retryable errors after growing, jittered delays."""
+    delays: List[float] = []
+    policy = RetryPolicy(
+        max_attempts=4,
+        base_delay=1.0,
+        max_delay=3.0,
+        rng=random.Random(0),
+        sleep=delays.append,
+    )
+    backend = FlakyBackend(failures=3)
+    assert policy.call(lambda: backend.run(["fuego", "c"])) == b"fuego c"
+    assert backend.calls == 4
+    assert len(delays) == 3
+    for delay, limit in zip(delays, [1.0, 2.0, 3.0]):
+        assert 0 <= delay <= limit
+
+    backend = FlakyBackend(failures=4)
+    with pytest.raises(subprocess.CalledProcessError):
+        policy.call(lambda: backend.run(["fuego", "c"]))
+    assert backend.calls == 4
+
+    def fail() -> bytes:
+        backend.calls += 1
+        raise ValueError("not transient")
+
+    backend.calls = 0
+    with pytest.raises(ValueError):
+        policy.call(fail)
+    assert backend.calls == 1
+
+
+def test_run_fuego_retries() -> None:
+    """It retries failed fuego calls with the active retry policy."""
+    backend = FlakyBackend(failures=2)
+    with use_backend(backend), pytest.raises(subprocess.CalledProcessError):
+        run_fuego(["fuego", "c"])
+
+    metrics = Metrics()
+    policy = RetryPolicy(max_attempts=3, sleep=lambda _: None)
+    backend = FlakyBackend(failures=2)
+    with use_backend(backend), use_retry_policy(policy), use_metrics(metrics):
+        assert run_fuego(["fuego", "c"]) == b"fuego c"
+        assert get_retry_policy() is policy
+
+    assert get_retry_policy() is None
+    assert metrics.counters["fuego retries"] == 2
+    assert metrics.counters["fuego calls"] == 1
+    assert metrics.phases["backoff"][0] == 2
+    assert TransientBackendError in policy.retryable
+
+
+def test_retry_policy_transient_errors() -> None:
+    """It retries transient backend errors but not other backend errors."""
+    policy = RetryPolicy(max_attempts=3, sleep=lambda _: None)
+    calls: List[str] = []
+
+    def fail(error: BackendError) -> bytes:
+        calls.append(type(error).__name__)
+        raise error
+
+    with pytest.raises(TransientBackendError):
+        policy.call(lambda: fail(TransientBackendError("code = Unavailable")))
+    assert calls == ["TransientBackendError"] * 3
+
+    calls.clear()
+    with pytest.raises(BackendError):
+        policy.call(lambda: fail(BackendError("Document users/zz does not exist")))
+    assert calls == ["BackendError"]
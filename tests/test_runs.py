@@ -1,6 +1,14 @@
 """Test cases for the runs module."""
+import asyncio
+import copy
+import time
 from datetime import date
 from datetime import datetime
+from functools import partial
+from pathlib import Path
+from typing import Any
+from typing import Dict
+from typing import List
 from typing import Optional
 from typing import Type
 from typing import Union
@@ -9,17 +17,44 @@ from unittest.mock import patch
 
 import pandas as pd
 import pytest
+from pandas import json_normalize
 
 from .mock_bytes import RUNS
 from .mock_bytes import RUNS_BYTES
 from .mock_bytes import TRIALS_1_BYTES
 from .mock_bytes import TRIALS_4_BYTES
 from .mock_bytes import TRIALS_BYTES
+from roarquery import runs
+from roarquery.backends import BackendError
+from roarquery.backends import LocalBackend
+from roarquery.backends import use_backend
+from roarquery.dtypes import compact_dtypes
+from roarquery.metrics import Metrics
+from roarquery.metrics import use_metrics
+from roarquery.runs import check_trial_conditions
+from roarquery.runs import date_conditions
 from roarquery.runs import filter_run_dates
+from roarquery.runs import get_runs
+from roarquery.runs import get_runs_async
 from roarquery.runs import get_runs_compat
+from roarquery.runs import get_runs_compat_async
+from roarquery.runs import get_runs_iter
 from roarquery.runs import get_trials_from_run
+from roarquery.runs import get_trials_iter
+from roarquery.runs import iter_trials_from_group
 from roarquery.runs import merge_data_with_metadata
+from roarquery.runs import NESTED_RUN_FIELDS
+from roarquery.runs import NoResultsError
+from roarquery.runs import normalize_runs
+from roarquery.runs import rechunk
+from roarquery.shards import date_shards
+from roarquery.shards import fetch_shard
+from roarquery.shards import Shard
 from roarquery.utils import bytes2json
+from roarquery.utils import FetchError
+from roarquery.utils import trim_doc_path
+from roarquery.utils import use_page_size
+from roarquery.writers import CsvWriter
 
 
 @pytest.mark.parametrize("date_or_datetime", [date, datetime])
@@ -41,6 +76,27 @@ def test_filter_run_dates(date_or_datetime: Union[Type[date], Type[datetime]]) -
     filtered = filter_run_dates(RUNS)
     assert filtered == RUNS
 
+    filtered = filter_run_dates(iter([]), started_before=date_or_datetime(2020, 1, 1))
+    assert filtered == []
+
+
+def test_date_conditions(monkeypatch: pytest.MonkeyPatch) -> None:
+    """It sends dates to fuego as UTC timestamps at local midnight."""
+    monkeypatch.setenv("TZ", "America/Los_Angeles")
+    time.tzset()
+    try:
+        assert date_conditions(
+            started_before=date(2024, 2, 1), started_after=date(2024, 1, 1)
+        ) == [
+            "timeStarted >= 2024-01-01T08:00:00Z",
+            "timeStarted < 2024-02-01T08:00:00Z",
+        ]
+    finally:
+        monkeypatch.undo()
+        time.tzset()
+
+    assert date_conditions() == []
+
 
 def test_merge_data_with_metadata() -> None:
     """It merges data with metadata."""
@@ -135,6 +191,7 @@ def test_get_runs(
         call_args.append(f"prod/roar-prod/users/{roar_uid}/runs")
 
     call_args.append('foo == "bar"')
+    call_args.extend(date_conditions(started_before, started_after))
 
     mock_subproc_check_output.assert_called_with(call_args)
 
@@ -144,7 +201,7 @@ def test_get_runs_empty_error(
     mock_subproc_check_output: Mock,
 ) -> None:
     """It returns an error for empty query results."""
-    with pytest.raises(ValueError):
+    with pytest.raises(NoResultsError, match="no results"):
         get_runs_compat(
             query_kwargs=dict(),
         )
@@ -218,3 +275,434 @@ def test_get_runs_and_trials_with_prefix(
     df_trials = df_trials[df_trials.pid.str.contains("aa-")]
 
     assert trials.equals(df_trials)
+
+
+def _fake_fuego(query: List[str]) -> bytes:
+    """Return canned fuego output based on the queried path."""
+    if "prod/roar-prod/users/aa-0001/runs/run-1/trials" in query:
+        return TRIALS_1_BYTES
+    if "prod/roar-prod/users/bb-0001/runs/run-4/trials" in query:
+        return TRIALS_4_BYTES
+    return RUNS_BYTES
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego)
+def test_get_runs_and_trials_concurrently(
+    mock_subproc_check_output: Mock,
+) -> None:
+    """It returns the same trials, in the same order, with a worker pool."""
+    sequential = get_runs_compat(
+        query_kwargs=dict(), return_trials=True, started_before=date(2020, 1, 15)
+    )
+    concurrent = get_runs_compat(
+        query_kwargs=dict(),
+        return_trials=True,
+        started_before=date(2020, 1, 15),
+        max_workers=4,
+    )
+
+    assert concurrent.equals(sequential)
+    assert mock_subproc_check_output.call_count == 6
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego)
+def test_get_runs_and_trials_streaming(
+    mock_subproc_check_output: Mock, tmp_path: Path
+) -> None:
+    """It writes the same trials to disk without materializing them."""
+    expected = get_runs_compat(
+        query_kwargs=dict(), return_trials=True, started_before=date(2020, 1, 15)
+    )
+
+    path = str(tmp_path / "trials.csv")
+    with CsvWriter(path) as writer:
+        df_runs = get_runs_compat(
+            query_kwargs=dict(),
+            return_trials=True,
+            started_before=date(2020, 1, 15),
+            max_workers=2,
+            trials_writer=writer,
+        )
+
+    assert df_runs.index.name == "runId"
+    assert writer.rows_written == len(expected)
+
+    output = pd.read_csv(path, index_col="trialId")
+    expected.to_csv(tmp_path / "expected.csv")
+    expected = pd.read_csv(tmp_path / "expected.csv", index_col="trialId")
+    assert output.equals(expected[output.columns])
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego)
+def test_get_runs_parse_timestamps(mock_subproc_check_output: Mock) -> None:
+    """It returns tz-aware timestamp columns for runs and trials."""
+    expected = get_runs_compat(
+        query_kwargs=dict(), return_trials=True, started_before=date(2020, 1, 15)
+    )
+    trials = get_runs_compat(
+        query_kwargs=dict(),
+        return_trials=True,
+        started_before=date(2020, 1, 15),
+        parse_timestamps=True,
+    )
+
+    for column in ["CreateTime_x", "CreateTime_y", "timeStarted"]:
+        assert str(trials[column].dtype) == "datetime64[ns, UTC]"
+        assert trials[column].equals(pd.to_datetime(expected[column], utc=True))
+
+    runs = get_runs_compat(
+        query_kwargs=dict(), started_before=date(2020, 1, 15), parse_timestamps=True
+    )
+    assert str(runs["timeStarted"].dtype) == "datetime64[ns, UTC]"
+
+
+CURRENT_RUNS = [
+    {
+        "taskId": "swr",
+        "timeStarted": f"2020-01-0{idx}T00:00:00Z",
+        "completed": True,
+        "assigningOrgs": orgs,
+        "scores": scores,
+    }
+    for idx, (orgs, scores) in enumerate(
+        [
+            (
+                {"districts": ["d1"], "schools": ["s1", "s2"]},
+                {"computed": {"composite": 1.5, "subscores": {"a": 1}}},
+            ),
+            ({"schools": ["s3"], "classes": []}, {"raw": {"composite": 2}}),
+            ({"districts": ["d1"]}, {}),
+        ],
+        start=1,
+    )
+]
+
+
+def test_normalize_runs() -> None:
+    """It flattens nested fields like the row-wise expansion it replaced."""
+    runs = [dict(run, runId=f"run-{idx}") for idx, run in enumerate(CURRENT_RUNS)]
+
+    expected = pd.DataFrame(copy.deepcopy(runs)).set_index("runId")
+    expected = pd.concat(
+        [
+            expected.drop(["assigningOrgs", "scores"], axis=1),
+            expected["assigningOrgs"]
+            .apply(partial(pd.Series, dtype="object"))
+            .add_prefix("assigningOrgs."),
+            json_normalize(expected["scores"].tolist())
+            .set_index(expected.index)
+            .add_prefix("scores."),
+        ],
+        axis=1,
+    )
+
+    df = normalize_runs(runs, NESTED_RUN_FIELDS).set_index("runId")
+    assert df.columns.tolist() == expected.columns.tolist()
+    assert df.equals(expected)
+
+
+def test_package_get_runs() -> None:
+    """It exposes get_runs and get_runs_async at the package level on first use."""
+    import roarquery
+
+    assert roarquery.get_runs is get_runs
+    assert roarquery.get_runs_async is get_runs_async
+    assert roarquery.get_trials_iter is get_trials_iter
+    assert "get_runs" in dir(roarquery)
+    with pytest.raises(AttributeError):
+        roarquery.not_a_function
+
+
+def test_get_runs_current() -> None:
+    """It returns runs with flattened orgs and scores and merged users."""
+    backend = LocalBackend()
+    for idx, run in enumerate(CURRENT_RUNS, start=1):
+        uid = "aa-0001" if idx < 3 else "bb-0001"
+        backend.add_document(f"users/{uid}/runs/run-{idx}", copy.deepcopy(run))
+    backend.add_document("users/aa-0001", {"grade": "1", "schools": ["s1"]})
+    backend.add_document("users/bb-0001", {"grade": "2"})
+
+    with use_backend(backend):
+        runs = get_runs(query_kwargs=dict(schoolId="s1"))
+        assert runs.index.tolist() == ["run-1"]
+
+        runs = get_runs(query_kwargs=dict(taskId="swr"))
+
+    assert runs.index.name == "runId"
+    assert runs.index.tolist() == ["run-1", "run-2", "run-3"]
+    assert runs.columns.tolist() == [
+        "taskId",
+        "timeStarted",
+        "completed",
+        "CreateTime",
+        "assigningOrgs.districts",
+        "assigningOrgs.schools",
+        "assigningOrgs.classes",
+        "scores.computed.composite",
+        "scores.computed.subscores.a",
+        "scores.raw.composite",
+        "user.grade",
+        "user.CreateTime",
+        "user.roarUid",
+    ]
+    assert runs["assigningOrgs.schools"].tolist()[:2] == [["s1", "s2"], ["s3"]]
+    assert runs["scores.raw.composite"].fillna(0).tolist() == [0, 2, 0]
+    assert runs["user.grade"].tolist() == ["1", "1", "2"]
+
+
+def test_get_runs_sharded() -> None:
+    """It returns the same runs when the runs query is sharded."""
+    backend = LocalBackend()
+    for idx, run in enumerate(CURRENT_RUNS, start=1):
+        uid = "aa-0001" if idx < 3 else "bb-0001"
+        backend.add_document(f"users/{uid}/runs/run-{idx}", copy.deepcopy(run))
+    backend.add_document("users/aa-0001", {"grade": "1"})
+    backend.add_document("users/bb-0001", {"grade": "2"})
+
+    with use_backend(backend):
+        expected = get_runs()
+        shards = date_shards(date(2019, 12, 31), date(2020, 1, 5), 3)
+        runs = get_runs(shards=shards, max_workers=2)
+
+    assert runs.sort_index().equals(expected)
+
+
+@pytest.fixture
+def legacy_backend() -> LocalBackend:
+    """A local backend holding the mock runs, trials and users."""
+    backend = LocalBackend()
+    for doc in [*RUNS, *bytes2json(TRIALS_1_BYTES), *bytes2json(TRIALS_4_BYTES)]:
+        backend.add_document(
+            doc["Path"], doc["Data"], doc["CreateTime"], doc["UpdateTime"]
+        )
+    for uid in ["aa-0001", "bb-0001"]:
+        backend.add_document(f"prod/roar-prod/users/{uid}", {"name": uid})
+    return backend
+
+
+def test_get_runs_compat_async(legacy_backend: LocalBackend, tmp_path: Path) -> None:
+    """It returns the same runs and trials as get_runs_compat."""
+    kwargs: Any = dict(started_before=date(2020, 1, 15), merge_user_info=True)
+    with use_backend(legacy_backend):
+        expected = get_runs_compat(return_trials=True, **kwargs)
+        trials = asyncio.run(
+            get_runs_compat_async(return_trials=True, max_concurrency=2, **kwargs)
+        )
+        assert trials.equals(expected)
+
+        path = str(tmp_path / "trials.csv")
+        with CsvWriter(path) as writer:
+            runs = asyncio.run(
+                get_runs_compat_async(
+                    return_trials=True, trials_writer=writer, **kwargs
+                )
+            )
+        assert runs.equals(get_runs_compat(**kwargs))
+        assert writer.rows_written == len(expected)
+
+
+def test_get_runs_compat_failed_runs(legacy_backend: LocalBackend) -> None:
+    """It leaves out the runs whose trials cannot be fetched, if asked to."""
+    kwargs: Any = dict(return_trials=True, started_before=date(2020, 1, 15))
+    with use_backend(legacy_backend):
+        expected = get_runs_compat(**kwargs)
+
+    def fail_run_4(run_path: str) -> List[Any]:
+        if run_path.endswith("run-4"):
+            raise RuntimeError("permission denied")
+        return get_trials_from_run(run_path)
+
+    with use_backend(legacy_backend), patch.object(
+        runs, "get_trials_from_run", side_effect=fail_run_4
+    ):
+        with pytest.raises(FetchError) as excinfo:
+            get_runs_compat(**kwargs)
+        assert list(excinfo.value.errors) == ["run-4"]
+
+        failed_runs: Dict[str, Exception] = {}
+        trials = get_runs_compat(failed_runs=failed_runs, max_workers=2, **kwargs)
+        assert list(failed_runs) == ["run-4"]
+        assert trials.equals(expected[expected["runId"] == "run-1"])
+
+
+def test_get_runs_compat_trial_scan(
+    legacy_backend: LocalBackend, tmp_path: Path, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """It fetches the trials of many runs with one collection-group scan."""
+    monkeypatch.setattr(runs, "TRIAL_SCAN_MIN_RUNS", 2)
+    # A trial of a run outside of the date range, which the scan skips.
+    legacy_backend.add_document(
+        "prod/roar-prod/users/aa-0001/runs/run-2/trials/trial-01",
+        {"correct": True, "grade": "KG"},
+    )
+    kwargs: Any = dict(return_trials=True, started_before=date(2020, 1, 15))
+    # Every trial of the mock runs is from kindergarten.
+    conditions = ['grade == "KG"']
+
+    with use_backend(legacy_backend):
+        expected = get_runs_compat(**kwargs)
+
+        metrics = Metrics()
+        with use_metrics(metrics):
+            trials = get_runs_compat(trial_conditions=conditions, **kwargs)
+        assert trials.equals(expected)
+        assert metrics.counters["trials skipped"] == 1
+
+        path = str(tmp_path / "trials.csv")
+        with CsvWriter(path) as writer:
+            get_runs_compat(trial_conditions=conditions, trials_writer=writer, **kwargs)
+        assert writer.rows_written == len(expected)
+
+        # A single run is fetched with a query of its own.
+        monkeypatch.setattr(runs, "TRIAL_SCAN_MIN_RUNS", 3)
+        with patch.object(runs, "iter_trials_from_group") as iter_trials:
+            assert get_runs_compat(trial_conditions=conditions, **kwargs).equals(
+                expected
+            )
+        iter_trials.assert_not_called()
+
+
+def test_iter_trials_from_group(
+    legacy_backend: LocalBackend, monkeypatch: pytest.MonkeyPatch
+) -> None:
+    """It attributes each trial to its run by its path."""
+    monkeypatch.setattr(runs, "TRIAL_SCAN_RUNS_PER_SHARD", 1)
+    run_paths = {run["ID"]: run["Path"] for run in reversed(RUNS)}
+    with use_backend(legacy_backend), use_page_size(2):
+        run_trials = list(
+            iter_trials_from_group(run_paths, ["correct == true"], max_workers=2)
+        )
+        assert [run_id for run_id, _ in run_trials] == ["run-1", "run-4"]
+        for run_id, trials in run_trials:
+            all_trials = get_trials_from_run(run_paths[run_id])
+            assert 0 < len(trials) < len(all_trials)
+            assert trials == [trial for trial in all_trials if trial["correct"]]
+
+        # The scan stops at the trials of the last requested run.
+        metrics = Metrics()
+        with use_metrics(metrics):
+            run_trials = list(
+                iter_trials_from_group(
+                    {"run-1": run_paths["run-1"]}, ["correct == true"]
+                )
+            )
+        assert [run_id for run_id, _ in run_trials] == ["run-1"]
+        assert "trials skipped" not in metrics.counters
+
+        # A failed shard fails the runs whose trials it holds, after the
+        # trials of the other shards.
+        def fetch(query: List[str], shard: Shard, **kwargs: Any) -> Any:
+            if shard.start_after == trim_doc_path(run_paths["run-4"]):
+                raise BackendError("unavailable")
+            return fetch_shard(query, shard, **kwargs)
+
+        run_ids = []
+        with patch.object(runs, "fetch_shard", fetch), pytest.raises(
+            FetchError
+        ) as excinfo:
+            for run_id, _ in iter_trials_from_group(run_paths, ['grade == "KG"']):
+                run_ids.append(run_id)
+        assert run_ids == ["run-1"]
+        assert list(excinfo.value.errors) == ["run-4"]
+
+
+def test_check_trial_conditions() -> None:
+    """It only accepts equality conditions, and at least one of them."""
+    conditions = ['taskId == "swr"', "grade <in> [1, 2]"]
+    assert check_trial_conditions(iter(conditions)) == conditions
+    for conditions, match in [
+        ([], "at least one"),
+        (['taskId == "swr"', "timeStarted >= 2024-01-01T00:00:00Z"], "equality"),
+        (["correct != true"], "equality"),
+        (["taskId swr"], "Cannot parse"),
+    ]:
+        with pytest.raises(ValueError, match=match):
+            check_trial_conditions(conditions)
+
+    with pytest.raises(ValueError, match="at least one"):
+        get_runs_compat(return_trials=True, trial_conditions=[])
+
+
+def test_rechunk() -> None:
+    """It regroups frames into equal chunks whose columns only grow."""
+    frames = [
+        pd.DataFrame({"a": [1, 2, 3]}),
+        pd.DataFrame({"b": [4, 5]}),
+        pd.DataFrame({"c": [6], "a": [7]}),
+    ]
+    chunks = list(rechunk(frames, 2))
+    assert [len(chunk) for chunk in chunks] == [2, 2, 2]
+    assert [chunk.columns.tolist() for chunk in chunks] == [
+        ["a"],
+        ["a", "b"],
+        ["a", "b", "c"],
+    ]
+    assert pd.concat(chunks)["a"].fillna(0).tolist() == [1, 2, 3, 0, 0, 7]
+
+    chunks = list(rechunk(frames, 4, columns=["c", "b"]))
+    assert [chunk.columns.tolist() for chunk in chunks] == [["c", "b"]] * 2
+    assert list(rechunk([], 2)) == []
+
+
+def test_get_runs_iter() -> None:
+    """It returns the same runs and trials as get_runs, a chunk at a time."""
+    backend = LocalBackend()
+    for idx, run in enumerate(CURRENT_RUNS, start=1):
+        uid = "aa-0001" if idx < 3 else "bb-0001"
+        backend.add_document(f"users/{uid}/runs/run-{idx}", copy.deepcopy(run))
+        for trial_idx in range(idx):
+            backend.add_document(
+                f"users/{uid}/runs/run-{idx}/trials/t-{idx}-{trial_idx}", {"rt": idx}
+            )
+    backend.add_document("users/aa-0001", {"grade": "1", "schools": ["s1"]})
+    backend.add_document("users/bb-0001", {"grade": "2"})
+
+    with use_backend(backend), use_page_size(1):
+        expected = get_runs()
+        chunks = list(get_runs_iter(chunk_size=2))
+        assert [len(chunk) for chunk in chunks] == [2, 1]
+        assert pd.concat(chunks).equals(expected)
+
+        expected = get_runs(return_trials=True)
+        chunks = list(get_trials_iter(chunk_size=4, run_chunk_size=2))
+        assert [len(chunk) for chunk in chunks] == [4, 2]
+        columns = chunks[0].columns.tolist()
+        assert chunks[1].columns.tolist()[: len(columns)] == columns
+        pd.testing.assert_frame_equal(
+            pd.concat(chunks), expected, check_like=True, check_dtype=False
+        )
+
+        chunks = list(get_trials_iter(run_chunk_size=1, columns=["rt", "taskId"]))
+        assert chunks[0].columns.tolist() == ["rt", "taskId"]
+        assert chunks[0]["rt"].tolist() == [1, 2, 2, 3, 3, 3]
+
+        assert list(get_runs_iter(query_kwargs=dict(taskId="none"))) == []
+
+        compacted = get_runs(compact=True)
+        assert compacted["taskId"].dtype == "category"
+        assert compacted.equals(compact_dtypes(get_runs()))
+
+        chunks = list(get_trials_iter(chunk_size=4, compact=True))
+        assert chunks[0]["rt"].dtype == "Int64"
+        assert chunks[1].dtypes.equals(chunks[0].dtypes)
+        assert pd.concat(chunks).dtypes.equals(chunks[0].dtypes)
+
+
+def test_get_runs_async() -> None:
+    """It returns the same runs and trials as get_runs."""
+    backend = LocalBackend()
+    for idx, run in enumerate(CURRENT_RUNS, start=1):
+        uid = "aa-0001" if idx < 3 else "bb-0001"
+        backend.add_document(f"users/{uid}/runs/run-{idx}", copy.deepcopy(run))
+        backend.add_document(f"users/{uid}/runs/run-{idx}/trials/t-{idx}", {"rt": idx})
+    backend.add_document("users/aa-0001", {"grade": "1", "schools": ["s1"]})
+    backend.add_document("users/bb-0001", {"grade": "2"})
+
+    with use_backend(backend):
+        for return_trials in [False, True]:
+            expected = get_runs(return_trials=return_trials)
+            runs = asyncio.run(get_runs_async(return_trials=return_trials))
+            assert runs.equals(expected)
+
+        with pytest.raises(ValueError, match="user_type"):
+            asyncio.run(get_runs_async(user_type="admins"))
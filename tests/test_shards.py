@@ -0,0 +1,139 @@
+"""Test cases for the shards module."""
+from datetime import date
+from datetime import datetime
+from datetime import timezone
+from typing import List
+
+import pytest
+
+from roarquery.backends import format_timestamp
+from roarquery.backends import LocalBackend
+from roarquery.backends import use_backend
+from roarquery.shards import date_shards
+from roarquery.shards import fetch_shard
+from roarquery.shards import iter_sharded_records
+from roarquery.shards import make_shards
+from roarquery.shards import path_shards
+from roarquery.shards import Shard
+from roarquery.shards import value_shards
+from roarquery.utils import page_results
+from roarquery.utils import use_page_size
+
+
+QUERY = ["fuego", "query", "-g", "runs"]
+TASKS = ["swr", "sre", "pa"]
+
+
+@pytest.fixture
+def backend() -> LocalBackend:
+    """A local backend holding 30 runs of 5 users."""
+    backend = LocalBackend()
+    for idx in range(30):
+        timestamp = format_timestamp(datetime(2024, 1, idx + 1, tzinfo=timezone.utc))
+        backend.add_document(
+            f"users/user-{idx % 5}/runs/run-{idx:02d}",
+            {"taskId": TASKS[idx % 3], "timeStarted": timestamp},
+        )
+    return backend
+
+
+def _paths(shards: List[Shard], max_workers: int = 3) -> List[str]:
+    return [
+        record.path
+        for record in iter_sharded_records(QUERY, shards, max_workers=max_workers)
+    ]
+
+
+def test_shard_apply() -> None:
+    """It adds the shard's conditions and start to the query."""
+    shard = Shard(["taskId == swr"], start_after="users/a/runs/r", end_at="users/b")
+    assert shard.apply(QUERY) == [
+        "fuego",
+        "query",
+        "--startafter",
+        "users/a/runs/r",
+        "-g",
+        "runs",
+        "taskId == swr",
+    ]
+    assert not shard.past_end("users/a-b/runs/r")
+    assert shard.past_end("users/b/runs/r")
+    assert not Shard().past_end("users/b/runs/r")
+
+
+def test_sharded_records(backend: LocalBackend) -> None:
+    """Each kind of shard returns every run exactly once."""
+    with use_backend(backend):
+        expected = sorted(doc["Path"] for doc in page_results(QUERY))
+        assert len(expected) == 30
+
+        with use_page_size(2):
+            boundaries = ["users/user-1/runs/run-06", "users/user-3/runs/run-28"]
+            for shards in [
+                date_shards(date(2023, 12, 1), date(2024, 3, 1), 4),
+                value_shards("taskId", TASKS),
+                path_shards(boundaries),
+            ]:
+                assert sorted(_paths(shards)) == expected
+                # The shards do not overlap.
+                assert sum(len(fetch_shard(QUERY, shard)) for shard in shards) == 30
+
+            # Runs in more than one shard are returned once.
+            overlapping = [*value_shards("taskId", ["swr"]), Shard(), Shard()]
+            assert sorted(_paths(overlapping, max_workers=1)) == expected
+
+            paths = _paths(path_shards(reversed(boundaries)))
+            assert paths == expected
+
+
+def test_path_shards_hyphenated_ids() -> None:
+    """Path shards keep documents whose IDs extend a boundary's ID."""
+    backend = LocalBackend()
+    expected = ["users/a/runs/r", "users/a-b/runs/r", "users/b/runs/r"]
+    for path in reversed(expected):
+        backend.add_document(path, {"taskId": "swr"})
+
+    with use_backend(backend), use_page_size(1):
+        # Documents come in Firestore's order, one path segment at a time.
+        assert [doc["Path"] for doc in page_results(QUERY)] == expected
+        shards = path_shards(["users/a/runs/r"])
+        assert [
+            [record.path for record in fetch_shard(QUERY, shard)] for shard in shards
+        ] == [expected[:1], expected[1:]]
+        assert _paths(shards) == expected
+
+        with pytest.raises(ValueError, match="timeStarted >="):
+            list(
+                iter_sharded_records(
+                    [*QUERY, "timeStarted >= 2024-01-01T00:00:00Z"], shards
+                )
+            )
+
+
+def test_date_shards() -> None:
+    """It splits a date range into equal windows."""
+    start = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    shards = date_shards(start, datetime(2024, 1, 3, tzinfo=timezone.utc), 2)
+    assert [shard.conditions for shard in shards] == [
+        ["timeStarted >= 2024-01-01T00:00:00Z", "timeStarted < 2024-01-02T00:00:00Z"],
+        ["timeStarted >= 2024-01-02T00:00:00Z", "timeStarted < 2024-01-03T00:00:00Z"],
+    ]
+
+    with pytest.raises(ValueError, match="non-empty range"):
+        date_shards(start, start, 2)
+
+
+def test_make_shards() -> None:
+    """It creates shards from their description."""
+    shards = make_shards("date:3", date(2024, 1, 1), date(2024, 2, 1))
+    assert len(shards) == 3
+    assert make_shards("task:swr, pa")[1].conditions == ['taskId == "pa"']
+    assert len(make_shards("path:users/a/runs/r")) == 2
+
+    with pytest.raises(ValueError, match="start and an end"):
+        make_shards("date:3", started_after=date(2024, 1, 1))
+    with pytest.raises(ValueError, match="date range"):
+        make_shards("path:users/a/runs/r", started_before=date(2024, 1, 1))
+    for spec in ["date:x", "task:", "user:a"]:
+        with pytest.raises(ValueError, match="Unknown shards"):
+            make_shards(spec)
@@ -0,0 +1,182 @@
+"""Test cases for the sync module."""
+import json
+import subprocess
+from datetime import date
+from pathlib import Path
+from typing import Dict
+from typing import List
+from unittest.mock import Mock
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from .mock_bytes import RUNS
+from .mock_bytes import RUNS_BYTES
+from .mock_bytes import TRIALS_1_BYTES
+from .mock_bytes import TRIALS_4_BYTES
+from roarquery.runs import date_conditions
+from roarquery.runs import NoResultsError
+from roarquery.sync import load_state
+from roarquery.sync import merge_exports
+from roarquery.sync import query_key
+from roarquery.sync import sync_runs
+from roarquery.sync import WatermarkFilter
+from roarquery.writers import read_export
+
+
+UPDATED_RUNS_BYTES = RUNS_BYTES.replace(
+    b'"Path": "prod/roar-prod/users/bb-0001/runs/run-4",\n'
+    b'    "ReadTime": "2020-01-01T00:00:00.000Z",\n'
+    b'    "UpdateTime": "2020-01-01T00:00:00.000Z"',
+    b'"Path": "prod/roar-prod/users/bb-0001/runs/run-4",\n'
+    b'    "ReadTime": "2020-01-01T00:00:00.000Z",\n'
+    b'    "UpdateTime": "2020-06-01T00:00:00.000Z"',
+)
+
+
+class FakeFuego:
+    """Serve canned runs and trials, recording each queried path."""
+
+    def __init__(self) -> None:
+        """Initialize with the original runs."""
+        self.runs_bytes = RUNS_BYTES
+        self.queried: List[str] = []
+
+    def __call__(self, query: List[str]) -> bytes:
+        """Return canned fuego output based on the queried path."""
+        self.queried.append(query[-1])
+        if query[-1].endswith("run-1/trials"):
+            return TRIALS_1_BYTES
+        if query[-1].endswith("run-4/trials"):
+            return TRIALS_4_BYTES
+        return self.runs_bytes
+
+
+def test_query_key() -> None:
+    """It builds a stable key from the query parameters."""
+    assert query_key(b=1, a=date(2020, 1, 1)) == '{"a": "2020-01-01", "b": 1}'
+
+
+def test_watermark_filter() -> None:
+    """It keeps changed runs and tracks the newest UpdateTime."""
+    run_filter = WatermarkFilter()
+    assert run_filter(RUNS) == RUNS
+    assert run_filter.max_update_time == "2020-03-01T00:00:00.000Z"
+
+    run_filter = WatermarkFilter("2020-02-15T00:00:00Z")
+    assert run_filter(RUNS) == [RUNS[2], RUNS[5]]
+    assert (run_filter.seen, run_filter.kept) == (6, 2)
+
+    started_late = dict(RUNS[0], Data={"timeStarted": "2020-03-01T00:00:00Z"})
+    not_started = dict(RUNS[0], Data={})
+    assert run_filter([started_late, not_started]) == [  # type: ignore[list-item]
+        started_late
+    ]
+
+
+def test_merge_exports() -> None:
+    """It replaces every row belonging to a changed run."""
+    previous = pd.DataFrame(
+        {"runId": ["r1", "r1", "r2"], "x": [1, 2, 3]},
+        index=pd.Index(["t1", "t2", "t3"], name="trialId"),
+    )
+    changed = pd.DataFrame(
+        {"runId": ["r1"], "x": [4]}, index=pd.Index(["t1"], name="trialId")
+    )
+    merged = merge_exports(previous, changed)
+    assert merged["x"].to_dict() == {"t3": 3, "t1": 4}
+
+    previous_runs = previous.drop_duplicates("runId").set_index("runId")
+    changed_runs = changed.set_index("runId")
+    assert merge_exports(previous_runs, changed_runs)["x"].to_dict() == {
+        "r2": 3,
+        "r1": 4,
+    }
+
+
+@pytest.mark.parametrize("filename", ["trials.csv", "trials.parquet"])
+def test_sync_runs(tmp_path: Path, filename: str) -> None:
+    """It fetches trials only for runs that changed since the last sync."""
+    fake_fuego = FakeFuego()
+    output = str(tmp_path / filename)
+    kwargs = dict(
+        legacy=True,
+        return_trials=True,
+        query_kwargs=dict(taskId="swr"),
+        started_before=date(2020, 1, 15),
+    )
+
+    with patch("subprocess.check_output", side_effect=fake_fuego):
+        first = sync_runs(output, **kwargs)  # type: ignore[arg-type]
+        assert len(first) == 12
+        assert fake_fuego.queried[1:] == [
+            "prod/roar-prod/users/aa-0001/runs/run-1/trials",
+            "prod/roar-prod/users/bb-0001/runs/run-4/trials",
+        ]
+        state = load_state(f"{output}.sync.json")
+        assert [value["UpdateTime"] for value in state.values()] == [
+            "2020-01-01T00:00:00.000Z"
+        ]
+
+        fake_fuego.queried = []
+        second = sync_runs(output, **kwargs)  # type: ignore[arg-type]
+        assert fake_fuego.queried == date_conditions(started_before=date(2020, 1, 15))
+        assert len(second) == 12
+
+        fake_fuego.queried = []
+        fake_fuego.runs_bytes = UPDATED_RUNS_BYTES
+        third = sync_runs(output, **kwargs)  # type: ignore[arg-type]
+        assert fake_fuego.queried[1:] == [
+            "prod/roar-prod/users/bb-0001/runs/run-4/trials"
+        ]
+        assert sorted(third.index) == sorted(first.index)
+        assert (third["runId"] == "run-4").sum() == 6
+
+    state = json.loads(Path(f"{output}.sync.json").read_text())
+    assert [value["UpdateTime"] for value in state.values()] == [
+        "2020-06-01T00:00:00.000Z"
+    ]
+    assert read_export(output).shape == third.shape
+
+
+def test_sync_runs_failed_runs(tmp_path: Path) -> None:
+    """It keeps the watermark when runs are skipped, so they are synced later."""
+
+    class FailingFuego(FakeFuego):
+        fail = True
+
+        def __call__(self, query: List[str]) -> bytes:
+            if self.fail and query[-1].endswith("run-1/trials"):
+                raise subprocess.CalledProcessError(1, query, b"rpc error")
+            return super().__call__(query)
+
+    fake_fuego = FailingFuego()
+    output = str(tmp_path / "trials.csv")
+    kwargs = dict(
+        legacy=True,
+        return_trials=True,
+        started_before=date(2020, 1, 15),
+    )
+
+    with patch("subprocess.check_output", side_effect=fake_fuego):
+        failed_runs: Dict[str, Exception] = {}
+        first = sync_runs(output, failed_runs=failed_runs, **kwargs)  # type: ignore
+        assert list(failed_runs) == ["run-1"]
+        assert set(first["runId"]) == {"run-4"}
+        assert load_state(f"{output}.sync.json") == {}
+
+        fake_fuego.fail = False
+        fake_fuego.queried = []
+        second = sync_runs(output, failed_runs={}, **kwargs)  # type: ignore
+        assert "prod/roar-prod/users/aa-0001/runs/run-1/trials" in fake_fuego.queried
+        assert set(second["runId"]) == {"run-1", "run-4"}
+        assert len(second) == 12
+        assert load_state(f"{output}.sync.json")
+
+
+@patch("subprocess.check_output", return_value=b"")
+def test_sync_runs_empty_error(mock_subproc_check_output: Mock, tmp_path: Path) -> None:
+    """It raises an error when the query returns nothing."""
+    with pytest.raises(NoResultsError):
+        sync_runs(str(tmp_path / "runs.csv"), legacy=True)
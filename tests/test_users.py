@@ -0,0 +1,128 @@
+"""Test cases for the users module."""
+import json
+import os
+from pathlib import Path
+from typing import List
+from unittest.mock import Mock
+from unittest.mock import patch
+
+from roarquery.runs import get_user_from_run
+from roarquery.users import fetch_user
+from roarquery.users import split_run_path
+from roarquery.users import UserResolver
+
+
+def _fake_fuego_get(query: List[str]) -> bytes:
+    """Return a user document for ``fuego get <collection> <uid>``."""
+    collection, uid = query[-2:]
+    return json.dumps(
+        {
+            "CreateTime": "2022-01-01T00:00:00Z",
+            "Data": {"grade": "KG", "schools": ["s1"], "name": uid},
+            "ID": uid,
+            "Path": f"prod/roar-prod/{collection}/{uid}",
+            "ReadTime": "2022-05-17T11:58:49.966593Z",
+            "UpdateTime": "2022-01-01T00:00:00Z",
+        }
+    ).encode("utf-8")
+
+
+RUN_PATHS = [
+    "databases/(default)/documents/users/aa-0001/runs/run-1",
+    "databases/(default)/documents/users/aa-0001/runs/run-2",
+    "databases/(default)/documents/users/bb-0001/runs/run-3",
+    "databases/(default)/documents/users/aa-0001/runs/run-4",
+]
+
+
+def test_split_run_path() -> None:
+    """It splits a run path into the user path and run ID."""
+    assert split_run_path(RUN_PATHS[2]) == ("users/bb-0001", "run-3")
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego_get)
+def test_fetch_user(mock_subproc_check_output: Mock) -> None:
+    """It fetches a single user document."""
+    user = fetch_user("users/aa-0001")
+    assert user["ID"] == "aa-0001"
+    mock_subproc_check_output.assert_called_once_with(
+        ["fuego", "get", "users", "aa-0001"]
+    )
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego_get)
+def test_get_user_from_run(mock_subproc_check_output: Mock) -> None:
+    """It returns the user info for a run, with or without a resolver."""
+    expected = {
+        "grade": "KG",
+        "name": "aa-0001",
+        "CreateTime": "2022-01-01T00:00:00Z",
+        "PID": "aa-0001",
+        "runId": "run-1",
+    }
+    assert get_user_from_run(RUN_PATHS[0], legacy=True) == expected
+
+    resolver = UserResolver()
+    assert get_user_from_run(RUN_PATHS[0], legacy=True, resolver=resolver) == expected
+    assert get_user_from_run(RUN_PATHS[0], legacy=True, resolver=resolver) == expected
+    assert mock_subproc_check_output.call_count == 2
+    assert resolver.stats() == {"hits": 1, "misses": 1, "size": 1}
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego_get)
+def test_get_users_from_runs(mock_subproc_check_output: Mock) -> None:
+    """It fetches each user only once and preserves run order."""
+    resolver = UserResolver()
+    users = resolver.get_users_from_runs(RUN_PATHS, max_workers=2)
+
+    assert [user["runId"] for user in users] == ["run-1", "run-2", "run-3", "run-4"]
+    assert [user["roarUid"] for user in users] == [
+        "aa-0001",
+        "aa-0001",
+        "bb-0001",
+        "aa-0001",
+    ]
+    assert all("schools" not in user for user in users)
+    assert mock_subproc_check_output.call_count == 2
+    assert (resolver.hits, resolver.misses) == (2, 2)
+
+    resolver.get_users_from_runs(RUN_PATHS)
+    assert mock_subproc_check_output.call_count == 2
+    assert (resolver.hits, resolver.misses) == (6, 2)
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego_get)
+def test_user_resolver_lru(mock_subproc_check_output: Mock) -> None:
+    """It evicts the least recently used user documents."""
+    resolver = UserResolver(max_size=1)
+    resolver.get_user("users/aa-0001")
+    resolver.get_user("users/bb-0001")
+    assert len(resolver) == 1
+
+    resolver.get_user("users/aa-0001")
+    assert mock_subproc_check_output.call_count == 3
+
+
+@patch("subprocess.check_output", side_effect=_fake_fuego_get)
+def test_user_resolver_persistence(
+    mock_subproc_check_output: Mock, tmp_path: Path
+) -> None:
+    """It persists user documents to disk and honors the TTL."""
+    cache_path = str(tmp_path / "cache" / "users.json")
+    resolver = UserResolver(cache_path=cache_path)
+    resolver.get_users_from_runs(RUN_PATHS)
+    resolver.save()
+    assert os.path.exists(cache_path)
+    assert mock_subproc_check_output.call_count == 2
+
+    reloaded = UserResolver(cache_path=cache_path)
+    reloaded.get_users_from_runs(RUN_PATHS)
+    assert mock_subproc_check_output.call_count == 2
+    assert reloaded.misses == 0
+
+    expired = UserResolver(cache_path=cache_path, ttl=0)
+    assert len(expired) == 0
+    expired.get_users_from_runs(RUN_PATHS)
+    assert mock_subproc_check_output.call_count == 4
+
+    UserResolver().save()
@@ -1,15 +1,29 @@
 """Test cases for the utils module."""
+import time
+from typing import List
 from typing import Optional
 from unittest.mock import Mock
 from unittest.mock import patch
 
 import pytest
 
+from roarquery.backends import LocalBackend
+from roarquery.backends import use_backend
 from roarquery.utils import bytes2json
 from roarquery.utils import camel_case
 from roarquery.utils import drop_empty
+from roarquery.utils import FetchError
+from roarquery.utils import FuegoRecord
+from roarquery.utils import get_page_size
+from roarquery.utils import iter_concurrently
+from roarquery.utils import iter_pages
+from roarquery.utils import iter_records
+from roarquery.utils import iter_results
+from roarquery.utils import map_concurrently
 from roarquery.utils import page_results
+from roarquery.utils import PageSizer
 from roarquery.utils import trim_doc_path
+from roarquery.utils import use_page_size
 
 
 def test_bytes2json() -> None:
@@ -186,3 +200,161 @@ def test_page_results(mock_subproc_check_output: Mock, limit: Optional[int]) ->
                 'classId=="c1"',
             ]
         )
+
+
+def _slow_square(x: int) -> int:
+    """Square a number, finishing earlier items last."""
+    time.sleep(0.01 * (5 - x))
+    if x == 3:
+        raise RuntimeError("boom")
+    return x * x
+
+
+@pytest.mark.parametrize("max_workers", [1, 4])
+def test_iter_concurrently(max_workers: int) -> None:
+    """It yields results in input order and isolates per-item errors."""
+    items = {f"item-{x}": x for x in range(5)}
+    results = []
+    with pytest.raises(FetchError) as excinfo:
+        for key, result in iter_concurrently(
+            _slow_square, items, max_workers=max_workers, desc="Testing"
+        ):
+            results.append((key, result))
+
+    assert results == [("item-0", 0), ("item-1", 1), ("item-2", 4), ("item-4", 16)]
+    assert list(excinfo.value.errors.keys()) == ["item-3"]
+    assert isinstance(excinfo.value.errors["item-3"], RuntimeError)
+
+
+def test_map_concurrently() -> None:
+    """It collects results and attaches partial results to errors."""
+    items = {f"item-{x}": x for x in range(3)}
+    assert map_concurrently(_slow_square, items, max_workers=3) == {
+        "item-0": 0,
+        "item-1": 1,
+        "item-2": 4,
+    }
+
+    items["item-3"] = 3
+    with pytest.raises(FetchError) as excinfo:
+        map_concurrently(_slow_square, items, max_workers=2)
+
+    assert excinfo.value.results == {"item-0": 0, "item-1": 1, "item-2": 4}
+
+
+@patch("subprocess.check_output", side_effect=SIDE_EFFECT)
+def test_iter_pages(mock_subproc_check_output: Mock) -> None:
+    """It runs each fuego call only when the next page is requested."""
+    query = ["fuego", "query", "prod/roar-prod/users/aa-0001/runs"]
+    pages = iter_pages(query, limit=1)
+    mock_subproc_check_output.assert_not_called()
+
+    first_page = next(pages)
+    assert first_page == bytes2json(SIDE_EFFECT[0])
+    mock_subproc_check_output.assert_called_once()
+
+    remaining = list(pages)
+    assert len(remaining) == 3
+    assert mock_subproc_check_output.call_count == 5
+    assert query == ["fuego", "query", "prod/roar-prod/users/aa-0001/runs"]
+
+
+@patch("subprocess.check_output", side_effect=SIDE_EFFECT)
+def test_iter_results(mock_subproc_check_output: Mock) -> None:
+    """It yields documents one at a time across pages."""
+    results = iter_results(["fuego", "query", "users/aa-0001/runs"], limit=1)
+    assert [result["ID"] for result in results] == [
+        f"test-id-{idx}" for idx in range(4)
+    ]
+
+
+@patch("subprocess.check_output", side_effect=SIDE_EFFECT)
+def test_iter_records(mock_subproc_check_output: Mock) -> None:
+    """It yields compact records that can be indexed like fuego dicts."""
+    records = list(
+        iter_records(
+            ["fuego", "query", "users/aa-0001/runs"],
+            drop=["ReadTime", "UpdateTime"],
+            limit=1,
+        )
+    )
+    expected = [bytes2json(result)[0] for result in drop_empty(SIDE_EFFECT)]
+    assert [record["ID"] for record in records] == [doc["ID"] for doc in expected]
+    for record, doc in zip(records, expected):
+        assert record["Path"] == record.path == doc["Path"]
+        assert record["Data"] is record.data
+        assert record["CreateTime"] == doc["CreateTime"]
+        assert record.get("UpdateTime") is None
+        with pytest.raises(KeyError):
+            record["ReadTime"]
+        assert record.to_json() == {
+            key: value
+            for key, value in doc.items()
+            if key not in ["ReadTime", "UpdateTime"]
+        }
+
+
+def test_fuego_record_path() -> None:
+    """It shares the parent path between records and keeps unusual paths."""
+    first = FuegoRecord("t1", "users/aa/runs/r1/trials/t1", {})
+    second = FuegoRecord("t2", "users/aa/runs/r1/trials/t2", {})
+    assert first._parent is second._parent
+    assert FuegoRecord("t1", "users/aa/t1x", {}).path == "users/aa/t1x"
+    assert not hasattr(first, "__dict__")
+
+
+def test_page_sizer() -> None:
+    """It grows after fast, small, full pages and shrinks after slow or big ones."""
+    sizer = PageSizer(100, max_page_size=1000, target_seconds=2, target_bytes=1000)
+    assert sizer.update(100, seconds=0.1, n_bytes=100) == 200
+    assert sizer.update(50, seconds=0.1, n_bytes=100) == 200
+    assert sizer.update(200, seconds=1.5, n_bytes=100) == 200
+    assert [sizer.update(1000, seconds=0.1, n_bytes=100) for _ in range(3)] == [
+        400,
+        800,
+        1000,
+    ]
+    assert sizer.update(1000, seconds=3, n_bytes=100) == 500
+    assert sizer.update(500, seconds=0.1, n_bytes=2000) == 250
+
+    assert PageSizer(20, max_page_size=20, min_page_size=10).update(20, 5, 0) == 10
+
+
+def test_page_sizer_fixed() -> None:
+    """It keeps the page size fixed without a maximum page size."""
+    sizer = PageSizer(100, target_seconds=2, target_bytes=1000)
+    assert [
+        sizer.update(100, seconds, n_bytes)
+        for seconds, n_bytes in [
+            (0.1, 100),
+            (3, 100),
+            (0.1, 2000),
+            (3, 2000),
+        ]
+    ] == [100] * 4
+
+
+def test_iter_pages_adaptive() -> None:
+    """It cuts the number of round-trips on big scans."""
+    backend = LocalBackend()
+    for idx in range(3000):
+        backend.add_document(f"users/u/runs/run-{idx:04d}", {"idx": idx})
+
+    limits: List[str] = []
+
+    def run(query: List[str]) -> bytes:
+        limits.append(query[query.index("--limit") + 1])
+        return LocalBackend.run(backend, query)
+
+    query = ["fuego", "query", "users/u/runs"]
+    with use_backend(backend), patch.object(backend, "run", side_effect=run):
+        assert len(page_results(query)) == 3000
+        assert len(limits) == 31
+
+        limits.clear()
+        with use_page_size(100, max_page_size=1000):
+            results = page_results(query)
+
+    assert [result["Data"]["idx"] for result in results] == list(range(3000))
+    assert limits == ["100", "200", "400", "800", "1000", "1000"]
+    assert get_page_size() == (100, None)
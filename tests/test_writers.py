@@ -0,0 +1,152 @@
+"""Test cases for the writers module."""
+from pathlib import Path
+
+import pandas as pd
+import pytest
+
+from roarquery.writers import ArrowWriter
+from roarquery.writers import ChunkWriter
+from roarquery.writers import CsvWriter
+from roarquery.writers import FeatherWriter
+from roarquery.writers import infer_format
+from roarquery.writers import open_writer
+from roarquery.writers import ParquetWriter
+from roarquery.writers import read_export
+
+
+def test_csv_writer(tmp_path: Path) -> None:
+    """It appends chunks and reconciles columns that appear late."""
+    path = str(tmp_path / "out.csv")
+    chunks = [
+        pd.DataFrame({"a": [1, 2], "b": ["x", "y"]}, index=["t1", "t2"]),
+        pd.DataFrame({"b": ["z"], "c": [True]}, index=["t3"]),
+        pd.DataFrame({"a": [4], "b": ['with "quotes", commas']}, index=["t4"]),
+    ]
+    for chunk in chunks:
+        chunk.index.name = "trialId"
+
+    with CsvWriter(path) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+    assert writer.columns == ["a", "b", "c"]
+    assert writer.rows_written == 4
+
+    output = pd.read_csv(path, index_col="trialId")
+    expected = pd.concat(chunks)
+    assert output.index.tolist() == ["t1", "t2", "t3", "t4"]
+    assert output["b"].tolist() == expected["b"].tolist()
+    assert output["a"].fillna(-1).tolist() == [1, 2, -1, 4]
+    assert output["c"].tolist()[2] is True
+
+
+def test_csv_writer_without_new_columns(tmp_path: Path) -> None:
+    """It leaves the file alone when the columns never change."""
+    path = tmp_path / "out.csv"
+    with CsvWriter(str(path)) as writer:
+        writer.write(pd.DataFrame({"a": [1]}, index=pd.Index(["t1"], name="id")))
+        writer.write(pd.DataFrame({"a": [2]}, index=pd.Index(["t2"], name="id")))
+
+    assert path.read_text().splitlines() == ["id,a", "t1,1", "t2,2"]
+
+
+def test_csv_writer_empty(tmp_path: Path) -> None:
+    """It leaves an empty file when nothing was written."""
+    path = tmp_path / "out.csv"
+    CsvWriter(str(path)).close()
+    assert path.read_text() == ""
+
+
+def test_infer_format() -> None:
+    """It infers the format from the extension unless one is given."""
+    assert infer_format("trials.PARQUET") == "parquet"
+    assert infer_format("trials.feather") == "feather"
+    assert infer_format("trials.csv") == "csv"
+    assert infer_format("trials.parquet", "csv") == "csv"
+    with pytest.raises(ValueError):
+        infer_format("trials.csv", "xlsx")
+
+    assert isinstance(open_writer(str(Path("x.csv"))), CsvWriter)
+
+
+@pytest.mark.parametrize("writer_class", [ParquetWriter, FeatherWriter])
+def test_arrow_writer(tmp_path: Path, writer_class: type) -> None:
+    """It writes row groups with unified columns and preserved dtypes."""
+    suffix = ".parquet" if writer_class is ParquetWriter else ".feather"
+    path = str(tmp_path / f"out{suffix}")
+    chunks = [
+        pd.DataFrame(
+            {
+                "taskId": ["swr", "swr"],
+                "timeStarted": ["2022-01-01T00:00:00Z", "2022-01-02T00:00:00Z"],
+                "a": [None, None],
+            },
+            index=["t1", "t2"],
+        ),
+        pd.DataFrame(
+            {"taskId": ["pa"], "a": [1.5], "correct": [True], "b": [{"x": 1}]},
+            index=["t3"],
+        ),
+        pd.DataFrame(
+            {"taskId": ["swr"], "correct": ["false"], "b": ["plain"]}, index=["t4"]
+        ),
+    ]
+    for chunk in chunks:
+        chunk.index.name = "trialId"
+
+    with writer_class(path, row_group_size=2) as writer:
+        for chunk in chunks:
+            writer.write(chunk)
+
+    assert writer.rows_written == 4
+    assert [p.name for p in tmp_path.iterdir()] == [f"out{suffix}"]
+
+    output = read_export(path)
+    assert output.index.tolist() == ["t1", "t2", "t3", "t4"]
+    assert output.columns.tolist() == ["taskId", "timeStarted", "a", "correct", "b"]
+    assert output["taskId"].dtype == "category"
+    assert output["taskId"].tolist() == ["swr", "swr", "pa", "swr"]
+    assert str(output["timeStarted"].dtype) == "datetime64[ns, UTC]"
+    assert output["timeStarted"].isna().tolist() == [False, False, True, True]
+    assert output["a"].fillna(-1).tolist() == [-1, -1, 1.5, -1]
+    assert output["correct"].tolist()[2:] == [True, False]
+    assert output["b"].tolist()[2:] == ['{"x": 1}', "plain"]
+
+
+def test_arrow_writer_empty(tmp_path: Path) -> None:
+    """It writes a valid file when nothing was written."""
+    path = str(tmp_path / "out.parquet")
+    ParquetWriter(path).close()
+    assert pd.read_parquet(path).empty
+
+
+def test_writer_base_classes(tmp_path: Path) -> None:
+    """It requires subclasses to implement the format-specific methods."""
+
+    class IncompleteWriter(ArrowWriter):
+        pass
+
+    with pytest.raises(TypeError, match="_finish"):
+        ChunkWriter(str(tmp_path / "out"))  # type: ignore[abstract]
+    with pytest.raises(TypeError, match="_open"):
+        IncompleteWriter(str(tmp_path / "out"))  # type: ignore[abstract]
+
+
+@pytest.mark.parametrize("filename", ["out.csv", "out.parquet", "out.feather"])
+def test_writer_failure(tmp_path: Path, filename: str) -> None:
+    """It leaves the previous output alone when the export fails."""
+    path = tmp_path / filename
+    path.write_text("previous export")
+    with pytest.raises(RuntimeError, match="interrupted"):
+        with open_writer(str(path)) as writer:
+            writer.write(pd.DataFrame({"a": [1]}, index=pd.Index(["t1"], name="id")))
+            writer.write(pd.DataFrame({"b": [2]}, index=pd.Index(["t2"], name="id")))
+            raise RuntimeError("interrupted")
+
+    assert path.read_text() == "previous export"
+    assert [child.name for child in tmp_path.iterdir()] == [filename]
+
+    with open_writer(str(path)) as writer:
+        writer.write(pd.DataFrame({"a": [1]}, index=pd.Index(["t1"], name="id")))
+    assert read_export(str(path))["a"].tolist() == [1]
+    assert [child.name for child in tmp_path.iterdir()] == [filename]